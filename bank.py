@@ -0,0 +1,162 @@
+"""
+Bank of mappings and velocity curves selected by MIDI Program Change.
+
+A bank file (.sbbank) lists which mapping (and optionally which velocity curve) each program number
+selects. All of them are loaded and compiled when the bank is loaded, along with everything derived
+from the mapping (auto split), so that switching on a Program Change message is a single reference
+swap on the MIDI callback thread: no file I/O, parsing or recompiling of the input handlers. The input
+handlers read the mapping of each note through `BANK.active`.
+
+Bank file format, one program per line, paths relative to the bank file:
+
+    # program (0-127)  .sbmap file  [.vel file]
+    0   default.sbmap
+    1   22edo.sbmap    euwbah.vel
+
+Blank lines and lines starting with `#` are ignored.
+"""
+import os
+import re
+import time
+from typing import Optional
+
+import configs  # noqa: F401, mapping can only be imported after configs
+from mapping import Mapping, MapParsingError
+from split import SplitData
+from stats import STATS
+from velcurve import VelocityCurves
+
+
+class BankParsingError(Exception):
+    def __init__(self, msg):
+        super().__init__('Error parsing bank. ' + msg)
+
+
+class BankSlot:
+    """
+    A mapping with everything the input handlers derive from it, prebuilt so that it can be switched
+    to by swapping one reference.
+    """
+    __slots__ = ('program', 'mapping', 'vel_curves', 'auto_split')
+
+    def __init__(self, program: int, mapping: Mapping, vel_curves: Optional[VelocityCurves],
+                 auto_split: Optional[SplitData] = None):
+        """
+        :param program: Program number of the slot, -1 for the handlers' own slot of the current CONFIGS
+        :param auto_split: Auto split data of the mapping, built from the mapping if None
+        """
+        self.program = program
+        self.mapping = mapping
+        self.vel_curves = vel_curves
+        """
+        None to use the velocity curves selected with the `vel` command.
+        """
+        self.auto_split = auto_split if auto_split is not None else SplitData(mapping)
+        """
+        Auto split data of the mapping, used if auto split is on.
+        """
+
+
+class MappingBank:
+    def __init__(self):
+        self.file_path: Optional[str] = None
+        self.slots: list[Optional[BankSlot]] = [None] * 128
+        """
+        Bank slot of each program number, None if the program isn't in the bank.
+        """
+        self.active: Optional[BankSlot] = None
+        """
+        Slot of the last selected program, which the input handlers use instead of CONFIGS.MAPPING.
+        None until a program of the bank is selected.
+        """
+
+    def load(self, path: str):
+        """
+        Loads and compiles every mapping and velocity curve of a bank file. The current bank stays
+        in use if the bank file has an error.
+        """
+        directory = os.path.dirname(path)
+        slots: list[Optional[BankSlot]] = [None] * 128
+        mappings: dict[str, Mapping] = {}
+        vel_curves: dict[str, VelocityCurves] = {}
+
+        with open(path, 'r') as f:
+            for linecount, line in enumerate(f, 1):
+                line = line.strip()
+                if len(line) == 0 or line.startswith('#'):
+                    continue
+
+                program, *files = re.split('\\s+', line)
+                if not 1 <= len(files) <= 2:
+                    raise BankParsingError(f'line {linecount}: expected <program> <.sbmap file> [<.vel file>]')
+                try:
+                    program = int(program)
+                    if not 0 <= program <= 127:
+                        raise ValueError
+                except ValueError:
+                    raise BankParsingError(f'line {linecount}: invalid program number (0-127): {program}')
+                if slots[program] is not None:
+                    raise BankParsingError(f'line {linecount}: duplicate program {program}')
+
+                map_path = os.path.join(directory, files[0])
+                if map_path not in mappings:
+                    print(f'bank: loading program {program} mapping {map_path}')
+                    try:
+                        mappings[map_path] = Mapping(map_path)
+                    except MapParsingError as e:
+                        raise BankParsingError(f'line {linecount}: {e}')
+                    except OSError as e:
+                        raise BankParsingError(f"line {linecount}: can't open {map_path}: {e}")
+
+                curves = None
+                if len(files) == 2:
+                    vel_path = os.path.join(directory, files[1])
+                    if vel_path not in vel_curves:
+                        vel_curves[vel_path] = VelocityCurves(vel_path)
+                        if vel_curves[vel_path].key_vel_curves is None:
+                            raise BankParsingError(f'line {linecount}: invalid velocity curve file {vel_path}')
+                    curves = vel_curves[vel_path]
+
+                slots[program] = BankSlot(program, mappings[map_path], curves)
+
+        self.slots = slots
+        # a reloaded bank stays on the same program
+        self.active = slots[self.active.program] if self.active is not None else None
+        self.file_path = path
+        print(f'bank: {sum(slot is not None for slot in slots)} programs loaded from {path}')
+
+    def unload(self):
+        self.active = None
+        self.slots = [None] * 128
+        self.file_path = None
+
+    def select(self, program: int) -> bool:
+        """
+        Switches the input handlers to the mapping/velocity curves of a program. Called on the MIDI
+        callback thread.
+
+        :return: False if the program isn't in the bank
+        """
+        t0 = time.perf_counter_ns()
+        slot = self.slots[program]
+        if slot is None:
+            return False
+
+        self.active = slot
+        if STATS.enabled:
+            STATS.record('bank.switch', time.perf_counter_ns() - t0)
+        return True
+
+    def deselect(self) -> Optional[int]:
+        """
+        Switches the input handlers back to CONFIGS.MAPPING until the next program is selected, e.g.
+        after a mapping was selected with the `map` command.
+
+        :return: The program that was active, or None
+        """
+        slot = self.active
+        self.active = None
+        return slot.program if slot is not None else None
+
+
+BANK = MappingBank()
@@ -0,0 +1,8 @@
+"""
+Micro-benchmarks for the hot paths of the mapper.
+
+Run from the repository root: `python -m benchmarks` runs the whole suite (see `benchmarks/suite.py`),
+`python -m benchmarks.velcurve` compares the compiled velocity stage with the previous implementation,
+`python -m benchmarks.stress_keytracker` stress tests the key tracker's cc74/note on state machine
+from several threads, `python -m benchmarks.importtime` checks the import time budget of `main.py`.
+"""
@@ -0,0 +1,75 @@
+"""
+Import time budget of the startup path.
+
+Imports `main` in a fresh interpreter with `-X importtime` and fails if importing it takes longer
+than the budget, or if it imports any of the modules that are only meant to be loaded when first
+needed (GUI toolkit, websocket server, legacy config reader).
+
+Usage (from the repository root):
+
+    python -m benchmarks.importtime [--budget <ms>] [--repeat <n>]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = 120
+"""
+Max cumulative import time of `main`, in milliseconds (best of `--repeat` runs).
+"""
+
+LAZY_MODULES = ('tkinter', 'dill', 'asyncio', 'websockets', 'janus', 'eventloop')
+"""
+Modules that must not be imported by `import main`.
+"""
+
+_PROBE = f'import main, sys; print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+
+
+def measure_import() -> tuple[float, list[str]]:
+    """
+    :return: (cumulative import time of main in ms, lazy modules that were imported)
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE],
+        cwd=root, capture_output=True, text=True, check=True,
+    )
+    cumulative_us = None
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == 'main':
+            cumulative_us = int(parts[1])
+    if cumulative_us is None:
+        raise RuntimeError(f'could not find the import time of main in:\n{proc.stderr}')
+
+    imported = [m for m in proc.stdout.strip().split(',') if m]
+    return cumulative_us / 1000, imported
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Check the import time budget of main.py.')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'max import time in ms (default: {DEFAULT_BUDGET_MS})')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs, the best one counts')
+    args = parser.parse_args(argv)
+
+    results = [measure_import() for _ in range(args.repeat)]
+    best = min(ms for ms, _ in results)
+    imported = results[0][1]
+
+    print(f'import main: {best:.1f}ms (budget {args.budget:.0f}ms)')
+    failed = False
+    if best > args.budget:
+        print('over budget')
+        failed = True
+    if imported:
+        print(f'imported modules that should be lazily imported: {", ".join(imported)}')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
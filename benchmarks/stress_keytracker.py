@@ -0,0 +1,172 @@
+"""
+Stress test of KeyTracker state transitions under concurrency.
+
+Several threads drive note on, cc74 and note off sequences with random timing, including gaps
+longer than the 20ms cc74 double check so that the scheduler thread's checks interleave with
+them. Then the MPE handler is fed notes with occasionally late cc74 messages, and its output
+is checked for dropped or mis-tuned notes.
+
+Usage (from the repository root):
+
+    python -m benchmarks.stress_keytracker [seconds per phase]
+"""
+import contextlib
+import io
+import random
+import sys
+import threading
+import time
+
+import keytracker
+from keytracker import KeyTracker
+from scheduler import SCHEDULER
+
+NUM_THREADS = 4
+CHANNELS_PER_THREAD = 4
+
+
+def drive_channels(tracker: KeyTracker, channels: list[int], seed: int, duration: float, errors: list[str]):
+    """
+    Plays random notes on the given input channels, checking every transition.
+    """
+    rng = random.Random(seed)
+    deadline = time.monotonic() + duration
+    # last cc74 registered on each channel while no note was on, which is what a
+    # note on that isn't preceded by its own cc74 may pick up within the double check window
+    last_cc74 = {ch: None for ch in channels}
+
+    while time.monotonic() < deadline:
+        ch = rng.choice(channels)
+        note = rng.randrange(0, 128)
+        cc74 = rng.randrange(0, 128)
+        cc74_first = rng.random() < 0.8
+
+        if cc74_first:
+            tracker.register_cc74(ch, cc74)
+            last_cc74[ch] = cc74
+            if rng.random() < 0.1:
+                # let the double check fire before the note on
+                time.sleep(keytracker.CC74_DOUBLE_CHECK_DELAY * 1.5)
+            else:
+                time.sleep(rng.uniform(0, 0.002))
+
+        init74 = tracker.note_on(note, 100, ch)
+        if init74 is None:
+            # note on before cc74: the next cc74 must resolve it
+            resolved = tracker.register_cc74(ch, cc74)
+            if type(resolved) is not keytracker.ChannelWrapper or resolved.midi_note_received != note:
+                errors.append(f'ch {ch}: pending note {note} not resolved by cc74, got {resolved!r}')
+                tracker.register_off(ch)
+                continue
+            init74 = cc74
+        elif init74 != last_cc74[ch]:
+            errors.append(f'ch {ch}: note {note} mis-tuned, initial cc74 {init74} != last cc74 {last_cc74[ch]}')
+
+        tracker.register_on(note, 100, ch, note, ch, 0)
+
+        for _ in range(rng.randrange(0, 5)):
+            slide = tracker.register_cc74(ch, rng.randrange(0, 128))
+            if slide != init74:
+                errors.append(f'ch {ch}: slide on active note returned {slide!r}, expected initial cc74 {init74}')
+            time.sleep(rng.uniform(0, 0.001))
+
+        if tracker.check_existing(ch) is None:
+            errors.append(f'ch {ch}: note {note} not on before note off')
+
+        tracker.register_off(ch)
+
+        if rng.random() < 0.2:
+            # late cc74 of the released note, must not leave the channel resolved for long
+            last_cc74[ch] = rng.randrange(0, 128)
+            tracker.register_cc74(ch, last_cc74[ch])
+
+
+def stress_tracker(duration: float) -> list[str]:
+    tracker = KeyTracker()
+    errors: list[str] = []
+    threads = [
+        threading.Thread(
+            target=drive_channels,
+            args=(tracker, list(range(i * CHANNELS_PER_THREAD, (i + 1) * CHANNELS_PER_THREAD)), i, duration, errors),
+        )
+        for i in range(NUM_THREADS)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # all double checks must have settled every channel back to waiting
+    time.sleep(keytracker.CC74_DOUBLE_CHECK_DELAY * 3)
+    for ch in range(16):
+        state = tracker.get_state(ch)
+        if state != keytracker.WAITING:
+            errors.append(f'ch {ch}: stuck in state {state} after all notes were released')
+
+    return errors
+
+
+def stress_handler(duration: float) -> list[str]:
+    """
+    Plays notes through the handler in real time, with their cc74 message occasionally arriving
+    after the note on, and checks that every note was sent with the pitch bend of its cc74.
+    """
+    import configs
+    from benchmarks.suite import load_default_mapping
+    from configs import CONFIGS, SlideMode
+    from handler import MidiInputHandler
+    from replay import MemoryOutPort
+
+    load_default_mapping()
+    CONFIGS.MPE_MODE = True
+    CONFIGS.SLIDE_MODE = SlideMode.RELATIVE
+    configs.configs_changed()
+
+    out_port = MemoryOutPort()
+    handler = MidiInputHandler(out_port)
+    rng = random.Random(0)
+    deadline = time.monotonic() + duration
+    errors = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        i = 0
+        while time.monotonic() < deadline:
+            ch = 1 + i % 15
+            i += 1
+            note = rng.randrange(48, 97)
+            cc74 = rng.randrange(0, 128)
+            late = rng.random() < 0.2
+            if not late:
+                handler(([0xB0 | ch, 74, cc74], 0.0))
+            handler(([0x90 | ch, note, 100], 0.0))
+            if late:
+                handler(([0xB0 | ch, 74, cc74], 0.0))
+            time.sleep(rng.uniform(0, 0.03))
+            handler(([0xD0 | ch, 64], 0.0))
+            handler(([0x80 | ch, note, 0], 0.0))
+
+            sent_pb = [m for _, m in out_port.messages if m[0] == 0xE0 | ch]
+            sent_on = [m for _, m in out_port.messages if m[0] == 0x90 | ch]
+            if not sent_on or sent_on[-1][1] != note:
+                errors.append(f'ch {ch}: note {note} was never sent')
+            elif sent_pb[-1][1:] != CONFIGS.MAPPING.calc_raw_pitchbend(note, cc74):
+                errors.append(f'ch {ch}: note {note} mis-tuned for cc74 {cc74}')
+            out_port.clear()
+
+    return errors
+
+
+def main(duration=2.0):
+    duration = float(duration)
+    failed = False
+    for name, stress in (('tracker', stress_tracker), ('handler', stress_handler)):
+        errors = stress(duration)
+        print(f'{name}: {"ok" if not errors else f"{len(errors)} errors"} (scheduler queue depth {SCHEDULER.queue_depth()})')
+        for e in errors[:20]:
+            print(f'    {e}')
+        failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,384 @@
+"""
+Micro-benchmark suite covering the hot paths of the mapper.
+
+Results are written as JSON and compared against a stored baseline, failing if any benchmark
+regressed by more than the threshold.
+
+Usage (from the repository root):
+
+    python -m benchmarks                    # run all, compare against benchmarks/baseline.json
+    python -m benchmarks --save-baseline    # run all, store the results as the new baseline
+    python -m benchmarks -k handler         # only run benchmarks whose name contains 'handler'
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Callable
+
+import configs
+import convert
+from configs import CONFIGS, SlideMode
+from log import LOG, WARNING
+from mapping import Mapping
+from split import SplitData
+from velcurve import VelocityCurves
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results.json')
+DEFAULT_THRESHOLD = 0.25
+"""
+Max allowed slowdown relative to the baseline (0.25 = 25% slower) before a benchmark counts as
+regressed.
+"""
+HANDLER_THRESHOLD = 0.5
+"""
+Max allowed slowdown of the end-to-end `handler.*` benchmarks. Each of them runs a whole performance
+through the handler, output stage and key tracker (locks, scheduler), and varies more between runs
+than the micro-benchmarks.
+"""
+DEFAULT_RUNS = 5
+"""
+Number of rounds over all benchmarks. The median result of each benchmark is compared, so that a busy
+period of the machine during one or two rounds doesn't count as a regression.
+"""
+CONFIRM_RUNS = 2
+"""
+Number of times benchmarks that regressed are measured again (another `--runs` rounds each) before
+failing. The machine may be busy for a whole run, so only a regression that persists counts.
+"""
+
+BENCHMARKS: dict[str, Callable[[], tuple[Callable[[], object], int]]] = {}
+"""
+Benchmark name -> setup function. The setup function returns (function to time, number of
+operations per call), so that results are reported per operation.
+"""
+
+
+def benchmark(name: str):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Swallow console output (e.g. mapping descriptions, debug warnings) while benchmarking. Handler
+    log messages aren't even recorded, so that the log writer thread doesn't run during the timed loops.
+    """
+    level = LOG.level
+    LOG.level = WARNING + 1
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        LOG.level = level
+
+
+def make_performance(seed=0, num_notes=500) -> list[tuple[list[int], float]]:
+    """
+    A deterministic synthetic Seaboard MPE performance as rtmidi (message, deltatime) events:
+    for each note, cc74 -> note on -> a stream of pressure/pitch bend/slide -> note off,
+    on round-robin member channels 2-16.
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(num_notes):
+        ch = 1 + i % 15
+        note = rng.randrange(48, 97)
+        events.append(([0xB0 | ch, 74, rng.randrange(0, 128)], 0.0005))
+        events.append(([0x90 | ch, note, rng.randrange(1, 128)], 0.0005))
+        for _ in range(8):
+            events.append(([0xD0 | ch, rng.randrange(0, 128)], 0.002))
+            events.append(([0xE0 | ch, rng.randrange(0, 128), rng.randrange(60, 68)], 0.0))
+            events.append(([0xB0 | ch, 74, rng.randrange(0, 128)], 0.0))
+        events.append(([0x80 | ch, note, 0], 0.001))
+    return events
+
+
+def load_default_mapping():
+    if not hasattr(CONFIGS, 'MAPPING'):
+        with quiet():
+            CONFIGS.MAPPING = Mapping('mappings/default.sbmap')
+    return CONFIGS.MAPPING
+
+
+@benchmark('mapping.load_mapping.default')
+def bench_load_default():
+    m = load_default_mapping()
+
+    def run():
+        with quiet():
+            m.load_mapping('mappings/default.sbmap')
+    return run, 1
+
+
+@benchmark('mapping.load_mapping.22edo')
+def bench_load_22edo():
+    m = load_default_mapping()
+
+    def run():
+        with quiet():
+            m.load_mapping('mappings/22edo.sbmap')
+
+    def run_and_restore():
+        run()
+        with quiet():
+            m.load_mapping('mappings/default.sbmap')
+
+    # make sure the default mapping is restored for the following benchmarks
+    run_and_restore()
+    return run_and_restore, 2
+
+
+@benchmark('mapping.load_mapping.default.parse')
+def bench_parse_default():
+    m = load_default_mapping()
+
+    def run():
+        with quiet():
+            m.load_mapping('mappings/default.sbmap', use_cache=False)
+    return run, 1
+
+
+@benchmark('mapping.calc_pitchbend')
+def bench_calc_pitchbend():
+    m = load_default_mapping()
+    calc_pitchbend = m.calc_pitchbend
+    inputs = [(n, c) for n in range(128) for c in range(128)]
+
+    def run():
+        for n, c in inputs:
+            calc_pitchbend(n, c)
+    return run, len(inputs)
+
+
+@benchmark('mapping.calc_notes_from_a4')
+def bench_calc_notes_from_a4():
+    m = load_default_mapping()
+    calc_notes_from_a4 = m.calc_notes_from_a4
+    inputs = [(n, c) for n in range(128) for c in range(128)]
+
+    def run():
+        for n, c in inputs:
+            calc_notes_from_a4(n, c)
+    return run, len(inputs)
+
+
+@benchmark('velcurve.get_velocity')
+def bench_get_velocity():
+    from benchmarks.velcurve import OCTAVE_OFFSET, make_events
+    with quiet():
+        curves = VelocityCurves('mappings/euwbah.vel')
+    get_velocity = curves.get_velocity
+    events = make_events()
+
+    def run():
+        for note, vel, cc74, _ in events:
+            get_velocity(note, vel, OCTAVE_OFFSET, cc74)
+    return run, len(events)
+
+
+@benchmark('convert.to_relative_slide_output')
+def bench_relative_slide():
+    inputs = [(a, i) for a in range(128) for i in range(128)]
+    f = convert.to_relative_slide_output
+
+    def run():
+        for a, i in inputs:
+            f(a, i)
+    return run, len(inputs)
+
+
+@benchmark('convert.to_bipolar_slide_output')
+def bench_bipolar_slide():
+    inputs = [(a, i) for a in range(128) for i in range(128)]
+    f = convert.to_bipolar_slide_output
+
+    def run():
+        for a, i in inputs:
+            f(a, i)
+    return run, len(inputs)
+
+
+@benchmark('split.get_split_range.autosplit')
+def bench_auto_split_range():
+    splits = SplitData(load_default_mapping())
+    get_split_range = splits.get_split_range
+
+    def run():
+        for n in range(128):
+            get_split_range(n)
+    return run, 128
+
+
+def make_handler_benchmark(mpe_mode: bool, slide_mode: SlideMode):
+    def setup():
+        # imported here, so that the rest of the suite doesn't pay for importing the handler
+        from handler import MidiInputHandler
+        from replay import MemoryOutPort
+
+        load_default_mapping()
+        CONFIGS.MPE_MODE = mpe_mode
+        CONFIGS.SLIDE_MODE = slide_mode
+        CONFIGS.AUTO_SPLIT = None
+        configs.configs_changed()
+
+        out_port = MemoryOutPort()
+        handler = MidiInputHandler(out_port)
+        # the settings don't change while benchmarking, stop the handler from recompiling for the
+        # settings of the benchmarks that are set up after this one
+        handler.close()
+        events = make_performance()
+
+        def run():
+            with quiet():
+                for event in events:
+                    handler(event)
+            out_port.clear()
+        return run, len(events)
+    return setup
+
+
+for _mpe_mode in (True, False):
+    for _slide_mode in SlideMode:
+        benchmark(f'handler.{"mpe" if _mpe_mode else "midi"}.{_slide_mode.name.lower()}')(
+            make_handler_benchmark(_mpe_mode, _slide_mode)
+        )
+
+
+def measure(setup, min_time=0.2, repeat=5) -> dict:
+    """
+    :return: Best time per operation in nanoseconds over `repeat` runs, each running for at least `min_time` seconds
+    """
+    run, ops = setup()
+    run()  # warm up
+
+    # calibrate number of calls per run
+    number = 1
+    while True:
+        t0 = time.perf_counter_ns()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter_ns() - t0
+        if elapsed >= min_time * 1e9 or number >= 1 << 16:
+            break
+        number *= 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter_ns()
+        for _ in range(number):
+            run()
+        best = min(best, time.perf_counter_ns() - t0)
+
+    return {'ns_per_op': best / (number * ops), 'ops': ops * number}
+
+
+def run_rounds(names: list[str], runs: int) -> dict:
+    """
+    :return: Median result of each benchmark over `runs` rounds over all of them
+    """
+    rounds: dict[str, list[dict]] = {name: [] for name in names}
+    for _ in range(runs):
+        for name in names:
+            rounds[name].append(measure(BENCHMARKS[name], min_time=0.1, repeat=3))
+    return {
+        name: {
+            'ns_per_op': statistics.median(r['ns_per_op'] for r in results_of_rounds),
+            'ops': results_of_rounds[0]['ops'],
+            'rounds': [r['ns_per_op'] for r in results_of_rounds],
+        }
+        for name, results_of_rounds in rounds.items()
+    }
+
+
+def threshold_of(name: str, threshold: float) -> float:
+    return max(threshold, HANDLER_THRESHOLD) if name.startswith('handler.') else threshold
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    :return: Names of benchmarks that regressed by more than `threshold` (see `threshold_of`) relative
+             to the baseline.
+    """
+    regressed = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f'{name:<45} {result["ns_per_op"]:>10.1f} ns/op   (no baseline)')
+            continue
+        base = baseline[name]['ns_per_op']
+        ratio = result['ns_per_op'] / base
+        flag = ''
+        if ratio > 1 + threshold_of(name, threshold):
+            regressed.append(name)
+            flag = '  REGRESSED'
+        print(f'{name:<45} {result["ns_per_op"]:>10.1f} ns/op   baseline {base:>10.1f}   {ratio:5.2f}x{flag}')
+    return regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run the mapper micro-benchmark suite.')
+    parser.add_argument('-k', default='', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--output', default=RESULTS_PATH, help='where to write the JSON results')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'allowed slowdown before failing (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                        help=f'rounds over all benchmarks, comparing the median result (default: {DEFAULT_RUNS})')
+    args = parser.parse_args(argv)
+
+    results = run_rounds([name for name in BENCHMARKS if args.k in name], args.runs)
+
+    document = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f'saved baseline to {args.baseline}')
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline_document = json.load(f)
+        baseline = baseline_document['results']
+        # timings of different interpreter versions aren't comparable
+        baseline_python = baseline_document.get('python', '')
+        if baseline_python.split('.')[:2] != platform.python_version().split('.')[:2]:
+            print(f'warning: baseline was recorded with Python {baseline_python}, running Python '
+                  f'{platform.python_version()}. Regenerate it with --save-baseline.')
+
+    regressed = compare(results, baseline, args.threshold)
+    for _ in range(CONFIRM_RUNS):
+        if not regressed:
+            break
+        print(f'measuring {len(regressed)} regressed benchmark(s) again...')
+        results.update(run_rounds(regressed, args.runs))
+        regressed = compare({name: results[name] for name in regressed}, baseline, args.threshold)
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if regressed:
+        print(f'{len(regressed)} benchmark(s) regressed by more than {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Compares the compiled velocity stage (curve index/curve table lookup + smoothing table lookup)
+against the previous implementation (linear scan over the key's cc74 partitions + float pow).
+
+Usage (from the repository root):
+
+    python -m benchmarks.velcurve [path to .vel file]
+"""
+
+import random
+import sys
+import timeit
+
+from configs import CONFIGS
+from smoothing import get_smoothing_table
+from velcurve import VelocityCurves
+
+OCTAVE_OFFSET = 4
+NUM_EVENTS = 10000
+
+
+def legacy_get_velocity(curves: VelocityCurves, midi_note, velocity, octave_offset, cc74):
+    """
+    The pre-compilation implementation of `VelocityCurves.get_velocity`.
+    """
+    if curves.key_vel_curves is None:
+        return velocity
+
+    physical_key_idx = midi_note - 12 * octave_offset
+
+    if physical_key_idx < 0 or physical_key_idx > 48:
+        return velocity
+
+    curve_index = 0
+    for cc74_bound, idx in curves.key_vel_curves[physical_key_idx]:
+        if cc74 <= cc74_bound:
+            curve_index = idx
+            break
+
+    return curves.vel_curves[curve_index][velocity]
+
+
+def legacy_smooth(scaled_vel, aftertouch_ma):
+    """
+    The pre-compilation implementation of velocity smoothing in `MidiInputHandler`.
+    """
+    scaled_vel = round(
+        ((scaled_vel / 127) ** (CONFIGS.SMOOTHING_BIAS + CONFIGS.SMOOTHING_EFFECT
+                                - 2 * CONFIGS.SMOOTHING_EFFECT * (aftertouch_ma / 127)))
+        * 127
+    )
+    if scaled_vel < 1:
+        scaled_vel = 1
+    if scaled_vel > 127:
+        scaled_vel = 127
+    return scaled_vel
+
+
+def make_events(n=NUM_EVENTS, seed=0):
+    """
+    Random (midi note, velocity, cc74, aftertouch moving average) note on events within
+    the physical range of a Rise 49.
+    """
+    rng = random.Random(seed)
+    lowest = 12 * OCTAVE_OFFSET
+    return [
+        (rng.randrange(lowest, lowest + 49), rng.randrange(1, 128), rng.randrange(0, 128), rng.uniform(0, 127))
+        for _ in range(n)
+    ]
+
+
+def run_legacy(curves, events):
+    for note, vel, cc74, ma in events:
+        legacy_smooth(legacy_get_velocity(curves, note, vel, OCTAVE_OFFSET, cc74), ma)
+
+
+def run_compiled(curves, events):
+    get_velocity = curves.get_velocity
+    smoothing_table = get_smoothing_table(CONFIGS.SMOOTHING_EFFECT, CONFIGS.SMOOTHING_BIAS)
+    for note, vel, cc74, ma in events:
+        smoothing_table[int(ma + 0.5) << 7 | get_velocity(note, vel, OCTAVE_OFFSET, cc74)]
+
+
+def bench(fn, *args, repeat=5, number=10) -> float:
+    """
+    :return: best time per call of `fn(*args)` in seconds
+    """
+    return min(timeit.repeat(lambda: fn(*args), repeat=repeat, number=number)) / number
+
+
+def main(vel_path='mappings/euwbah.vel'):
+    curves = VelocityCurves(vel_path)
+    events = make_events()
+
+    # sanity check: curve lookups must match exactly. Smoothing differs only by the
+    # quantization of the moving average.
+    for note, vel, cc74, ma in events:
+        assert curves.get_velocity(note, vel, OCTAVE_OFFSET, cc74) == legacy_get_velocity(
+            curves, note, vel, OCTAVE_OFFSET, cc74
+        )
+
+    legacy = bench(run_legacy, curves, events)
+    compiled = bench(run_compiled, curves, events)
+
+    print(f'{len(events)} note ons using {vel_path}:')
+    print(f'  legacy:   {legacy * 1e9 / len(events):8.1f} ns/note')
+    print(f'  compiled: {compiled * 1e9 / len(events):8.1f} ns/note')
+    print(f'  speedup:  {legacy / compiled:8.2f}x')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -1,12 +1,24 @@
+import json
 import os
+import traceback
 from enum import Enum
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
-import dill
-
-from mapping import Mapping
+import mapping
+from mapping import Mapping, MapParsingError
 from split import SplitData
 from velcurve import VelocityCurves
+from voices import VoiceAllocation
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+CONFIG_FILE = 'config.json'
+LEGACY_CONFIG_FILE = 'config.dill'
+CONFIG_VERSION = 2
+"""
+Version of the config file format. Bump when the format changes, and convert older versions in `read_configs`.
+"""
 
 
 class SlideMode(Enum):
@@ -32,6 +44,12 @@ class CONFIGS:
     This is useful for Pianoteq which allows multi-channel mode where channel N+1 is pitched
     one octave higher than channel N. (useful for very large edos)
     '''
+    VOICES_PER_SPLIT: int = 1
+    """
+    Number of output channels each split region can use in MIDI mode, so that each note gets its own channel
+    and pitch bends don't affect the other notes of the region. Limited to 16 channels in total.
+    """
+    VOICE_ALLOCATION: VoiceAllocation = VoiceAllocation.LRU
     PITCH_BEND_RANGE: int = 24
     MAPPING: Mapping
     TOGGLE_SUSTAIN: bool = False
@@ -42,56 +60,302 @@ class CONFIGS:
 
     Turning this on attempts to reduce the effect of inaccurate velocity sensing on certain areas of the seaboard.
     """
+    SMOOTHING_ALPHA: float = 0.04
+    """
+    When doing velocity smoothing by aftertouch exponential moving average, this is the alpha rate of
+    change.
+    """
+    SMOOTHING_EFFECT: float = 0.4
+    """
+    How much after touch affects velocity curve steepness. This number is the max increase/decrease of
+    the exponent applied to the velocity curve normalized to 0-1, relative to `SMOOTHING_BIAS`.
+    """
+    SMOOTHING_BIAS: float = 1.0
+    """
+    What exponent to apply to the velocity curve when aftertouch is at mid point (64).
+
+    1.0 is no change.
+    """
+    OUTPUT_FILTER: bool = True
+    """
+    If true, drop output cc, pitch bend and channel pressure messages that don't change the last value sent
+    (see `filters.py`). Note on/off and the first message after a note on always pass.
+    """
+    FILTER_MIN_CC_CHANGE: int = 1
+    """
+    Minimum change of a cc/channel pressure value for it to be sent. 1 only drops exact duplicates.
+    """
+    FILTER_MIN_PB_CHANGE: int = 1
+    """
+    Minimum change of a pitch bend value (0-16383) for it to be sent. 1 only drops exact duplicates.
+    """
+    FILTER_MAX_RATE: float = 0
+    """
+    Max messages per second of each (channel, cc/pitch bend/channel pressure) sent, 0 for no limit.
+    """
+    INPUT_DECIMATION: bool = False
+    """
+    If true, incoming channel pressure, slide (cc74 of sounding notes) and pitch bend messages are dropped before
+    they are handled when they change less than the DECIMATE_* thresholds or come faster than DECIMATE_MAX_RATE.
+    """
+    DECIMATE_MIN_CC_CHANGE: int = 1
+    DECIMATE_MIN_PB_CHANGE: int = 1
+    DECIMATE_MAX_RATE: float = 250
+    """
+    Max incoming messages per second of each (channel, pressure/slide/pitch bend) that are handled, 0 for no limit.
+    """
+    BANK_FILE: Optional[str] = None
+    """
+    .sbbank file of mappings selected by Program Change messages (see `bank.py`), loaded on startup.
+    """
+    JOURNAL: bool = True
+    """
+    Record every input/output message in the journal file, see `journal.py`.
+    """
     DEBUG: bool = False
 
 
+_listeners: list[Callable[[], None]] = []
+
+
+def add_listener(listener: Callable[[], None]):
+    """
+    Register a function to be called after CONFIGS are changed, e.g. to recompile
+    anything that was specialised for the previous CONFIGS.
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[], None]):
+    """
+    Unregister a function registered with `add_listener`. Does nothing if it isn't registered.
+    """
+    try:
+        _listeners.remove(listener)
+    except ValueError:
+        pass
+
+
+# mappings are compiled for the pitch bend range before anything else is recompiled
+add_listener(mapping.recompile_pitchbend_tables)
+
+
+def configs_changed():
+    """
+    Must be called after modifying CONFIGS so that listeners pick up the changes.
+    """
+    for listener in _listeners:
+        listener()
+
+
 def read_configs() -> bool:
     """
-    Read saved CONFIG state.
-    :return: True if successfully read a config file from 'config.dill'
+    Read saved CONFIG state. If there is no config.json but a config.dill saved by an older
+    version, it is converted to config.json.
+
+    :return: True if successfully read the saved configs, including the saved mapping
     """
-    if not os.path.isfile('config.dill'):
-        return False
+    if not os.path.isfile(CONFIG_FILE):
+        return _migrate_legacy_configs()
 
-    print('loading saved configurations from config.dill')
+    print(f'loading saved configurations from {CONFIG_FILE}')
 
     try:
-        with open('config.dill', 'rb') as f:
-            c: dict = dill.load(f)
-            CONFIGS.MPE_MODE = c['MPE_MODE']
-            CONFIGS.SLIDE_MODE = c['SLIDE_MODE']
-            CONFIGS.SLIDE_FIXED_N = c['SLIDE_FIXED_N']
-            CONFIGS.SPLITS = c['SPLITS']
-            CONFIGS.AUTO_SPLIT = c['AUTO_SPLIT']
-            CONFIGS.PITCH_BEND_RANGE = c['PITCH_BEND_RANGE']
-            CONFIGS.MAPPING = c['MAPPING']
-            CONFIGS.TOGGLE_SUSTAIN = c['TOGGLE_SUSTAIN']
-            CONFIGS.VELOCITY_CURVES = c['VELOCITY_CURVES']
-            CONFIGS.DEBUG = c['DEBUG']
-            CONFIGS.VELOCITY_SMOOTHING = c.get('VELOCITY_SMOOTHING', True)
+        with open(CONFIG_FILE, 'r') as f:
+            c: dict = json.load(f)
+
+        if c.get('version', 0) > CONFIG_VERSION:
+            print(f'{CONFIG_FILE} was saved by a newer version of the mapper, ignoring it.')
+            return False
+
+        # everything is resolved before CONFIGS are touched, so that a missing file or invalid
+        # value doesn't leave half of the saved settings applied
+        splits = SplitData()
+        for midinum, offset in c['SPLITS']:
+            splits.add_split(midinum, offset)
+        values = {
+            'MPE_MODE': c['MPE_MODE'],
+            'SLIDE_MODE': SlideMode[c['SLIDE_MODE']],
+            'SLIDE_FIXED_N': c['SLIDE_FIXED_N'],
+            'SPLITS': splits,
+            'PITCH_BEND_RANGE': c['PITCH_BEND_RANGE'],
+            'TOGGLE_SUSTAIN': c['TOGGLE_SUSTAIN'],
+            'VELOCITY_SMOOTHING': c['VELOCITY_SMOOTHING'],
+            'DEBUG': c['DEBUG'],
+            # added in version 2
+            'VOICES_PER_SPLIT': c.get('VOICES_PER_SPLIT', 1),
+            'VOICE_ALLOCATION': VoiceAllocation[c.get('VOICE_ALLOCATION', VoiceAllocation.LRU.name)],
+            'OUTPUT_FILTER': c.get('OUTPUT_FILTER', True),
+            'FILTER_MIN_CC_CHANGE': c.get('FILTER_MIN_CC_CHANGE', 1),
+            'FILTER_MIN_PB_CHANGE': c.get('FILTER_MIN_PB_CHANGE', 1),
+            'FILTER_MAX_RATE': c.get('FILTER_MAX_RATE', 0),
+            'INPUT_DECIMATION': c.get('INPUT_DECIMATION', False),
+            'BANK_FILE': c.get('BANK_FILE'),
+            'SMOOTHING_ALPHA': c.get('SMOOTHING_ALPHA', 0.04),
+            'SMOOTHING_EFFECT': c.get('SMOOTHING_EFFECT', 0.4),
+            'SMOOTHING_BIAS': c.get('SMOOTHING_BIAS', 1.0),
+            'JOURNAL': c.get('JOURNAL', True),
+            'DECIMATE_MIN_CC_CHANGE': c.get('DECIMATE_MIN_CC_CHANGE', 1),
+            'DECIMATE_MIN_PB_CHANGE': c.get('DECIMATE_MIN_PB_CHANGE', 1),
+            'DECIMATE_MAX_RATE': c.get('DECIMATE_MAX_RATE', 250),
+        }
 
+        if values['SMOOTHING_EFFECT'] > values['SMOOTHING_BIAS']:
+            print(f'ignoring the saved velocity smoothing effect ({values["SMOOTHING_EFFECT"]:g}), it can\'t be '
+                  f'larger than the bias ({values["SMOOTHING_BIAS"]:g}).')
+            del values['SMOOTHING_EFFECT'], values['SMOOTHING_BIAS']
+
+        vel = c['VELOCITY_CURVES']
+        if vel is not None and _check_file(vel):
+            values['VELOCITY_CURVES'] = VelocityCurves(vel['path'])
+
+        if c['MAPPING'] is None or not _check_file(c['MAPPING']):
+            return False
+        # compiled for the saved pitch bend range by `configs_changed` below
+        values['MAPPING'] = Mapping(c['MAPPING']['path'])
+        values['AUTO_SPLIT'] = SplitData(values['MAPPING']) if c['AUTO_SPLIT'] else None
+    except MapParsingError as e:
+        print(e)
+        return False
     except Exception:
-        print('failed to load saved configurations. Delete config.dill.')
+        print(f'failed to load saved configurations. Delete {CONFIG_FILE}.')
+        if CONFIGS.DEBUG:
+            traceback.print_exc()
         return False
 
+    for name, value in values.items():
+        setattr(CONFIGS, name, value)
+    configs_changed()
+    return True
+
+
+def _check_file(ref: dict) -> bool:
+    """
+    :param ref: A saved file reference {'path': ..., 'sha256': ...}
+    :return: False if the file no longer exists.
+    """
+    path = ref['path']
+    if not os.path.isfile(path):
+        print(f'{path} no longer exists.')
+        return False
+    if mapping.file_sha256(path).hex() != ref['sha256']:
+        print(f'note: {path} has changed since the settings were saved.')
     return True
 
 
-def save_configs():
-    print('saving settings into config.dill')
-
-    with open('config.dill', 'wb') as f:
-        c = {
-            'MPE_MODE': CONFIGS.MPE_MODE,
-            'SLIDE_MODE': CONFIGS.SLIDE_MODE,
-            'SLIDE_FIXED_N': CONFIGS.SLIDE_FIXED_N,
-            'SPLITS': CONFIGS.SPLITS,
-            'AUTO_SPLIT': CONFIGS.AUTO_SPLIT,
-            'PITCH_BEND_RANGE': CONFIGS.PITCH_BEND_RANGE,
-            'MAPPING': CONFIGS.MAPPING,
-            'TOGGLE_SUSTAIN': CONFIGS.TOGGLE_SUSTAIN,
-            'VELOCITY_CURVES': CONFIGS.VELOCITY_CURVES,
-            'VELOCITY_SMOOTHING': CONFIGS.VELOCITY_SMOOTHING,
-            'DEBUG': CONFIGS.DEBUG
+def _migrate_legacy_configs() -> bool:
+    """
+    Reads a config.dill saved by an older version, and saves it as config.json.
+    """
+    if not os.path.isfile(LEGACY_CONFIG_FILE):
+        return False
+
+    print(f'converting saved configurations from {LEGACY_CONFIG_FILE} to {CONFIG_FILE}')
+
+    try:
+        # only imported to read old configs
+        import dill
+
+        with open(LEGACY_CONFIG_FILE, 'rb') as f:
+            c: dict = dill.load(f)
+        values = {
+            'MPE_MODE': c['MPE_MODE'],
+            'SLIDE_MODE': c['SLIDE_MODE'],
+            'SLIDE_FIXED_N': c['SLIDE_FIXED_N'],
+            'SPLITS': c['SPLITS'],
+            'AUTO_SPLIT': c['AUTO_SPLIT'],
+            'PITCH_BEND_RANGE': c['PITCH_BEND_RANGE'],
+            'MAPPING': c['MAPPING'],
+            'TOGGLE_SUSTAIN': c['TOGGLE_SUSTAIN'],
+            'VELOCITY_CURVES': c['VELOCITY_CURVES'],
+            'DEBUG': c['DEBUG'],
+            'VELOCITY_SMOOTHING': c.get('VELOCITY_SMOOTHING', True),
         }
-        dill.dump(c, f)
+    except Exception:
+        print(f'failed to load saved configurations. Delete {LEGACY_CONFIG_FILE}.')
+        return False
+
+    # old versions didn't keep the path of loaded files, assume they were in mappings/
+    for obj, name in ((values['MAPPING'], values['MAPPING'].mapping_file_name),
+                      (values['VELOCITY_CURVES'], values['VELOCITY_CURVES'].file_name)):
+        if getattr(obj, 'file_path', None) is None:
+            path = os.path.join('mappings', name)
+            obj.file_path = path if os.path.isfile(path) else None
+
+    for name, value in values.items():
+        setattr(CONFIGS, name, value)
+    configs_changed()
+    save_configs()
+    return True
+
+
+_save_executor: Optional['ThreadPoolExecutor'] = None
+
+
+def _file_ref(path: Optional[str]) -> Optional[dict]:
+    if path is None:
+        return None
+    return {'path': path, 'sha256': mapping.file_sha256(path).hex()}
+
+
+def _write_configs(c: dict):
+    try:
+        c['MAPPING'] = _file_ref(c['MAPPING'])
+        c['VELOCITY_CURVES'] = _file_ref(c['VELOCITY_CURVES'])
+
+        # write to a temporary file first, so that a crash mid-save never leaves a truncated config
+        tmp_path = f'{CONFIG_FILE}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(c, f, indent=2)
+        os.replace(tmp_path, CONFIG_FILE)
+    except Exception:
+        print(f'failed to save settings into {CONFIG_FILE}:')
+        traceback.print_exc()
+
+
+def save_configs() -> 'Future':
+    """
+    Saves the current CONFIGS. The settings are captured immediately, the file is written on a
+    background thread.
+
+    :return: Future that completes when the file is written.
+    """
+    global _save_executor
+    print(f'saving settings into {CONFIG_FILE}')
+
+    c = {
+        'version': CONFIG_VERSION,
+        'MPE_MODE': CONFIGS.MPE_MODE,
+        'SLIDE_MODE': CONFIGS.SLIDE_MODE.name,
+        'SLIDE_FIXED_N': CONFIGS.SLIDE_FIXED_N,
+        'SPLITS': CONFIGS.SPLITS.get_splits(),
+        'AUTO_SPLIT': CONFIGS.AUTO_SPLIT is not None,
+        'VOICES_PER_SPLIT': CONFIGS.VOICES_PER_SPLIT,
+        'VOICE_ALLOCATION': CONFIGS.VOICE_ALLOCATION.name,
+        'PITCH_BEND_RANGE': CONFIGS.PITCH_BEND_RANGE,
+        # file paths are replaced with {'path', 'sha256'} references on the save thread
+        'MAPPING': getattr(CONFIGS, 'MAPPING', None) and CONFIGS.MAPPING.file_path,
+        'TOGGLE_SUSTAIN': CONFIGS.TOGGLE_SUSTAIN,
+        'VELOCITY_CURVES': CONFIGS.VELOCITY_CURVES.file_path,
+        'VELOCITY_SMOOTHING': CONFIGS.VELOCITY_SMOOTHING,
+        'OUTPUT_FILTER': CONFIGS.OUTPUT_FILTER,
+        'FILTER_MIN_CC_CHANGE': CONFIGS.FILTER_MIN_CC_CHANGE,
+        'FILTER_MIN_PB_CHANGE': CONFIGS.FILTER_MIN_PB_CHANGE,
+        'FILTER_MAX_RATE': CONFIGS.FILTER_MAX_RATE,
+        'INPUT_DECIMATION': CONFIGS.INPUT_DECIMATION,
+        'BANK_FILE': CONFIGS.BANK_FILE,
+        'SMOOTHING_ALPHA': CONFIGS.SMOOTHING_ALPHA,
+        'SMOOTHING_EFFECT': CONFIGS.SMOOTHING_EFFECT,
+        'SMOOTHING_BIAS': CONFIGS.SMOOTHING_BIAS,
+        'JOURNAL': CONFIGS.JOURNAL,
+        'DECIMATE_MIN_CC_CHANGE': CONFIGS.DECIMATE_MIN_CC_CHANGE,
+        'DECIMATE_MIN_PB_CHANGE': CONFIGS.DECIMATE_MIN_PB_CHANGE,
+        'DECIMATE_MAX_RATE': CONFIGS.DECIMATE_MAX_RATE,
+        'DEBUG': CONFIGS.DEBUG,
+    }
+
+    if _save_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        # a single worker, so that saves are written in order
+        _save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='save-configs')
+    return _save_executor.submit(_write_configs, c)
@@ -0,0 +1,85 @@
+"""
+Optional single asyncio event loop architecture (`main.py --asyncio`).
+
+Incoming MIDI messages are handed from the rtmidi callback thread to one event loop, which also
+runs the websocket server, deferred actions (see `Scheduler.use_loop`) and REPL commands. There
+is no janus queue between the MIDI handler and the websocket server, and every message is handled
+in the order it was received on one thread.
+
+Commands that prompt for input (file dialogs, split points, pitch bend range) still run on the
+main thread, as tkinter can only be used from the thread that created the Tk root.
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+import ws_server
+from scheduler import SCHEDULER
+from stats import STATS
+
+LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+class MidiForwarder:
+    """
+    rtmidi callback that hands each event over to the event loop.
+
+    While latency stats are enabled, the time each event waited between the rtmidi callback and
+    being handled on the loop is recorded under the 'loop.wait' branch.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, handler: Callable):
+        self.loop = loop
+        self.handler = handler
+
+    def __call__(self, event, data=None):
+        self.loop.call_soon_threadsafe(self.handle, event, time.perf_counter_ns())
+
+    def handle(self, event, received_ns: int):
+        if STATS.enabled:
+            STATS.record('loop.wait', time.perf_counter_ns() - received_ns)
+        self.handler(event)
+
+
+def start(inputs: list[tuple[object, Callable]]) -> asyncio.AbstractEventLoop:
+    """
+    Starts the event loop on its own thread, with the websocket server running on it,
+    and forwards all messages received by each input port to its handler on the loop.
+
+    :param inputs: (rtmidi MidiIn port, `MidiInputHandler`) of each input device
+    """
+    global LOOP
+    LOOP = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(LOOP)
+        SCHEDULER.use_loop(LOOP)
+        LOOP.create_task(ws_server.serve(use_intake=False))
+        LOOP.call_soon(started.set)
+        LOOP.run_forever()
+
+    print('starting websocket server at 127.0.0.1:8765')
+    threading.Thread(target=run, name='event-loop', daemon=True).start()
+    started.wait()
+
+    for midi_in, handler in inputs:
+        midi_in.set_callback(MidiForwarder(LOOP, handler))
+    return LOOP
+
+
+def call(fn: Callable, *args):
+    """
+    Runs `fn(*args)` on the event loop and waits for it to finish.
+
+    :return: The return value of `fn`
+    """
+    async def run():
+        return fn(*args)
+
+    return asyncio.run_coroutine_threadsafe(run(), LOOP).result()
+
+
+def stop():
+    if LOOP is not None:
+        LOOP.call_soon_threadsafe(LOOP.stop)
@@ -0,0 +1,205 @@
+"""
+Suppression of redundant continuous controller messages.
+
+The Seaboard streams pitch bend, cc74 and channel pressure at a high rate, and many of those
+messages repeat the value that was last sent. `ChangeFilter` remembers the last value passed for
+each (channel, message type, controller) and drops messages that don't change it by at least a
+minimum amount, or that come faster than a maximum rate.
+
+Note on and note off messages always pass, and a note on forgets the last values of its channel,
+so the first message of each kind after a note on always passes.
+
+A message dropped by the max rate isn't lost: the latest one of each (channel, message type,
+controller) is passed on once the rate allows it (see `on_trailing`), or before the note off of its
+channel, so the last value of a gesture always arrives.
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+from midi import NOTE_ON, NOTE_OFF, CONTROL_CHANGE, CHANNEL_PRESSURE, PITCH_BEND
+from scheduler import SCHEDULER, ScheduledAction
+from stats import STATS
+
+SLOTS_PER_CHANNEL = 130
+"""
+128 controllers, pitch bend and channel pressure.
+"""
+PITCH_BEND_SLOT = 128
+PRESSURE_SLOT = 129
+
+
+class ChangeFilter:
+    __slots__ = ('min_cc_change', 'min_pb_change', 'min_interval', 'counter', 'on_trailing', '__last', '__time',
+                 '__trailing', '__trailing_action', '__trailing_slots', '__trailing_lock')
+
+    def __init__(self, min_cc_change: int = 1, min_pb_change: int = 1, max_rate: float = 0,
+                 counter: Optional[str] = None, on_trailing: Optional[Callable[[int, int, int], None]] = None):
+        """
+        :param min_cc_change: Minimum change of a cc or channel pressure value for a message to pass.
+                              1 drops exact duplicates only.
+        :param min_pb_change: Minimum change of a pitch bend value (0-16383) for a message to pass.
+        :param max_rate: Max messages per second of each (channel, message type, controller), 0 for no limit.
+        :param counter: Name of the `STATS` counter to count dropped messages in.
+        :param on_trailing: See `on_trailing`.
+        """
+        self.min_cc_change = min_cc_change
+        self.min_pb_change = min_pb_change
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0.0
+        self.counter = counter
+        self.on_trailing = on_trailing
+        """
+        Called with (status, data1, data2) of the latest message of a (channel, message type, controller)
+        dropped by the max rate, once the rate allows it. Runs on the scheduler thread, or on the thread
+        calling `accept` with the note off of its channel. If None, dropped messages are lost.
+        """
+        self.__last = [-1] * (16 * SLOTS_PER_CHANNEL)
+        """
+        Last value passed of each (channel, slot), -1 if none since the last note on.
+        """
+        self.__time = [0.0] * (16 * SLOTS_PER_CHANNEL)
+        """
+        Time (perf_counter) the last value of each (channel, slot) was passed. Only kept with a max rate.
+        """
+        self.__trailing: list[Optional[tuple[int, int, int, int]]] = [None] * (16 * SLOTS_PER_CHANNEL)
+        """
+        (status, data1, data2, value) of the latest message of each (channel, slot) dropped by the max rate,
+        waiting to be passed on by `__send_trailing`.
+        """
+        self.__trailing_action: list[Optional[ScheduledAction]] = [None] * (16 * SLOTS_PER_CHANNEL)
+        self.__trailing_slots: set[int] = set()
+        """
+        Slots with a trailing message, so that the common case of none costs a single check.
+        """
+        self.__trailing_lock = threading.Lock()
+        """
+        Trailing messages are taken by the scheduler thread and the thread calling `accept`.
+        """
+
+    def accept(self, status: int, data1: int, data2: int = 0) -> bool:
+        """
+        :return: True if the message should be sent, False if it is redundant.
+        """
+        kind = status & 0xF0
+        if kind == CONTROL_CHANGE:
+            slot = (status & 0x0F) * SLOTS_PER_CHANNEL + data1
+            value = data2
+            min_change = self.min_cc_change
+        elif kind == PITCH_BEND:
+            slot = (status & 0x0F) * SLOTS_PER_CHANNEL + PITCH_BEND_SLOT
+            value = data2 << 7 | data1
+            min_change = self.min_pb_change
+        elif kind == CHANNEL_PRESSURE:
+            slot = (status & 0x0F) * SLOTS_PER_CHANNEL + PRESSURE_SLOT
+            value = data1
+            min_change = self.min_cc_change
+        else:
+            if kind == NOTE_ON and data2:
+                self.reset_channel(status & 0x0F)
+            elif self.__trailing_slots and (kind == NOTE_OFF or kind == NOTE_ON):
+                self.flush_channel(status & 0x0F)
+            return True
+
+        last = self.__last[slot]
+        if last != -1:
+            if abs(value - last) < min_change:
+                if self.counter is not None:
+                    STATS.count(self.counter)
+                if self.__trailing_slots:
+                    # back to (about) the last value passed, which is the final value now
+                    self.__cancel_trailing(slot)
+                return False
+            if self.min_interval:
+                now = time.perf_counter()
+                if now - self.__time[slot] < self.min_interval:
+                    if self.counter is not None:
+                        STATS.count(self.counter)
+                    if self.on_trailing is not None:
+                        self.__defer(slot, status, data1, data2, value, self.__time[slot] + self.min_interval - now)
+                    return False
+                self.__time[slot] = now
+        elif self.min_interval:
+            self.__time[slot] = time.perf_counter()
+
+        if self.__trailing_slots:
+            # superseded by this message
+            self.__cancel_trailing(slot)
+        self.__last[slot] = value
+        return True
+
+    def __defer(self, slot: int, status: int, data1: int, data2: int, value: int, delay: float):
+        with self.__trailing_lock:
+            self.__trailing[slot] = (status, data1, data2, value)
+            if self.__trailing_action[slot] is None:
+                self.__trailing_action[slot] = SCHEDULER.call_later(delay, self.__send_trailing, slot)
+                self.__trailing_slots.add(slot)
+
+    def __take_trailing(self, slot: int) -> Optional[tuple[int, int, int, int]]:
+        """
+        :return: The trailing message of a slot, which now counts as passed, or None
+        """
+        with self.__trailing_lock:
+            message = self.__trailing[slot]
+            SCHEDULER.cancel(self.__trailing_action[slot])
+            self.__trailing[slot] = None
+            self.__trailing_action[slot] = None
+            self.__trailing_slots.discard(slot)
+            if message is not None:
+                self.__last[slot] = message[3]
+                self.__time[slot] = time.perf_counter()
+            return message
+
+    def __cancel_trailing(self, slot: int):
+        with self.__trailing_lock:
+            if self.__trailing_action[slot] is not None:
+                SCHEDULER.cancel(self.__trailing_action[slot])
+                self.__trailing[slot] = None
+                self.__trailing_action[slot] = None
+                self.__trailing_slots.discard(slot)
+
+    def __send_trailing(self, slot: int):
+        message = self.__take_trailing(slot)
+        if message is not None:
+            self.on_trailing(message[0], message[1], message[2])
+
+    def flush_channel(self, channel: int):
+        """
+        Passes on the trailing messages of a channel now, e.g. so that the final values of a note's
+        gesture arrive before its note off.
+        """
+        start = channel * SLOTS_PER_CHANNEL
+        for slot in sorted(s for s in self.__trailing_slots if start <= s < start + SLOTS_PER_CHANNEL):
+            self.__send_trailing(slot)
+
+    def forget(self, status: int, data1: int):
+        """
+        Forgets the last value of the (channel, message type, controller) of a message that was sent
+        without going through `accept`, so that the next message of its kind passes.
+        """
+        kind = status & 0xF0
+        if kind == CONTROL_CHANGE:
+            slot = data1
+        elif kind == PITCH_BEND:
+            slot = PITCH_BEND_SLOT
+        elif kind == CHANNEL_PRESSURE:
+            slot = PRESSURE_SLOT
+        else:
+            return
+        slot += (status & 0x0F) * SLOTS_PER_CHANNEL
+        if self.__trailing_slots:
+            # the message that was sent supersedes the trailing one
+            self.__cancel_trailing(slot)
+        self.__last[slot] = -1
+
+    def reset_channel(self, channel: int):
+        """
+        Forgets the last values of a channel, and drops its trailing messages, e.g. on note on.
+        """
+        start = channel * SLOTS_PER_CHANNEL
+        if self.__trailing_slots:
+            for slot in [s for s in self.__trailing_slots if start <= s < start + SLOTS_PER_CHANNEL]:
+                self.__cancel_trailing(slot)
+        self.__last[start:start + SLOTS_PER_CHANNEL] = _EMPTY_CHANNEL
+
+
+_EMPTY_CHANNEL = [-1] * SLOTS_PER_CHANNEL
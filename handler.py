@@ -1,41 +1,152 @@
 import threading
 import time
-import rtmidi.midiconstants as midi
-from rtmidi import MidiIn, MidiOut  # type: ignore
+from typing import Optional, TYPE_CHECKING
 
+import configs
 import convert
+import midi
 import ws_server
-from keytracker import KeyTracker, ChannelWrapper
+from bank import BANK, BankSlot
+from journal import JOURNAL, INPUT
+from keytracker import KeyTracker, ON
+from log import LOG, DEBUG, INFO
 from configs import SlideMode, CONFIGS
+from filters import ChangeFilter
+from mapping import Mapping
+from output import MidiOutputStage
+from scheduler import SCHEDULER
+from smoothing import VelocitySmoother
+from split import SplitData
+from stats import STATS
+from voices import NUM_CHANNELS, VoiceAllocator
+
+if TYPE_CHECKING:
+    # only for annotations, importing rtmidi loads the native MIDI backend
+    from rtmidi import MidiOut  # type: ignore
 
 EVENT_MASK = 0b11110000
 CHANNEL_MASK = 0b00001111
 MIDI_NOTE_A4 = convert.notename_to_midinum("a4")
 ALL_CHANNELS = -1
-
-SMOOTHING_ALPHA = 0.04
-"""
-When doing velocity smoothing by aftertouch exponential moving average, this is the alpha rate of
-change.
+FIXED_SLIDE_DELAY = 0.001
 """
-SMOOTHING_EFFECT = 0.4
+Seconds to wait after a note on in MIDI mode before sending the fixed slide cc74.
 """
-How much after touch affects velocity curve steepness. This number is the max increase/decrease of
-the exponent applied to the velocity curve normalized to 0-1, relative to `SMOOTHING_BIAS`.
+
+SLIDE_PREEMPT_VALUES = {
+    SlideMode.ABSOLUTE: None,  # the received cc74 value itself
+    SlideMode.RELATIVE: 64,
+    SlideMode.PRESS: 0,
+    SlideMode.BIPOLAR: 0,
+}
 """
-SMOOTHING_BIAS = 1.0
+The cc74 value forwarded when a cc74 message precedes a note (i.e. the initial slide position),
+per slide mode. Fixed slide mode doesn't forward it.
 """
-What exponent to apply to the velocity curve when aftertouch is at mid point (64).
 
-1.0 is no change.
+
+def _absolute_slide_output(abs74, init74):
+    return abs74
+
+
+SLIDE_OUTPUTS = {
+    SlideMode.ABSOLUTE: _absolute_slide_output,
+    SlideMode.RELATIVE: convert.to_relative_slide_output,
+    SlideMode.BIPOLAR: convert.to_bipolar_slide_output,
+}
+"""
+Converts the cc74 of an active note to the cc74 value to forward, per slide mode.
+Fixed and press slide modes don't forward cc74 of active notes.
 """
 
-tracker = KeyTracker()
+
+def mpe_channel_maps(num_devices: int) -> list[bytes]:
+    """
+    Splits the 15 MPE member channels (2-16) between several input devices sharing one output port,
+    so that their notes don't collide. Each device's member channels are folded into its own block of
+    output channels, the master channel (1) is shared.
+
+    :return: For each device, the output channel of each of its 16 input channels (0-indexed).
+    """
+    if not 1 <= num_devices <= 15:
+        raise ValueError(f'{num_devices} devices can\'t share the 15 MPE member channels')
+
+    maps = []
+    start = 1
+    for device in range(num_devices):
+        size = 15 // num_devices + (1 if device < 15 % num_devices else 0)
+        maps.append(bytes([0] + [start + (c - 1) % size for c in range(1, 16)]))
+        start += size
+    return maps
+
+
+class CompiledHandler:
+    """
+    Everything `MidiInputHandler.compile` specialises for the current CONFIGS.
+
+    Built on whichever thread changed the settings, without touching the state the input callback
+    thread uses, then installed by the input callback thread before it handles its next event.
+    """
+    __slots__ = ('dispatch', 'timed', 'journaled', 'all_channels', 'channel_map', 'journal',
+                 'change_filter', 'voices', 'smoother', 'decimator')
+
+    def __init__(self, dispatch: list, timed: bool, journaled: bool, all_channels: tuple[int, ...],
+                 channel_map: Optional[bytes], change_filter: Optional[ChangeFilter], voices: VoiceAllocator,
+                 smoother: Optional[VelocitySmoother], decimator: Optional[ChangeFilter]):
+        self.dispatch = dispatch
+        self.timed = timed
+        self.journaled = journaled
+        self.all_channels = all_channels
+        self.channel_map = channel_map
+        """
+        Output stage channel map, None to send the input channels as is.
+        """
+        self.change_filter = change_filter
+        self.voices = voices
+        """
+        A new voice allocator if the split/voice layout changed, otherwise the handler's current one.
+        """
+        self.smoother = smoother
+        self.decimator = decimator
+        """
+        The input decimator if it has a max rate, so that messages it held back are handled later on
+        the scheduler thread. Events are only handled under the handler's lock while there is one.
+        """
 
 
 class MidiInputHandler:
-    def __init__(self, out_port: MidiOut):
+    def __init__(self, out_port: 'MidiOut', mapping: Optional[Mapping] = None,
+                 channel_map: Optional[bytes] = None, port_lock: Optional[threading.Lock] = None,
+                 device: int = 0):
+        """
+        :param out_port: The output port
+        :param mapping: Mapping to use for this input device instead of CONFIGS.MAPPING
+        :param channel_map: Output channel of each input channel in MPE mode, when several input devices share
+                            the output port (see `mpe_channel_maps`). None to use the input channels as is.
+                            In MIDI mode, the voices of this device use the output channels its member
+                            channels are mapped to.
+        :param port_lock: Lock shared by the handlers of all input devices sending to `out_port`
+        :param device: Index of the input device, to tell devices apart in the journal
+        """
         self.out_port = out_port
+        self.out = MidiOutputStage(out_port, lock=port_lock)
+        """
+        Messages are buffered here while handling an input event, and flushed at the end of `__call__`.
+        """
+        self.mapping = mapping
+        """
+        If not None, used instead of CONFIGS.MAPPING for this input device.
+        """
+        self.channel_map = channel_map
+        self.device = device
+        self.tracker = KeyTracker()
+        """
+        Channel state of this input device.
+        """
+        self.ws = ws_server.Publisher()
+        """
+        Websocket events produced while handling an input event, published at the end of `__call__`.
+        """
         self._wallclock = time.time()
         self.octave_offset = 4
         """
@@ -43,269 +154,606 @@ class MidiInputHandler:
 
         CC 06 (Data Entry MSB) gives the octave offset when it is updated.
         """
-        self.aftertouch_ma = 64
+        self.smoother: Optional[VelocitySmoother] = None
+        """
+        Pressure moving averages of each split region or octave, for velocity smoothing. None if smoothing is off.
+        """
+        self.deferred_cc74 = [None] * 16
         """
-        Moving average of aftertouch values. Used for velocity smoothing if enabled.
+        Pending delayed fixed slide cc74 action (MIDI mode) for each input channel, sent on the output channel
+        of the channel's note.
         """
+        self.voices = VoiceAllocator()
+        """
+        Output channels of the sounding notes in MIDI mode. Rebuilt when the split regions or voice settings change.
+        """
+        self.__voice_channels = range(NUM_CHANNELS) if channel_map is None else \
+            range(min(channel_map[1:]), max(channel_map[1:]) + 1)
+        """
+        Output channels the voices of this device are allocated from in MIDI mode, so that devices sharing
+        the output port don't play on each other's channels.
+        """
+        self.__all_channels: tuple[int, ...] = (0,)
+        """
+        Output channels that `ALL_CHANNELS` messages are sent to. Compiled from CONFIGS.
+        """
+        self.__dispatch: list = []
+        """
+        Handler function for each status byte, specialised for the current CONFIGS.
+        Each handler function is called with (message, input channel), and returns the name
+        of the branch it took (for `stats`).
+        """
+        self.__timed = False
+        """
+        Whether to record processing times into `STATS`. Compiled from `STATS.enabled`.
+        """
+        self.__journaled = False
+        """
+        Whether to record input messages into `JOURNAL`. Compiled from `JOURNAL.enabled`.
+        """
+        self.__pending: Optional[CompiledHandler] = None
+        """
+        Compiled for the latest CONFIGS by `compile`, and not installed by the input callback thread yet.
+        """
+        self.__pending_lock = threading.Lock()
+        self.__decimator: Optional[ChangeFilter] = None
+        """
+        See `CompiledHandler.decimator`.
+        """
+        self.__lock = threading.RLock()
+        """
+        Held while an event is handled if there is a `__decimator`, whose held back messages are handled
+        later on the scheduler thread (or from within the note off of their channel), and while installing.
+        """
+
+        self.compile()
+        self.__install()
+        configs.add_listener(self.compile)
+
+    def close(self):
+        """
+        Stops following CONFIGS changes, so that the handler can be garbage collected once its input
+        port is closed, and cancels the delayed cc74 messages that weren't sent yet.
+        """
+        configs.remove_listener(self.compile)
+        for channel, action in enumerate(self.deferred_cc74):
+            SCHEDULER.cancel(action)
+            self.deferred_cc74[channel] = None
 
     def __call__(self, event, data=None):
-        mapping = CONFIGS.MAPPING
+        if self.__pending is not None:
+            with self.__lock:
+                self.__install()
+
+        if self.__decimator is None:
+            self.__handle(event)
+            return
+        with self.__lock:
+            self.__handle(event)
+
+    def __handle(self, event):
         message, deltatime = event
         self._wallclock += deltatime
 
-        msg_type, channel = EVENT_MASK & message[0], CHANNEL_MASK & message[0]
+        if self.__journaled:
+            JOURNAL.record(INPUT, self.device, message, time.time())
 
-        def tune_and_send_note(note, vel, cc74):
-            edosteps_from_a4 = mapping.calc_notes_from_a4(note, cc74)
-            scaled_vel = CONFIGS.VELOCITY_CURVES.get_velocity(
-                note, vel, self.octave_offset, cc74, CONFIGS.DEBUG
-            )
+        status = message[0]
 
-            if CONFIGS.VELOCITY_SMOOTHING:
-                presmoothed_vel = scaled_vel
-                scaled_vel = round(
-                    (
-                        (scaled_vel / 127)
-                        ** (
-                            SMOOTHING_BIAS
-                            + SMOOTHING_EFFECT
-                            - 2 * SMOOTHING_EFFECT * (self.aftertouch_ma / 127)
-                        )
-                    )
-                    * 127
-                )
-                if scaled_vel < 1:
-                    scaled_vel = 1
-                if scaled_vel > 127:
-                    scaled_vel = 127
-
-            pitchbend = None
-
-            if CONFIGS.MPE_MODE:
-                pitchbend = mapping.calc_pitchbend(note, cc74)
-                # pitch bend has to go before the note on event
-                # otherwise equator might not register it.
-                self.send_pitch_bend(channel, pitchbend)
-                self.send_note_on(channel, note, scaled_vel)
-
-                if CONFIGS.SLIDE_MODE == SlideMode.FIXED:
-                    self.send_cc(channel, 74, CONFIGS.SLIDE_FIXED_N)
-                # NOTE: the vel parameter is raw, before applying velocity curve
-                tracker.register_on(note, vel, channel, note, channel, edosteps_from_a4, pitchbend)
-
-                # pitch bend has to go after note on event
-                # otherwise strobe 2 complete disregards it
-                # because of this we have to send it twice
-                self.send_pitch_bend(channel, pitchbend)
-            else:
-                if CONFIGS.AUTO_SPLIT is not None:
-                    send_ch, send_note_offset = CONFIGS.AUTO_SPLIT.get_split_range(note)
-                else:
-                    send_ch, send_note_offset = CONFIGS.SPLITS.get_split_range(note)
+        if self.__timed:
+            t0 = time.perf_counter_ns()
+            branch = self.__dispatch[status](message, status & CHANNEL_MASK)
+            self.out.flush()
+            self.ws.flush(self._wallclock)
+            STATS.record(branch, time.perf_counter_ns() - t0)
+            return
 
-                send_note = edosteps_from_a4 + MIDI_NOTE_A4 + send_note_offset
+        self.__dispatch[status](message, status & CHANNEL_MASK)
 
-                if 0 > send_note > 127:
-                    send_note = max(0, min(127, send_note))
-                    print(
-                        "Midi note out of range! Consider using mutliple vst instances in different octaves "
-                        "and split ranges with pitch offsets when in MIDI mode."
-                    )
-                self.send_note_on(send_ch, send_note, scaled_vel)
+        self.out.flush()
+        self.ws.flush(self._wallclock)
+
+    def __handle_later(self, decimator: ChangeFilter, handle, message: list[int]):
+        """
+        Handles a message held back by input decimation, outside of `__call__`.
+
+        :param decimator: The decimator that held it back
+        :param handle: Handler function of the message's kind, without decimation
+        """
+        with self.__lock:
+            if decimator is not self.__decimator:
+                # the settings changed meanwhile
+                return
+            handle(message, message[0] & CHANNEL_MASK)
+            self.out.flush()
+            self.ws.flush(self._wallclock)
+
+    def compile(self):
+        """
+        Rebuilds the dispatch table with handler functions specialised for the current
+        CONFIGS (MPE/MIDI mode, slide mode, velocity smoothing, splits, etc...).
+
+        Called whenever CONFIGS change, see `configs.configs_changed`. Safe to call from any thread
+        while input is being handled: the result is installed by the input callback thread before
+        the next event.
+        """
+        mpe_mode = CONFIGS.MPE_MODE
+        slide_mode = CONFIGS.SLIDE_MODE
+        slide_fixed_n = CONFIGS.SLIDE_FIXED_N
+        velocity_smoothing = CONFIGS.VELOCITY_SMOOTHING
+        toggle_sustain = CONFIGS.TOGGLE_SUSTAIN
+        debug = CONFIGS.DEBUG
+        device_mapping = self.mapping
+        auto_split = CONFIGS.AUTO_SPLIT is not None
+        splits = CONFIGS.AUTO_SPLIT if auto_split else CONFIGS.SPLITS
+        if auto_split and device_mapping is not None:
+            splits = SplitData(device_mapping)
+        # the mapping of each note is read through one reference: the selected bank program, or this
+        # slot of the current CONFIGS. Devices with their own mapping don't follow the bank.
+        own_slot = BankSlot(-1, CONFIGS.MAPPING if device_mapping is None else device_mapping,
+                            CONFIGS.VELOCITY_CURVES, splits if auto_split else None)
+        default_vel_curves = CONFIGS.VELOCITY_CURVES
+        use_bank = device_mapping is None
+        preempt_value = SLIDE_PREEMPT_VALUES.get(slide_mode)
+        slide_output = SLIDE_OUTPUTS.get(slide_mode)
+        LOG.level = DEBUG if debug else INFO
+
+        num_regions = splits.get_num_channels_used()
+        voice_channels = self.__voice_channels
+        channels_per_region = max(1, min(CONFIGS.VOICES_PER_SPLIT, len(voice_channels) // num_regions))
+        first_channel = voice_channels.start
+        if first_channel + num_regions * channels_per_region > NUM_CHANNELS:
+            # more regions than channels of this device, some are shared with the previous device
+            first_channel = max(0, NUM_CHANNELS - num_regions * channels_per_region)
+            if not mpe_mode:
+                LOG.warning('%d split regions don\'t fit in the %d output channels of input device %d, '
+                            'using channels %d-%d', num_regions, len(voice_channels), self.device + 1,
+                            first_channel + 1, first_channel + num_regions * channels_per_region)
+        voices = self.voices
+        if (voices.num_regions, voices.channels_per_region, voices.policy, voices.first_channel) != \
+                (num_regions, channels_per_region, CONFIGS.VOICE_ALLOCATION, first_channel):
+            # notes of the current allocator on channels the new one doesn't have are turned off
+            # when this is installed
+            voices = VoiceAllocator(num_regions, channels_per_region, CONFIGS.VOICE_ALLOCATION, first_channel)
+        reset_bend = channels_per_region > 1
+
+        change_filter = ChangeFilter(
+            CONFIGS.FILTER_MIN_CC_CHANGE, CONFIGS.FILTER_MIN_PB_CHANGE, CONFIGS.FILTER_MAX_RATE,
+            counter='output_filtered'
+        ) if CONFIGS.OUTPUT_FILTER else None
+
+        # smoothing uses the regions of the voice allocator. Without splits (e.g. in MPE mode) each
+        # octave keeps its own average, as with auto split.
+        smoothing_splits = splits if num_regions > 1 else SplitData(own_slot.mapping)
+        smoother = VelocitySmoother(smoothing_splits, CONFIGS.SMOOTHING_ALPHA,
+                                    CONFIGS.SMOOTHING_EFFECT, CONFIGS.SMOOTHING_BIAS) \
+            if velocity_smoothing else None
+
+        out = self.out
+        tracker = self.tracker
+        ws = self.ws
+        send_cc = self.send_cc
+        send_note_on = self.send_note_on
+        send_note_off = self.send_note_off
+        send_raw_pitch_bend = self.send_raw_pitch_bend
+        send_pitch_bend = self.send_pitch_bend
+        deferred_cc74 = self.deferred_cc74
+
+        def current_slot():
+            return (BANK.active if use_bank else None) or own_slot
+
+        def scale_velocity(slot, channel, note, vel, cc74):
+            curves = slot.vel_curves if slot.vel_curves is not None else default_vel_curves
+            scaled_vel = curves.get_velocity(note, vel, self.octave_offset, cc74, debug)
+
+            if velocity_smoothing:
+                smoothed_vel = smoother.smooth(channel, note, scaled_vel)
+                if debug:
+                    LOG.debug('Aftertouch MA: %d, vel before smoothing: %d', round(smoother.average(channel)), scaled_vel)
+                return smoothed_vel
+
+            return scaled_vel
+
+        def tune_and_send_note_mpe(channel, note, vel, cc74):
+            slot = current_slot()
+            mapping = slot.mapping
+            edosteps_from_a4 = mapping.calc_notes_from_a4(note, cc74)
+            scaled_vel = scale_velocity(slot, channel, note, vel, cc74)
+            pitchbend, pb_lsb, pb_msb = mapping.calc_pitchbend_msg(note, cc74)
+
+            # pitch bend has to go before the note on event
+            # otherwise equator might not register it.
+            send_raw_pitch_bend(channel, pb_lsb, pb_msb)
+            send_note_on(channel, note, scaled_vel)
+
+            if slide_mode == SlideMode.FIXED:
+                send_cc(channel, 74, slide_fixed_n)
+            # NOTE: the vel parameter is raw, before applying velocity curve
+            tracker.register_on(note, vel, channel, note, channel, edosteps_from_a4, pitchbend)
+
+            # pitch bend has to go after note on event
+            # otherwise strobe 2 complete disregards it
+            # because of this we have to send it twice
+            send_raw_pitch_bend(channel, pb_lsb, pb_msb)
+
+            ws.send_note_on(edosteps_from_a4, scaled_vel)
+
+            if debug:
+                LOG.debug(
+                    'recv: (note %d, vel %d, cc74 %d), sent: (note %d, pb %d, vel %d)',
+                    note, vel, cc74, edosteps_from_a4, pitchbend, scaled_vel
+                )
 
-                # if a note overrides another active note in the same input channel,
-                # stop that note. Prevents ghosts that hang around.
-                if existing := tracker.check_existing(channel):
-                    print(f"max channel used: sent {existing.edosteps_from_a4} off")
-                    self.send_note_off(existing.channel_sent, existing.midi_note_sent, 0)
-                    ws_server.send_note_off(existing.edosteps_from_a4, 0)
+        def tune_and_send_note_midi(channel, note, vel, cc74):
+            slot = current_slot()
+            mapping = slot.mapping
+            edosteps_from_a4 = mapping.calc_notes_from_a4(note, cc74)
+            scaled_vel = scale_velocity(slot, channel, note, vel, cc74)
+            # auto split offsets depend on the mapping, the regions are the same for every mapping
+            region, send_note_offset = (slot.auto_split if auto_split else splits).get_split_range(note)
 
-                def do_later():
-                    time.sleep(0.001)
-                    self.send_cc(channel, 74, CONFIGS.SLIDE_FIXED_N)
+            send_note = edosteps_from_a4 + MIDI_NOTE_A4 + send_note_offset
 
-                if CONFIGS.SLIDE_MODE == SlideMode.FIXED:
-                    threading.Thread(target=do_later).start()
+            if not 0 <= send_note <= 127:
+                send_note = max(0, min(127, send_note))
+                LOG.warning(
+                    "Midi note out of range! Consider using mutliple vst instances in different octaves "
+                    "and split ranges with pitch offsets when in MIDI mode."
+                )
 
-                # NOTE: the vel parameter is raw, before applying velocity curve
-                tracker.register_on(note, vel, channel, send_note, send_ch, edosteps_from_a4)
+            # if a note overrides another active note in the same input channel,
+            # stop that note. Prevents ghosts that hang around.
+            if existing := tracker.check_existing(channel):
+                STATS.count('channel_steals')
+                LOG.info("max channel used: sent %d off", existing.edosteps_from_a4)
+                if voices.release(channel) != -1:
+                    send_note_off(existing.channel_sent, existing.midi_note_sent, 0)
+                    ws.send_note_off(existing.edosteps_from_a4, 0)
+
+            send_ch, stolen = voices.allocate(channel, region)
+            if stolen != -1:
+                # all channels of the region are in use, the oldest note was stolen
+                STATS.count('voice_steals')
+                # its delayed fixed slide cc74 would go to the channel of this note
+                if SCHEDULER.cancel(deferred_cc74[stolen]):
+                    deferred_cc74[stolen] = None
+                victim = tracker.check_existing(stolen)
+                if victim is not None:
+                    send_note_off(victim.channel_sent, victim.midi_note_sent, 0)
+                    ws.send_note_off(victim.edosteps_from_a4, 0)
+
+            if reset_bend:
+                # the channel may still be bent by the previous note that played on it
+                send_pitch_bend(send_ch, 8192)
+            send_note_on(send_ch, send_note, scaled_vel)
+
+            if slide_mode == SlideMode.FIXED:
+                SCHEDULER.cancel(deferred_cc74[channel])
+                deferred_cc74[channel] = SCHEDULER.call_later(
+                    FIXED_SLIDE_DELAY, self.send_deferred_cc, send_ch, 74, slide_fixed_n
+                )
+
+            # NOTE: the vel parameter is raw, before applying velocity curve
+            tracker.register_on(note, vel, channel, send_note, send_ch, edosteps_from_a4)
 
-            ws_server.send_note_on(edosteps_from_a4, scaled_vel)
+            ws.send_note_on(edosteps_from_a4, scaled_vel)
 
-            if CONFIGS.DEBUG:
-                print(
-                    f'recv: (note {note}, vel {vel}, cc74 {cc74}), sent: (note {edosteps_from_a4}, {f"pb {pitchbend}, " if CONFIGS.MPE_MODE else ""}vel {scaled_vel})'
+            if debug:
+                LOG.debug(
+                    'recv: (note %d, vel %d, cc74 %d), sent: (note %d, vel %d)',
+                    note, vel, cc74, edosteps_from_a4, scaled_vel
                 )
-                if CONFIGS.VELOCITY_SMOOTHING:
-                    print(f'Aftertouch MA: {round(self.aftertouch_ma)}, vel before smoothing: {presmoothed_vel}')
-
-        if msg_type == midi.NOTE_ON:
-            note, vel = message[1:3]
-            if not tracker.check_waiting_for_cc74(channel):
-                cc74 = tracker.get_initial_cc74(channel)
-                tune_and_send_note(note, vel, cc74)
+
+        tune_and_send_note = tune_and_send_note_mpe if mpe_mode else tune_and_send_note_midi
+
+        def on_note_on(message, channel):
+            note = message[1]
+            vel = message[2]
+            cc74 = tracker.note_on(note, vel, channel)
+            if cc74 is not None:
+                tune_and_send_note(channel, note, vel, cc74)
+                return 'note_on'
             else:
-                tracker.register_received(note, vel, channel)
+                STATS.count('deferred_notes')
 
-                print(f"debug: note on before cc74: " f"{convert.midinum_to_12edo_name(note)}")
+                if debug:
+                    LOG.debug("debug: note on before cc74: %s", convert.midinum_to_12edo_name(note))
+                return 'note_on.deferred'
 
-        elif msg_type == midi.NOTE_OFF:
-            note, vel = message[1:3]
+        def on_note_off(message, channel):
+            vel = message[2]
 
-            if CONFIGS.MPE_MODE:
-                self.send_note_off(channel, note, vel)
+            # the note off supersedes a delayed fixed slide cc74 that hasn't been sent yet
+            if SCHEDULER.cancel(deferred_cc74[channel]):
+                deferred_cc74[channel] = None
 
-            if existing := tracker.check_existing(channel):
-                if not CONFIGS.MPE_MODE:
-                    self.send_note_off(existing.channel_sent, existing.midi_note_sent, vel)
+            if mpe_mode:
+                send_note_off(channel, message[1], vel)
 
-                ws_server.send_note_off(existing.edosteps_from_a4, vel)
+            if existing := tracker.check_existing(channel):
+                if mpe_mode:
+                    ws.send_note_off(existing.edosteps_from_a4, vel)
+                elif voices.release(channel) != -1:
+                    # (a stolen note was already turned off)
+                    send_note_off(existing.channel_sent, existing.midi_note_sent, vel)
+                    ws.send_note_off(existing.edosteps_from_a4, vel)
+                tracker.register_off(channel)
+                return 'note_off'
             else:
-                print(
+                STATS.count('stuck_notes')
+                LOG.warning(
                     "warning: unable to find existing note to turn off in websocket/MIDI mode. "
                     "There may be a stuck note present."
                 )
+                tracker.register_off(channel)
+                return 'note_off.stuck'
+
+        def send_preempt_defaults(c, value):
+            if preempt_value is not None:
+                send_cc(c, 74, preempt_value)
+            elif slide_mode == SlideMode.ABSOLUTE:
+                send_cc(c, 74, value)
+
+        def on_cc74(channel, value):
+            c = channel if mpe_mode else ALL_CHANNELS
+            init74_or_note = tracker.register_cc74(channel, value)
+
+            if init74_or_note is None:
+                # in these other cases, a note is about to happen.
+                # send the correct preemptive cc74 messages according
+                # to slide mode.
+                send_preempt_defaults(c, value)
+                return 'cc74.preempt'
+            elif type(init74_or_note) is int:
+                # The note is currently active
+                if slide_output is not None:
+                    send_cc(c, 74, slide_output(value, init74_or_note))
+                return 'cc74.slide'
+            else:
+                # Note was awaiting cc74 to be forwarded.
+                send_preempt_defaults(c, value)
+                tune_and_send_note(
+                    channel,
+                    init74_or_note.midi_note_received,
+                    init74_or_note.on_velocity_received,
+                    value,
+                )
+                STATS.count('resolved_notes')
 
-            tracker.register_off(channel)
-
-        elif msg_type == midi.CONTROL_CHANGE:
-            cc, value = message[1:3]
-            c = channel if CONFIGS.MPE_MODE else ALL_CHANNELS
+                if debug:
+                    LOG.debug(
+                        "debug: resolved note on before cc74: %s",
+                        convert.midinum_to_12edo_name(init74_or_note.midi_note_received)
+                    )
+                return 'cc74.resolve'
 
-            def send_preempt_defaults():
-                if CONFIGS.SLIDE_MODE == SlideMode.ABSOLUTE:
-                    self.send_cc(c, cc, value)
-                elif CONFIGS.SLIDE_MODE == SlideMode.RELATIVE:
-                    self.send_cc(c, cc, 64)
-                elif (
-                    CONFIGS.SLIDE_MODE == SlideMode.PRESS or CONFIGS.SLIDE_MODE == SlideMode.BIPOLAR
-                ):
-                    self.send_cc(c, cc, 0)
+        def on_cc(message, channel):
+            cc = message[1]
+            value = message[2]
 
             if cc == 74:
-                if init74_or_note := tracker.register_cc74(channel, value):
-                    if type(init74_or_note) is int:
-                        # The note is currently active
-                        if CONFIGS.SLIDE_MODE == SlideMode.ABSOLUTE:
-                            self.send_cc(c, cc, value)
-                        elif CONFIGS.SLIDE_MODE == SlideMode.RELATIVE:
-                            self.send_cc(
-                                c, cc, convert.to_relative_slide_output(value, init74_or_note)
-                            )
-                        elif CONFIGS.SLIDE_MODE == SlideMode.BIPOLAR:
-                            self.send_cc(
-                                c, cc, convert.to_bipolar_slide_output(value, init74_or_note)
-                            )
-                    elif type(init74_or_note) is ChannelWrapper:
-                        # Note was awaiting cc74 to be forwarded.
-                        send_preempt_defaults()
-                        tune_and_send_note(
-                            init74_or_note.midi_note_received,
-                            init74_or_note.on_velocity_received,
-                            value,
-                        )
-
-                        print(
-                            f"debug: resolved note on before cc74: "
-                            f"{convert.midinum_to_12edo_name(init74_or_note.midi_note_received)}"
-                        )
+                return on_cc74(channel, value)
 
-                else:
-                    # in these other cases, a note is about to happen.
-                    # send the correct preemptive cc74 messages according
-                    # to slide mode.
-                    send_preempt_defaults()
-
-            elif cc == midi.SUSTAIN:  # CC 64
-                sustain_value = value if not CONFIGS.TOGGLE_SUSTAIN else 127 - value
-                self.send_cc(c, cc, sustain_value)
-                ws_server.send_cc(cc, sustain_value)
+            c = channel if mpe_mode else ALL_CHANNELS
+
+            if cc == midi.SUSTAIN:  # CC 64
+                sustain_value = value if not toggle_sustain else 127 - value
+                send_cc(c, cc, sustain_value)
+                ws.send_cc(cc, sustain_value)
+                return 'cc.sustain'
             elif cc == 6:  # Data Entry MSB, octave switch
                 self.octave_offset = value
-                self.send_cc(c, cc, value)
+                send_cc(c, cc, value)
+                return 'cc.octave'
             else:
-                self.send_cc(c, cc, value)
-
-        elif msg_type == midi.PITCH_BEND:
-            ls7, ms7 = message[1:3]
-            pb = (
-                convert.raw_pitch_msg_to_pitch_bend(ls7, ms7)
-                - 8192
-                + tracker.get_base_pitch(channel)
-            )
+                send_cc(c, cc, value)
+                return 'cc'
 
+        def on_pitch_bend_mpe(message, channel):
             if tracker.check_existing(channel):
-                if CONFIGS.MPE_MODE:
-                    self.send_pitch_bend(channel, pb)
-                else:
-                    # sends pitch bend only on the channel pertaining to the split range
-                    self.send_pitch_bend(tracker.get_output_channel(channel), pb)
-        else:
+                pb = convert.raw_pitch_msg_to_pitch_bend(message[1], message[2]) - 8192 + tracker.get_base_pitch(channel)
+                send_pitch_bend(channel, pb)
+                return 'pitch_bend'
+            return 'pitch_bend.ignored'
+
+        def on_pitch_bend_midi(message, channel):
+            if tracker.check_existing(channel) and (send_ch := voices.channel_of(channel)) != -1:
+                pb = convert.raw_pitch_msg_to_pitch_bend(message[1], message[2]) - 8192 + tracker.get_base_pitch(channel)
+                # sends pitch bend only on the output channel of the note
+                send_pitch_bend(send_ch, pb)
+                return 'pitch_bend'
+            return 'pitch_bend.ignored'
+
+        def on_channel_pressure(message, channel):
             # just forward the message
-            self.send_raw(message)
+            out.send_raw(message)
 
-            # If slide mode is set to aftertouch, send cc74 according to aftertouch
+            aftertouch = message[1]
 
-            if msg_type == midi.CHANNEL_PRESSURE:
+            if velocity_smoothing:
+                # update exponential moving average of the region of the channel's note
+                smoother.update(channel, aftertouch)
 
-                aftertouch = message[1]
-
-                if CONFIGS.VELOCITY_SMOOTHING:
-                    # update exponential moving average
-                    self.aftertouch_ma = (
-                        SMOOTHING_ALPHA * aftertouch + (1 - SMOOTHING_ALPHA) * self.aftertouch_ma
-                    )
+            # If slide mode is set to aftertouch, send cc74 according to aftertouch
+            if slide_mode == SlideMode.PRESS:
+                # note: channel pressure only has 1 data byte, of which represents
+                #       the value
+                send_cc(channel if mpe_mode else ALL_CHANNELS, 74, aftertouch)
+
+            return 'pressure'
+
+        def on_program_change(message, channel):
+            if not BANK.select(message[1]):
+                # not in the bank (or no bank loaded), let the synth handle it
+                out.send_raw(message)
+                return 'program_change'
+            if debug:
+                LOG.debug('bank: program %d', message[1])
+            return 'program_change.bank'
+
+        def on_other(message, channel):
+            # just forward the message
+            out.send_raw(message)
+            return 'other'
+
+        on_pitch_bend = on_pitch_bend_mpe if mpe_mode else on_pitch_bend_midi
+
+        decimator = None
+        if CONFIGS.INPUT_DECIMATION:
+            # drop incoming pressure, slide and pitch bend messages that barely change anything
+            # before they are handled. Note on/off are never delayed or dropped.
+            def handle_trailing(status, data1, data2):
+                # the latest message held back by the max rate, handled once the rate allows it
+                kind = status & 0xF0
+                if kind == midi.CHANNEL_PRESSURE:
+                    self.__handle_later(decimator, handle_channel_pressure, [status, data1])
+                elif kind == midi.PITCH_BEND:
+                    self.__handle_later(decimator, handle_pitch_bend, [status, data1, data2])
+                else:
+                    self.__handle_later(decimator, handle_cc, [status, data1, data2])
 
-                if CONFIGS.SLIDE_MODE == SlideMode.PRESS:
-                    if CONFIGS.MPE_MODE:
-                        # note: channel pressure only has 1 data byte, of which represents
-                        #       the value
-                        self.send_cc(channel, 74, aftertouch)
-                    else:
-                        self.send_cc(ALL_CHANNELS, 74, aftertouch)
+            decimator = ChangeFilter(
+                CONFIGS.DECIMATE_MIN_CC_CHANGE, CONFIGS.DECIMATE_MIN_PB_CHANGE, CONFIGS.DECIMATE_MAX_RATE,
+                counter='input_decimated', on_trailing=handle_trailing
+            )
+            accept = decimator.accept
+            reset_channel = decimator.reset_channel
+            flush_channel = decimator.flush_channel
+            handle_note_on = on_note_on
+            handle_note_off = on_note_off
+            handle_cc = on_cc
+            handle_pitch_bend = on_pitch_bend
+            handle_channel_pressure = on_channel_pressure
+
+            def on_note_on(message, channel):
+                # the first expression messages of a new note always pass
+                reset_channel(channel)
+                return handle_note_on(message, channel)
+
+            def on_note_off(message, channel):
+                # the final pressure, slide and pitch bend of the note are handled before it ends
+                flush_channel(channel)
+                return handle_note_off(message, channel)
+
+            def on_cc(message, channel):
+                # cc74 messages of notes that aren't on yet carry their initial slide, which tunes the note.
+                if message[1] == 74 and tracker.get_state(channel) == ON and not accept(message[0], 74, message[2]):
+                    return 'decimated'
+                return handle_cc(message, channel)
+
+            def on_pitch_bend(message, channel):
+                if accept(message[0], message[1], message[2]):
+                    return handle_pitch_bend(message, channel)
+                return 'decimated'
+
+            def on_channel_pressure(message, channel):
+                if accept(message[0], message[1]):
+                    return handle_channel_pressure(message, channel)
+                return 'decimated'
+
+        dispatch = [on_other] * 256
+        for ch in range(0, 16):
+            dispatch[midi.NOTE_ON | ch] = on_note_on
+            dispatch[midi.NOTE_OFF | ch] = on_note_off
+            dispatch[midi.CONTROL_CHANGE | ch] = on_cc
+            dispatch[midi.PITCH_BEND | ch] = on_pitch_bend
+            dispatch[midi.CHANNEL_PRESSURE | ch] = on_channel_pressure
+            dispatch[midi.PROGRAM_CHANGE | ch] = on_program_change
+
+        compiled = CompiledHandler(
+            dispatch, STATS.enabled, JOURNAL.enabled,
+            (voices.first_channel,) if CONFIGS.AUTO_SPLIT is not None else tuple(voices.channels()),
+            self.channel_map if mpe_mode else None, change_filter, voices, smoother,
+            decimator if decimator is not None and decimator.min_interval else None,
+        )
+        # published in one assignment, a compile that wasn't installed yet is superseded
+        with self.__pending_lock:
+            self.__pending = compiled
+
+    def __install(self):
+        """
+        Installs the result of the latest `compile`. Only called from the input callback thread
+        (or before input is handled), so the output stage, voices and smoother are never replaced
+        while an event is being handled.
+        """
+        with self.__pending_lock:
+            compiled = self.__pending
+            self.__pending = None
+        if compiled is None:
+            return
+
+        if compiled.voices is not self.voices:
+            self.__reset_voices(compiled.voices)
+        if compiled.smoother is not None and self.smoother is not None:
+            compiled.smoother.carry_over(self.smoother)
+        self.smoother = compiled.smoother
+
+        self.__all_channels = compiled.all_channels
+        self.out.set_channel_map(compiled.channel_map)
+        self.out.set_journal(JOURNAL if compiled.journaled else None, self.device)
+        self.out.set_filter(compiled.change_filter)
+        self.__timed = compiled.timed
+        self.__journaled = compiled.journaled
+        self.__decimator = compiled.decimator
+        self.__dispatch = compiled.dispatch
+
+    def __reset_voices(self, voices: VoiceAllocator):
+        """
+        Replaces the voice allocator for a new split/voice layout. Notes still sounding keep their
+        channel if it is a channel of the new layout, the others are turned off.
+        """
+        for in_channel, out_channel in self.voices.active_voices():
+            if voices.adopt(in_channel, out_channel):
+                continue
+            if existing := self.tracker.check_existing(in_channel):
+                self.out.send(midi.NOTE_OFF + out_channel, existing.midi_note_sent, 0)
+                self.ws.send_note_off(existing.edosteps_from_a4, 0)
+        self.voices = voices
 
     def send_note_on(self, channel, note, vel):
         if channel == ALL_CHANNELS:
-            if CONFIGS.AUTO_SPLIT is not None:
-                self.out_port.send_message([midi.NOTE_ON + 0, note, vel])
-            else:
-                for c in range(0, CONFIGS.SPLITS.get_num_channels_used()):
-                    self.out_port.send_message([midi.NOTE_ON + c, note, vel])
+            for c in self.__all_channels:
+                self.out.send(midi.NOTE_ON + c, note, vel)
         else:
-            self.out_port.send_message([midi.NOTE_ON + channel, note, vel])
+            self.out.send(midi.NOTE_ON + channel, note, vel)
 
     def send_note_off(self, channel, note, vel):
         if channel == ALL_CHANNELS:
-            if CONFIGS.AUTO_SPLIT is not None:
-                self.out_port.send_message([midi.NOTE_OFF + 0, note, vel])
-            else:
-                for c in range(0, CONFIGS.SPLITS.get_num_channels_used()):
-                    self.out_port.send_message([midi.NOTE_OFF + c, note, vel])
+            for c in self.__all_channels:
+                self.out.send(midi.NOTE_OFF + c, note, vel)
         else:
-            self.out_port.send_message([midi.NOTE_OFF + channel, note, vel])
+            self.out.send(midi.NOTE_OFF + channel, note, vel)
 
     def send_cc(self, channel, cc, val):
         if channel == ALL_CHANNELS:
-            if CONFIGS.AUTO_SPLIT is not None:
-                self.out_port.send_message([midi.CONTROL_CHANGE + 0, cc, val])
-            else:
-                for c in range(0, CONFIGS.SPLITS.get_num_channels_used()):
-                    self.out_port.send_message([midi.CONTROL_CHANGE + c, cc, val])
+            sent = False
+            for c in self.__all_channels:
+                if self.out.send(midi.CONTROL_CHANGE + c, cc, val):
+                    sent = True
         else:
-            self.out_port.send_message([midi.CONTROL_CHANGE + channel, cc, val])
+            sent = self.out.send(midi.CONTROL_CHANGE + channel, cc, val)
+
+        # websocket clients don't get the changes that were filtered out either
+        if sent:
+            self.ws.send_cc(cc, val)
 
-        ws_server.send_cc(cc, val)
+    def send_deferred_cc(self, channel, cc, val):
+        """
+        Sends a cc message immediately. Used by deferred actions which run outside of the input callback.
+        """
+        self.out.send_now(midi.CONTROL_CHANGE + channel, cc, val)
+        ws_server.send_cc_now(cc, val)
 
     def send_pitch_bend(self, channel, pitchbend):
         lsb, msb = convert.pitch_bend_to_raw_pitch_msg(pitchbend)
+        self.send_raw_pitch_bend(channel, lsb, msb)
+
+    def send_raw_pitch_bend(self, channel, lsb, msb):
         if channel == ALL_CHANNELS:
-            if CONFIGS.AUTO_SPLIT is not None:
-                self.out_port.send_message([midi.PITCH_BEND + 0, lsb, msb])
-            else:
-                for c in range(0, CONFIGS.SPLITS.get_num_channels_used()):
-                    self.out_port.send_message([midi.PITCH_BEND + c, lsb, msb])
+            for c in self.__all_channels:
+                self.out.send(midi.PITCH_BEND + c, lsb, msb)
         else:
-            self.out_port.send_message([midi.PITCH_BEND + channel, lsb, msb])
+            self.out.send(midi.PITCH_BEND + channel, lsb, msb)
 
     def send_raw(self, msg):
-        self.out_port.send_message(msg)
+        self.out.send_raw(msg)
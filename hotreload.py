@@ -0,0 +1,162 @@
+"""
+Hot reload of the loaded mapping and velocity curve files.
+
+While watching, a background thread polls the .sbmap and .vel files currently in use. When one
+changes, it is parsed and compiled on that thread, then swapped into CONFIGS with a single
+assignment. Notes that are already sounding keep the tuning they started with (their pitch bend
+base and output note are stored in the key tracker on note on), only new notes use the new mapping.
+"""
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+import configs
+from bank import BANK
+from configs import CONFIGS
+from mapping import Mapping, MapParsingError
+from split import SplitData
+from velcurve import VelocityCurves
+
+POLL_INTERVAL = 0.25
+"""
+Seconds between checks of the watched files.
+"""
+
+
+def _signature(path: Optional[str]) -> Optional[tuple[int, int]]:
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    def __init__(self):
+        self.run_swap: Callable[[Callable[[], None]], object] = lambda swap: swap()
+        """
+        Runs the function that swaps a reloaded file into CONFIGS. Defaults to running it on the watcher
+        thread. With `--asyncio`, set to `eventloop.call` so that the swap happens on the event loop.
+        """
+        self.__thread: Optional[threading.Thread] = None
+        self.__stop: Optional[threading.Event] = None
+        """
+        Set to stop the current watcher thread. Each thread gets its own, so that `stop` doesn't have to wait
+        for the thread (which may be waiting for `run_swap` on the event loop `stop` was called from).
+        """
+        self.__seen: dict[str, Optional[tuple[int, int]]] = {}
+        """
+        Path -> (mtime, size) of the version of the file that is loaded (or failed to load).
+        """
+        self.__changed: dict[str, Optional[tuple[int, int]]] = {}
+        """
+        Path -> (mtime, size) of a change that was seen on the last poll, but is only reloaded once the file
+        stops changing, so that a file that is still being written isn't parsed.
+        """
+
+    def is_running(self) -> bool:
+        return self.__thread is not None
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stop = threading.Event()
+        self.__seen = {}
+        self.__changed = {}
+        self.__thread = threading.Thread(target=self.__run, args=(self.__stop,), name='hot-reload', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread = None
+
+    def __run(self, stop: threading.Event):
+        while not stop.wait(POLL_INTERVAL):
+            try:
+                mapping = getattr(CONFIGS, 'MAPPING', None)
+                if mapping is not None and self.__check(mapping.file_path):
+                    self.__reload_mapping(mapping.file_path)
+
+                vel_path = CONFIGS.VELOCITY_CURVES.file_path
+                if self.__check(vel_path):
+                    self.__reload_vel_curves(vel_path)
+            except Exception:
+                print('error while hot reloading:')
+                traceback.print_exc()
+
+    def __check(self, path: Optional[str]) -> bool:
+        """
+        :return: True if the file changed since it was loaded, and didn't change since the last poll.
+        """
+        if path is None:
+            return False
+
+        sig = _signature(path)
+        if path not in self.__seen:
+            # first time this file is watched, it was loaded by someone else
+            self.__seen[path] = sig
+            return False
+
+        if sig == self.__seen[path] or sig is None:
+            self.__changed.pop(path, None)
+            return False
+
+        if self.__changed.get(path) != sig:
+            self.__changed[path] = sig
+            return False
+
+        del self.__changed[path]
+        self.__seen[path] = sig
+        return True
+
+    def __reload_mapping(self, path: str):
+        print(f'\n{path} changed, reloading...')
+        t0 = time.perf_counter()
+        try:
+            mapping = Mapping(path)
+        except MapParsingError as e:
+            print(e)
+            print('Keeping the previous mapping.')
+            return
+        auto_split = SplitData(mapping) if CONFIGS.AUTO_SPLIT is not None else None
+
+        def swap():
+            # the mapping may have been changed with the map command in the meantime
+            if CONFIGS.MAPPING.file_path != path:
+                return
+            CONFIGS.MAPPING = mapping
+            if CONFIGS.AUTO_SPLIT is not None:
+                CONFIGS.AUTO_SPLIT = auto_split if auto_split is not None else SplitData(mapping)
+            configs.configs_changed()
+            if BANK.active is not None:
+                print(f'note: bank program {BANK.active.program} is in use, the reloaded mapping is used '
+                      f'after `map` or `bank off`.')
+
+        self.run_swap(swap)
+        print(f'Mapping reloaded in {(time.perf_counter() - t0) * 1000:.1f}ms')
+
+    def __reload_vel_curves(self, path: str):
+        print(f'\n{path} changed, reloading...')
+        t0 = time.perf_counter()
+        curves = VelocityCurves(path)
+        if curves.key_vel_curves is None:
+            print('Keeping the previous velocity curves.')
+            return
+
+        def swap():
+            if CONFIGS.VELOCITY_CURVES.file_path != path:
+                return
+            CONFIGS.VELOCITY_CURVES = curves
+            configs.configs_changed()
+
+        self.run_swap(swap)
+        print(f'Velocity curves reloaded in {(time.perf_counter() - t0) * 1000:.1f}ms')
+
+
+WATCHER = FileWatcher()
@@ -0,0 +1,301 @@
+"""
+Memory-mapped journal of input and output MIDI messages.
+
+Every message received from the input devices and sent to the output port is written as a fixed
+width record into a ring buffer file. Writing a record is a `struct.pack_into` into a memory map,
+so journaling is cheap enough to leave on, and the journal survives a crash of the mapper. When
+the ring is full the oldest records are overwritten.
+
+The journal of a stuck or mistuned note can be printed, or its input messages replayed offline:
+
+    python journal.py [journal.sbj] [--last <n>]
+    python replay.py journal.sbj [--device <n>] [--midi] ...
+
+File format (little endian): a 16 byte header `'<4sIQ'` (magic, capacity in records, number of
+records written so far), then `capacity` records of 16 bytes `'<dBB3s3x'`:
+
+- `double time`: seconds since the epoch (system clock) when the message was received or sent.
+- `uint8 kind`: `device << 2 | INPUT/OUTPUT/SESSION/SETTINGS`
+- `uint8 length`: length of the message. Only the first 3 bytes of longer (sysex) messages are kept.
+- `3 bytes`: message bytes
+
+SETTINGS records hold the settings replay needs instead of a device and message, see
+`Journal.record_settings`.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Optional
+
+MAGIC = b'SBJ1'
+HEADER = struct.Struct('<4sIQ')
+RECORD = struct.Struct('<dBB3s3x')
+
+INPUT = 0
+OUTPUT = 1
+SESSION = 2
+"""
+Written when the journal is opened, to tell runs of the mapper apart.
+"""
+SETTINGS = 3
+"""
+Written when the journal is opened and whenever the settings change. The device bits of the record hold
+one of the `SETTING_*` fields.
+"""
+KIND_MASK = 0b11
+
+SETTING_MODES = 0
+"""
+Message bytes: MPE mode (0/1), slide mode (`SlideMode` value), fixed slide value.
+"""
+SETTING_PITCH_BEND_RANGE = 1
+"""
+Message byte: pitch bend range.
+"""
+SETTING_MAPPING = 2
+"""
+Up to 3 bytes of the UTF-8 absolute path of the mapping file per record, written after SETTING_MODES
+and SETTING_PITCH_BEND_RANGE.
+"""
+
+JOURNAL_FILE = 'journal.sbj'
+JOURNAL_RECORDS = 65536
+"""
+Number of records kept (1 MiB).
+"""
+
+
+class JournalError(Exception):
+    def __init__(self, msg):
+        super().__init__('Error reading journal. ' + msg)
+
+
+Record = tuple[float, int, int, int, bytes]
+"""
+(time, kind, device, message length, message bytes)
+"""
+
+Settings = tuple[bool, int, int, int, Optional[str]]
+"""
+(MPE mode, slide mode (`SlideMode` value), fixed slide value, pitch bend range, mapping file path or None)
+"""
+
+
+class Journal:
+    def __init__(self):
+        self.file_path: Optional[str] = None
+        self.__file = None
+        self.__map: Optional[mmap.mmap] = None
+        self.__capacity = 0
+        self.__count = 0
+        """
+        Number of records written, including overwritten ones. The next record goes into slot
+        `__count % __capacity`.
+        """
+        self.__lock = threading.Lock()
+        """
+        Records are written from the input callback thread(s) and the scheduler thread.
+        """
+        self.__settings: Optional[Settings] = None
+        """
+        The settings last recorded in this session.
+        """
+
+    @property
+    def enabled(self) -> bool:
+        return self.__map is not None
+
+    def open(self, path: str = JOURNAL_FILE, capacity: int = JOURNAL_RECORDS):
+        """
+        Opens (or creates) the journal file and starts a new session. Records of previous sessions
+        are kept until the ring wraps around.
+        """
+        self.close()
+        size = HEADER.size + capacity * RECORD.size
+        count = 0
+        f = open(path, 'r+b' if os.path.isfile(path) else 'w+b')
+        try:
+            header = f.read(HEADER.size)
+            if len(header) == HEADER.size:
+                magic, old_capacity, old_count = HEADER.unpack(header)
+                if magic == MAGIC and old_capacity == capacity and os.path.getsize(path) == size:
+                    count = old_count
+            if count == 0:
+                f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+        except BaseException:
+            f.close()
+            raise
+
+        HEADER.pack_into(mm, 0, MAGIC, capacity, count)
+        self.__file = f
+        self.__map = mm
+        self.__capacity = capacity
+        self.__count = count
+        self.file_path = path
+        self.__settings = None
+        self.record(SESSION, 0, (), time.time())
+
+    def close(self):
+        with self.__lock:
+            if self.__map is None:
+                return
+            self.__map.flush()
+            self.__map.close()
+            self.__file.close()
+            self.__map = None
+            self.__file = None
+
+    def record(self, kind: int, device: int, message, t: float):
+        """
+        :param kind: INPUT, OUTPUT or SESSION
+        :param device: Index of the input device (see `main.py --inputs`) the message belongs to
+        :param message: Message bytes
+        :param t: Time of the message, seconds since the epoch
+        """
+        with self.__lock:
+            if self.__map is not None:
+                self.__write(kind, device, message, t)
+
+    def record_settings(self, settings: Settings, t: float):
+        """
+        Records the settings that input messages are handled with, so that they can be replayed with the
+        same settings (see `session_settings`). Does nothing if they didn't change since they were last
+        recorded in this session.
+        """
+        mpe_mode, slide_mode, slide_fixed_n, pitch_bend_range, mapping_path = settings
+        path = os.path.abspath(mapping_path).encode('utf-8') if mapping_path is not None else b''
+        with self.__lock:
+            if self.__map is None or settings == self.__settings:
+                return
+            self.__settings = settings
+            # written under one lock, so that the records of the mapping path aren't interleaved
+            self.__write(SETTINGS, SETTING_MODES, (int(mpe_mode), slide_mode, slide_fixed_n), t)
+            self.__write(SETTINGS, SETTING_PITCH_BEND_RANGE, (min(pitch_bend_range, 255),), t)
+            for i in range(0, len(path), 3):
+                self.__write(SETTINGS, SETTING_MAPPING, path[i:i + 3], t)
+
+    def __write(self, kind: int, device: int, message, t: float):
+        mm = self.__map
+        count = self.__count
+        RECORD.pack_into(mm, HEADER.size + count % self.__capacity * RECORD.size,
+                         t, device << 2 | kind, min(len(message), 255), bytes(message[:3]))
+        self.__count = count = count + 1
+        HEADER.pack_into(mm, 0, MAGIC, self.__capacity, count)
+
+
+def read_journal(path: str) -> list[Record]:
+    """
+    :return: All records of a journal file that haven't been overwritten, oldest first
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise JournalError(f'{path} is too short')
+    magic, capacity, count = HEADER.unpack_from(data)
+    if magic != MAGIC or len(data) < HEADER.size + capacity * RECORD.size:
+        raise JournalError(f'{path} is not a journal file')
+
+    records = []
+    for n in range(max(0, count - capacity), count):
+        t, kind, length, msg = RECORD.unpack_from(data, HEADER.size + n % capacity * RECORD.size)
+        records.append((t, kind & KIND_MASK, kind >> 2, length, msg[:length]))
+    return records
+
+
+def last_session(records: list[Record]) -> list[Record]:
+    """
+    :return: The records after the last SESSION record
+    """
+    start = 0
+    for i, (_, kind, _, _, _) in enumerate(records):
+        if kind == SESSION:
+            start = i + 1
+    return records[start:]
+
+
+def session_settings(records: list[Record]) -> Optional[Settings]:
+    """
+    :return: The settings of the last session when its first input message was received, None if they
+             weren't recorded (or were overwritten)
+    """
+    settings = None
+    modes = pitch_bend_range = None
+    path = b''
+    for _, kind, field, _, msg in last_session(records) + [(0.0, INPUT, 0, 0, b'')]:
+        if kind != SETTINGS:
+            # the end of a group of settings records
+            if modes is not None and pitch_bend_range is not None:
+                settings = (bool(modes[0]), modes[1], modes[2], pitch_bend_range,
+                            path.decode('utf-8', errors='replace') if path else None)
+            modes = pitch_bend_range = None
+            if kind == INPUT:
+                break
+        elif field == SETTING_MODES and len(msg) == 3:
+            modes = msg
+            path = b''
+        elif field == SETTING_PITCH_BEND_RANGE and len(msg) == 1:
+            pitch_bend_range = msg[0]
+        elif field == SETTING_MAPPING:
+            path += msg
+    return settings
+
+
+def input_events(records: list[Record], device: int = 0) -> list[tuple[list[int], float]]:
+    """
+    :return: Input messages of a device in the last session, as (message, deltatime) rtmidi events.
+             Truncated (sysex) messages are skipped.
+    """
+    events = []
+    prev = None
+    for t, kind, dev, length, msg in last_session(records):
+        if kind != INPUT or dev != device or length > 3:
+            continue
+        events.append((list(msg), 0.0 if prev is None else t - prev))
+        prev = t
+    return events
+
+
+def format_record(record: Record) -> str:
+    t, kind, device, length, msg = record
+    if kind == SESSION:
+        return f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))}.{int(t % 1 * 1000):03d} --- session'
+    if kind == SETTINGS:
+        if device == SETTING_MODES:
+            value = f'mpe {msg[0]}, slide mode {msg[1]}, fixed slide {msg[2]}' if length == 3 else ''
+        elif device == SETTING_PITCH_BEND_RANGE:
+            value = f'pitch bend range {msg[0]}' if length == 1 else ''
+        else:
+            value = 'mapping ' + msg.decode('utf-8', errors='replace')
+        return f'{time.strftime("%H:%M:%S", time.localtime(t))}.{int(t % 1 * 1e6):06d} --- settings {value}'
+    direction = 'in ' if kind == INPUT else 'out'
+    return f'{time.strftime("%H:%M:%S", time.localtime(t))}.{int(t % 1 * 1e6):06d} {direction}{device} ' \
+           + ' '.join(f'{b:02x}' for b in msg) + (' ...' if length > len(msg) else '')
+
+
+def dump(path: str = JOURNAL_FILE, last: Optional[int] = None, file=sys.stdout):
+    records = read_journal(path)
+    if last is not None:
+        records = records[-last:]
+    for record in records:
+        print(format_record(record), file=file)
+
+
+JOURNAL = Journal()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the records of a journal file.')
+    parser.add_argument('journal', nargs='?', default=JOURNAL_FILE, help=f'journal file (default: {JOURNAL_FILE})')
+    parser.add_argument('--last', type=int, default=None, help='only print the last n records')
+    args = parser.parse_args()
+    try:
+        dump(args.journal, args.last)
+    except (JournalError, OSError) as e:
+        print(e)
+        sys.exit(1)
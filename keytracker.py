@@ -1,31 +1,63 @@
 import threading
-import time
 from typing import Optional, Union
 
+from scheduler import SCHEDULER, ScheduledAction
+
+CC74_DOUBLE_CHECK_DELAY = 0.02
+"""
+Seconds to wait after a cc74 message received while no note is on before checking that
+the note is indeed on. See `KeyTracker.register_cc74`.
+"""
+
+WAITING = 0
+"""
+No note is on, and no cc74 message has been received since the last note off.
+A note on received in this state has to wait for its cc74 message.
+"""
+RESOLVED = 1
+"""
+No note is on, but a cc74 message was received. The next note on can be forwarded immediately.
+"""
+PENDING = 2
+"""
+A note on was received before its cc74 message. It is forwarded when the cc74 message arrives.
+"""
+ON = 3
+"""
+The note is on. cc74 messages are slide messages, pitch bend messages are forwarded.
+"""
+
 
 class ChannelWrapper:
+    """
+    State of one input channel.
+
+    All state transitions happen while holding `lock`, as they can happen on the
+    MIDI callback thread and the scheduler thread.
+    """
+    __slots__ = (
+        'lock', 'state', '_cc74', 'midi_note_received', 'on_velocity_received', 'midi_note_sent',
+        'channel_sent', 'base_pitch', 'edosteps_from_a4', '_double_check', '_cc74_count',
+    )
+
     def __init__(self):
-        self._cc74 = 0
+        self.lock = threading.Lock()
 
-        self._note_on = False
-        """
-        flag that affects whether cc74 messages or pitch bend messages get passed through
-        if not on, cc74 messages pass, else, pitch bend messages will pass.
+        self.state = WAITING
         """
+        One of WAITING, RESOLVED, PENDING, ON.
 
-        self._waiting_for_cc74 = True
-        """
         Race conditions can cause a note on event to be handled before its corresponding
         cc74 message. Das not gud.
-        This flag is set to True upon note off, and will only be set to false when a
-        cc74 message has been registered.
 
-        If a cc74 message is registered before a note on event, no problem.
+        If a cc74 message is registered before a note on event, no problem (WAITING -> RESOLVED -> ON).
         If a cc74 message is only registered after a note on event, the cc74 message
         has to act as if the note was not yet on, and the appropriate pitch bends and
-        base pitch setting must be applied.
+        base pitch setting must be applied (WAITING -> PENDING -> RESOLVED -> ON).
         """
 
+        self._cc74 = 0
+
         self.midi_note_received = 0
         """
         Stores the midi note that was received in the event that the note cannot
@@ -81,15 +113,52 @@ class ChannelWrapper:
         Raw number of edosteps from a4 that was sent to the websocket server
         """
 
+        self._double_check: Optional[ScheduledAction] = None
+        """
+        The pending cc74 double check of this channel, if any.
+        """
+
+        self._cc74_count = 0
+        """
+        Number of cc74 messages registered while no note was on. Lets a double check that was
+        already running when it got superseded recognise that it is stale.
+        """
+
+
+def _double_check(n: ChannelWrapper, cc74_count: int):
+    with n.lock:
+        if n.state == RESOLVED and n._cc74_count == cc74_count:
+            n.state = WAITING
+            n._double_check = None
+
 
 class KeyTracker:
     """
     Deals with interfacing & correlation of output events with input events.
     """
     def __init__(self):
-        self.__notes: dict[int, ChannelWrapper] = {}
-        for ch in range(0, 16):
-            self.__notes[ch] = ChannelWrapper()
+        self.__notes: list[ChannelWrapper] = [ChannelWrapper() for _ in range(0, 16)]
+
+    def note_on(self, midi_received, vel, in_channel) -> Optional[int]:
+        """
+        Called when a NOTE ON event is received.
+
+        :param midi_received: The midi note that was received from input
+        :param vel: The velocity that was received
+        :param in_channel: The input channel of the note
+        :return: The initial cc74 of the note if it can be forwarded immediately (register_on must
+                 be called once it has been). None if it has to wait for its cc74 message,
+                 it will then be returned by register_cc74.
+        """
+        n = self.__notes[in_channel]
+        with n.lock:
+            if n.state == RESOLVED or n.state == ON:
+                return n._cc74
+
+            n.midi_note_received = midi_received
+            n.on_velocity_received = vel
+            n.state = PENDING
+            return None
 
     def register_on(self, midi_received, vel, in_channel, midi_sent, send_channel, edosteps_from_a4, pitch_offset=8192):
         """
@@ -105,13 +174,16 @@ class KeyTracker:
         :param pitch_offset: The initial base pitch offset (only in MPE mode)
         """
         n = self.__notes[in_channel]
-        n.midi_note_received = midi_received
-        n.on_velocity_received = vel
-        n.midi_note_sent = midi_sent
-        n._note_on = True
-        n.base_pitch = pitch_offset
-        n.channel_sent = send_channel
-        n.edosteps_from_a4 = edosteps_from_a4
+        with n.lock:
+            SCHEDULER.cancel(n._double_check)
+            n._double_check = None
+            n.midi_note_received = midi_received
+            n.on_velocity_received = vel
+            n.midi_note_sent = midi_sent
+            n.base_pitch = pitch_offset
+            n.channel_sent = send_channel
+            n.edosteps_from_a4 = edosteps_from_a4
+            n.state = ON
 
     def register_received(self, midi_received, vel, in_channel):
         """
@@ -123,16 +195,20 @@ class KeyTracker:
         :param in_channel: The input channel that triggered this event
         """
         n = self.__notes[in_channel]
-        n.midi_note_received = midi_received
-        n.on_velocity_received = vel
+        with n.lock:
+            n.midi_note_received = midi_received
+            n.on_velocity_received = vel
+            n.state = PENDING
 
     def register_off(self, in_channel):
         """
         :param in_channel: The input channel the note off event was received on
         """
         n = self.__notes[in_channel]
-        n._note_on = False
-        n._waiting_for_cc74 = True
+        with n.lock:
+            SCHEDULER.cancel(n._double_check)
+            n._double_check = None
+            n.state = WAITING
 
     def register_cc74(self, in_channel, cc74) -> Optional[Union[int, ChannelWrapper]]:
         """
@@ -140,32 +216,40 @@ class KeyTracker:
         :param in_channel: The input channel the cc74 event was received on
         :param cc74: The cc74 value
         :return: None if the cc74 was updated, cc74 value if active, and ChannelWrapper object if waiting for cc74
-                 in order for note to be forwarded.
+                 in order for note to be forwarded (register_on must be called once it has been).
         """
         n = self.__notes[in_channel]
-        if not n._note_on:
+        with n.lock:
+            state = n.state
+            if state == ON:
+                return n._cc74
+
             n._cc74 = cc74
-            n._waiting_for_cc74 = False
+
+            if state == PENDING:
+                n.state = RESOLVED
+                return n
+
+            n.state = RESOLVED
+            n._cc74_count += 1
 
             # this cc74 message may appear after a NOTE OFF event due to thread problems
-            # to really ensure that waiting_for_cc74 isn't erroneously set to False,
+            # to really ensure that the channel isn't erroneously left resolved,
             # wait 20ms and check again that the note is indeed ON.
-            def double_check():
-                time.sleep(0.02)
-                if not n._note_on:
-                    n._waiting_for_cc74 = True
-
-            threading.Thread(target=double_check).start()
+            # A newer cc74 message supersedes the pending check.
+            SCHEDULER.cancel(n._double_check)
+            n._double_check = SCHEDULER.call_later(CC74_DOUBLE_CHECK_DELAY, _double_check, n, n._cc74_count)
             return None
-        elif n._waiting_for_cc74:
-            n._cc74 = cc74
-            n._waiting_for_cc74 = False
-            return n
-
-        return n._cc74
 
     def check_waiting_for_cc74(self, in_channel):
-        return self.__notes[in_channel]._waiting_for_cc74
+        state = self.__notes[in_channel].state
+        return state == WAITING or state == PENDING
+
+    def get_state(self, in_channel) -> int:
+        """
+        :return: One of WAITING, RESOLVED, PENDING, ON
+        """
+        return self.__notes[in_channel].state
 
     def get_initial_cc74(self, in_channel) -> int:
         return self.__notes[in_channel]._cc74
@@ -189,7 +273,6 @@ class KeyTracker:
         :return: ChannelWrapper object or none.
         """
         n = self.__notes[in_channel]
-        if n._note_on:
+        if n.state == ON:
             return n
         return None
-
@@ -0,0 +1,154 @@
+"""
+Logging for the input handling path.
+
+Printing on the MIDI callback thread can block for milliseconds when the console is slow. Instead,
+`LOG` records each message as a (level, format string, args) event into a preallocated ring buffer,
+and a background thread formats and writes them to the console. When the ring buffer is full, new
+messages are dropped and counted instead of waiting for the console.
+
+Messages are formatted with the % operator, only once they are written:
+
+    LOG.warning('note %d out of range', note)
+"""
+import sys
+import threading
+import time
+from typing import Optional
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning'}
+
+RING_SIZE = 1024
+"""
+Max number of messages waiting to be written.
+"""
+
+WRITE_INTERVAL = 0.05
+"""
+Seconds between writes of the buffered messages to the console.
+"""
+
+
+class RingLogger:
+    def __init__(self, capacity: int = RING_SIZE):
+        self.level = INFO
+        """
+        Messages below this level are ignored.
+        """
+        self.dropped = {level: 0 for level in LEVEL_NAMES}
+        """
+        Number of messages of each level dropped because the ring buffer was full.
+        """
+        self.__capacity = capacity
+        self.__ring: list[Optional[tuple[int, str, tuple]]] = [None] * capacity
+        self.__head = 0
+        """
+        Number of messages recorded. The next message goes into `__ring[__head % capacity]`.
+        """
+        self.__tail = 0
+        """
+        Number of messages taken by the writer thread.
+        """
+        self.__lock = threading.Lock()
+        self.__written = threading.Condition(threading.Lock())
+        """
+        Notified by the writer thread after each write, for `flush`.
+        """
+        self.__num_written = 0
+        """
+        Number of messages written to the console (or dropped because they failed to format/write).
+        """
+        self.__thread: Optional[threading.Thread] = None
+
+    def log(self, level: int, fmt: str, *args):
+        """
+        Records a message to be written by the writer thread. Never blocks on the console.
+
+        :param level: DEBUG, INFO or WARNING
+        :param fmt: % format string
+        :param args: Values for `fmt`. Should be immutable, they are formatted later.
+        """
+        if level < self.level:
+            return
+        with self.__lock:
+            if self.__head - self.__tail >= self.__capacity:
+                self.dropped[level] += 1
+                return
+            self.__ring[self.__head % self.__capacity] = (level, fmt, args)
+            self.__head += 1
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='log-writer', daemon=True)
+                self.__thread.start()
+
+    def debug(self, fmt: str, *args):
+        self.log(DEBUG, fmt, *args)
+
+    def info(self, fmt: str, *args):
+        self.log(INFO, fmt, *args)
+
+    def warning(self, fmt: str, *args):
+        self.log(WARNING, fmt, *args)
+
+    def flush(self, timeout: float = 1.0):
+        """
+        Waits until all messages recorded so far are written, e.g. before exiting.
+        """
+        with self.__lock:
+            target = self.__head
+            if self.__thread is None:
+                return
+        with self.__written:
+            self.__written.wait_for(lambda: self.__num_written >= target, timeout)
+
+    def __take(self) -> tuple[list[tuple[int, str, tuple]], int]:
+        """
+        :return: (messages waiting to be written, number of messages recorded including those)
+        """
+        with self.__lock:
+            events = []
+            while self.__tail < self.__head:
+                idx = self.__tail % self.__capacity
+                events.append(self.__ring[idx])
+                self.__ring[idx] = None
+                self.__tail += 1
+            return events, self.__tail
+
+    def __run(self):
+        reported = dict(self.dropped)
+        while True:
+            time.sleep(WRITE_INTERVAL)
+            events, taken = self.__take()
+
+            lines = []
+            for level, fmt, args in events:
+                try:
+                    lines.append(fmt % args if args else fmt)
+                except (TypeError, ValueError):
+                    lines.append(f'{fmt} {args!r}')
+
+            dropped = {level: n - reported[level] for level, n in self.dropped.items() if n != reported[level]}
+            if dropped:
+                reported = dict(self.dropped)
+                lines.append('log: dropped ' + ', '.join(
+                    f'{n} {LEVEL_NAMES[level]} message(s)' for level, n in dropped.items()
+                ))
+
+            if lines:
+                try:
+                    sys.stdout.write('\n'.join(lines) + '\n')
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass
+
+            with self.__written:
+                self.__num_written = taken
+                self.__written.notify_all()
+
+    def print_counters(self):
+        print('    log messages dropped: ' + ', '.join(f'{LEVEL_NAMES[level]} {n}' for level, n in self.dropped.items()))
+
+
+LOG = RingLogger()
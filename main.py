@@ -1,6 +1,12 @@
-import asyncio
+import time
+
+_STARTUP_T0 = time.perf_counter()
+
+import argparse
 import os.path
+import threading
 import traceback
+from typing import Optional
 
 # these classes are dynamically generated by rtmidi, so the unknown import error can be ignored
 from rtmidi import MidiIn, MidiOut  # type: ignore
@@ -8,18 +14,58 @@ from rtmidi.midiutil import open_midiinput, open_midioutput
 
 import configs
 import convert
+import hotreload
+import journal
 from velcurve import VelocityCurves
 import ws_server
+from bank import BANK, BankParsingError
 from configs import SlideMode, CONFIGS
-from handler import MidiInputHandler
+from handler import MidiInputHandler, mpe_channel_maps
+from journal import JOURNAL
+from log import LOG
 from mapping import Mapping, MapParsingError
 from split import SplitData
+from stats import STATS
+from voices import VoiceAllocation
+
+_root = None
+"""
+Hidden Tk root window for the file dialogs. Created when the first dialog opens, so that
+startup doesn't import tkinter when no dialog is needed.
+"""
+
+
+def tk_root():
+    global _root
+    if _root is None:
+        import tkinter as tk
+        _root = tk.Tk()
+        _root.withdraw()
+    return _root
+
 
-import tkinter.filedialog as filedialog
-import tkinter as tk
+startup_phases: list[tuple[str, float]] = []
+"""
+(phase name, seconds) of each startup phase, see `--timings`.
+"""
+_phase_start = _STARTUP_T0
 
-root = tk.Tk()
-root.withdraw()
+
+def startup_phase(name: str):
+    """
+    Marks the end of a startup phase that began at the end of the previous one (or when main.py started importing).
+    """
+    global _phase_start
+    now = time.perf_counter()
+    startup_phases.append((name, now - _phase_start))
+    _phase_start = now
+
+
+def print_startup_timings():
+    print('startup timings:')
+    for name, seconds in startup_phases:
+        print(f'    {name:<24}{seconds * 1000:>9.1f}ms')
+    print(f'    {"total":<24}{(_phase_start - _STARTUP_T0) * 1000:>9.1f}ms')
 
 def select_splits():
     while True:
@@ -77,8 +123,6 @@ def select_mapping(search_default=False):
     print('SEABOARD MAPPING SELECTION')
     print('')
 
-    root.deiconify()
-
     if search_default:
         if os.path.isfile('mappings/default.sbmap'):
             try:
@@ -92,6 +136,11 @@ def select_mapping(search_default=False):
                 print('unknown error:')
                 traceback.print_exc()
 
+    import tkinter.filedialog as filedialog
+
+    root = tk_root()
+    root.deiconify()
+
     while True:
         path = filedialog.askopenfilename(
             title='Choose seaboard map file',
@@ -115,11 +164,33 @@ def select_mapping(search_default=False):
 
     root.withdraw()
 
+def select_device_mapping(device: int) -> Optional[Mapping]:
+    """
+    Asks for a mapping to use for one of several input devices.
+
+    :return: The mapping, or None to use CONFIGS.MAPPING
+    """
+    while True:
+        path = input(f'enter .sbmap file for input device {device + 1}, '
+                     f'or leave blank to use {CONFIGS.MAPPING.mapping_file_name}: ').strip()
+        if path == '':
+            return None
+        try:
+            return Mapping(path)
+        except MapParsingError as e:
+            print(e)
+        except OSError as e:
+            print(f"can't open {path}: {e}")
+
+
 def select_vel_curve():
     print('')
     print('SEABOARD VELOCITY CURVE SELECTION')
     print('')
 
+    import tkinter.filedialog as filedialog
+
+    root = tk_root()
     root.deiconify()
 
     path = filedialog.askopenfilename(
@@ -140,6 +211,61 @@ def select_vel_curve():
     root.withdraw()
 
 
+def load_bank(path: str) -> bool:
+    try:
+        BANK.load(path)
+    except BankParsingError as e:
+        print(e)
+        return False
+    except OSError as e:
+        print(f"can't open bank {path}: {e}")
+        return False
+    CONFIGS.BANK_FILE = path
+    return True
+
+
+def select_bank():
+    print('')
+    print('MAPPING BANK SELECTION')
+    print('')
+
+    import tkinter.filedialog as filedialog
+
+    root = tk_root()
+    root.deiconify()
+
+    path = filedialog.askopenfilename(
+        title='Choose mapping bank file',
+        initialdir='./',
+        filetypes=(('Seaboard mapping bank files', '*.sbbank'),)
+    )
+    root.withdraw()
+
+    if path:
+        load_bank(path)
+
+
+def open_journal() -> bool:
+    try:
+        JOURNAL.open(journal.JOURNAL_FILE)
+    except OSError as e:
+        print(f"can't open journal {journal.JOURNAL_FILE}: {e}")
+        return False
+    record_journal_settings()
+    return True
+
+
+def record_journal_settings():
+    """
+    Records the settings that `replay.py` needs to replay the journal like it was played. Registered as
+    a configs listener, the journal skips settings that didn't change.
+    """
+    if JOURNAL.enabled:
+        mapping = getattr(CONFIGS, 'MAPPING', None)
+        JOURNAL.record_settings((CONFIGS.MPE_MODE, CONFIGS.SLIDE_MODE.value, CONFIGS.SLIDE_FIXED_N,
+                                 CONFIGS.PITCH_BEND_RANGE, mapping and mapping.file_path), time.time())
+
+
 def select_pitch_bend_range():
     while True:
         try:
@@ -151,6 +277,7 @@ def select_pitch_bend_range():
                 print('Pitch bend range has to be 1 or more')
                 continue
 
+            # every loaded mapping is recompiled for it by `configs_changed`
             CONFIGS.PITCH_BEND_RANGE = pb
             return
         except Exception:
@@ -179,35 +306,306 @@ def print_help():
                                     bip: {'(active)' if CONFIGS.SLIDE_MODE == SlideMode.BIPOLAR else '        '} (default) emulate bipolar mode
     split                       set split points (for midi mode)
     autosplit   {'(active)' if CONFIGS.AUTO_SPLIT is not None else '        '}        toggle auto-split for Pianoteq (for midi mode)
+    voices <n> [lru|rr]         output channels per split region in midi mode ({CONFIGS.VOICES_PER_SPLIT}, {'lru' if CONFIGS.VOICE_ALLOCATION == VoiceAllocation.LRU else 'rr'})
     map {CONFIGS.MAPPING.mapping_file_name:^23} select new .sbmap tuning file
     vel {CONFIGS.VELOCITY_CURVES.file_name:^23} select .vel velocity curve file
+    bank [off]  {(os.path.basename(BANK.file_path) + (f' #{BANK.active.program}' if BANK.active else '')) if BANK.file_path else 'off':<16}select .sbbank mapping bank to switch with Program Change (of any controller) / unload it
     pb          +/-{CONFIGS.PITCH_BEND_RANGE:<8}     change pitch bend amount
     sus         {'-' if CONFIGS.TOGGLE_SUSTAIN else '+'}               toggles sustain pedal polarity
     velsm       {'on ' if CONFIGS.VELOCITY_SMOOTHING else 'off'}             toggles velocity smoothing
+    velsm alpha|effect|bias <x> pressure average rate (alpha: {CONFIGS.SMOOTHING_ALPHA:g}) / max curve exponent change (effect: {CONFIGS.SMOOTHING_EFFECT:g}) / mid exponent (bias: {CONFIGS.SMOOTHING_BIAS:g})
+    watch       {'on ' if hotreload.WATCHER.is_running() else 'off'}             toggles reloading the .sbmap/.vel files when they change
+    filter      {'on ' if CONFIGS.OUTPUT_FILTER else 'off'}             toggles dropping repeated cc/pitch bend/pressure output messages
+    filter cc|pb|rate <n>       drop changes smaller than n (cc: {CONFIGS.FILTER_MIN_CC_CHANGE}, pb: {CONFIGS.FILTER_MIN_PB_CHANGE}) / over n per second (rate: {CONFIGS.FILTER_MAX_RATE:g}, 0 = no limit)
+    decimate    {'on ' if CONFIGS.INPUT_DECIMATION else 'off'}             toggles dropping incoming pressure/slide/pitch bend messages that change little
+    decimate cc|pb|rate <n>     ignore input changes smaller than n (cc: {CONFIGS.DECIMATE_MIN_CC_CHANGE}, pb: {CONFIGS.DECIMATE_MIN_PB_CHANGE}) / over n per second (rate: {CONFIGS.DECIMATE_MAX_RATE:g}, 0 = no limit)
     save                        saves all current settings (not automatic)
     debug       {'on ' if CONFIGS.DEBUG else 'off'}             toggles debug mode
+    journal     {'on ' if JOURNAL.enabled else 'off'}             toggles recording input/output messages to {journal.JOURNAL_FILE}
+    journal dump [n]            print the last n (20) journal records
+    stats [on|off|reset]        print handler latency stats and counters / toggle timing / reset
     exit                        exit the program
     """)
 
 
+def parse_filter_setting(s: str) -> Optional[tuple]:
+    """
+    Parses the arguments of the `filter`/`decimate` commands.
+
+    :return: () to toggle, ('cc'|'pb'|'rate', value) to change a setting, or None if invalid.
+    """
+    command, *args = s.split()
+    if len(args) == 0:
+        return ()
+    if len(args) != 2 or args[0] not in ('cc', 'pb', 'rate'):
+        print(f'Usage: {command} | {command} cc <n> | {command} pb <n> | {command} rate <n>')
+        return None
+    try:
+        n = float(args[1]) if args[0] == 'rate' else int(args[1])
+        if n < 0 or (args[0] != 'rate' and n < 1):
+            raise ValueError
+    except ValueError:
+        print(f'{command} cc/pb needs a whole number >= 1, {command} rate a number >= 0')
+        return None
+    return args[0], n
+
+
+PROMPT_COMMANDS = ('split', 'map', 'vel', 'pb', 'bank')
+"""
+Commands that prompt for input. With `--asyncio`, these run on the main thread instead of the
+event loop (see `eventloop.py`).
+"""
+
+
+def handle_command(s: str):
+    """
+    Handles one REPL command (other than exit). Does not call `configs.configs_changed`.
+    """
+    if s == 'save':
+        configs.save_configs()
+    elif s == 'mpe':
+        print('MPE mode active')
+        CONFIGS.MPE_MODE = True
+    elif s == 'midi':
+        print('MIDI mode active')
+        CONFIGS.MPE_MODE = False
+    elif s.startswith('slide'):
+        if 'none' in s:
+            CONFIGS.SLIDE_MODE = SlideMode.FIXED
+            CONFIGS.SLIDE_FIXED_N = 64
+            print('Defaulting slide dimension (cc74) to 64')
+        elif 'prs' in s or 'press' in s:
+            CONFIGS.SLIDE_MODE = SlideMode.PRESS
+            print('Forwarding press dimension to cc74')
+        elif 'rel' in s or 'relative' in s:
+            CONFIGS.SLIDE_MODE = SlideMode.RELATIVE
+            print('Relative slide mode activated')
+        elif 'abs' in s or 'absolute' in s:
+            CONFIGS.SLIDE_MODE = SlideMode.ABSOLUTE
+            print('Absolute slide mode activated')
+        elif 'bip' in s or 'bipolar' in s:
+            CONFIGS.SLIDE_MODE = SlideMode.BIPOLAR
+            print('Bipolar slide mode activated')
+        else:
+            try:
+                n = int(s[5:])
+                if 0 > n > 127:
+                    print('Default slide value must be an integer from 0-127 inclusive')
+                else:
+                    CONFIGS.SLIDE_MODE = SlideMode.FIXED
+                    CONFIGS.SLIDE_FIXED_N = n
+            except Exception:
+                print("""Unsupported slide mode. Valid slide modes are:
+                    <n>: fixed slide value (choose from 0-127)
+                    prs: map to press dimension
+                    rel: emulate relative slide mode
+                    abs: emulate absolute slide mode
+                    bip: (default) emulate bipolar mode
+                """)
+                pass
+    elif s == 'split':
+        select_splits()
+    elif s == 'autosplit':
+        if CONFIGS.AUTO_SPLIT is not None:
+            CONFIGS.AUTO_SPLIT = None
+        else:
+            CONFIGS.AUTO_SPLIT = SplitData(CONFIGS.MAPPING)
+        print(f'Auto Split: {"on" if CONFIGS.AUTO_SPLIT is not None else "off"}')
+    elif s.startswith('voices'):
+        args = s.split()[1:]
+        try:
+            n = int(args[0])
+            if not 1 <= n <= 16:
+                raise ValueError
+        except (IndexError, ValueError):
+            print('Usage: voices <number of channels per split region (1-16)> [lru|rr]')
+            return
+        if len(args) > 1:
+            if args[1] == 'rr':
+                CONFIGS.VOICE_ALLOCATION = VoiceAllocation.ROUND_ROBIN
+            elif args[1] == 'lru':
+                CONFIGS.VOICE_ALLOCATION = VoiceAllocation.LRU
+            else:
+                print('Voice allocation must be lru (least recently used channel) or rr (round robin)')
+                return
+        CONFIGS.VOICES_PER_SPLIT = n
+        splits = CONFIGS.AUTO_SPLIT if CONFIGS.AUTO_SPLIT is not None else CONFIGS.SPLITS
+        regions = splits.get_num_channels_used()
+        if n * regions > 16:
+            print(f'Only {16 // regions} channels per split region fit in 16 channels with {regions} split regions')
+        print(f'MIDI mode voices: {min(n, 16 // regions)} channel(s) per split region, '
+              f'{"round robin" if CONFIGS.VOICE_ALLOCATION == VoiceAllocation.ROUND_ROBIN else "least recently used"}')
+    elif s == 'map':
+        select_mapping()
+        if (program := BANK.deselect()) is not None:
+            print(f'Bank program {program} deselected, {CONFIGS.MAPPING.mapping_file_name} is used until the '
+                  f'next Program Change.')
+    elif s == 'vel':
+        select_vel_curve()
+        print('Press octave switch to track octave offset.')
+    elif s == 'bank':
+        select_bank()
+        print('Send a Program Change message to switch to a program of the bank.')
+    elif s == 'bank off':
+        BANK.unload()
+        CONFIGS.BANK_FILE = None
+        print('Mapping bank unloaded, Program Change messages are forwarded.')
+    elif s.startswith('velsm'):
+        args = s.split()[1:]
+        if len(args) == 0:
+            CONFIGS.VELOCITY_SMOOTHING = not CONFIGS.VELOCITY_SMOOTHING
+        else:
+            try:
+                if len(args) != 2 or args[0] not in ('alpha', 'effect', 'bias'):
+                    raise ValueError
+                x = float(args[1])
+                if x < 0 or (args[0] == 'alpha' and x > 1):
+                    raise ValueError
+            except ValueError:
+                print('Usage: velsm | velsm alpha <0-1> | velsm effect <x> | velsm bias <x>')
+                return
+            effect = x if args[0] == 'effect' else CONFIGS.SMOOTHING_EFFECT
+            bias = x if args[0] == 'bias' else CONFIGS.SMOOTHING_BIAS
+            if effect > bias:
+                print(f'The effect ({effect:g}) can\'t be larger than the bias ({bias:g}), or playing with a heavy '
+                      f'touch would give every note full velocity.')
+                return
+            setattr(CONFIGS, 'SMOOTHING_' + args[0].upper(), x)
+            CONFIGS.VELOCITY_SMOOTHING = True
+        print(f'Velocity Smoothing: {"on" if CONFIGS.VELOCITY_SMOOTHING else "off"} '
+              f'(alpha {CONFIGS.SMOOTHING_ALPHA:g}, effect {CONFIGS.SMOOTHING_EFFECT:g}, '
+              f'bias {CONFIGS.SMOOTHING_BIAS:g})')
+    elif s == 'pb':
+        select_pitch_bend_range()
+    elif s == 'sus':
+        CONFIGS.TOGGLE_SUSTAIN = not CONFIGS.TOGGLE_SUSTAIN
+        print(f'Invert sustain: {"on" if CONFIGS.TOGGLE_SUSTAIN else "off"}')
+    elif s.startswith('stats'):
+        if 'on' in s:
+            STATS.enabled = True
+            print('Latency stats timing on')
+        elif 'off' in s:
+            STATS.enabled = False
+            print('Latency stats timing off')
+        elif 'reset' in s:
+            STATS.reset()
+            print('Stats reset')
+        else:
+            STATS.print()
+            LOG.print_counters()
+    elif s.startswith('filter'):
+        setting = parse_filter_setting(s)
+        if setting is None:
+            return
+        if setting == ():
+            CONFIGS.OUTPUT_FILTER = not CONFIGS.OUTPUT_FILTER
+        else:
+            setattr(CONFIGS, {'cc': 'FILTER_MIN_CC_CHANGE', 'pb': 'FILTER_MIN_PB_CHANGE',
+                              'rate': 'FILTER_MAX_RATE'}[setting[0]], setting[1])
+            CONFIGS.OUTPUT_FILTER = True
+        print(f'Output filter: {"on" if CONFIGS.OUTPUT_FILTER else "off"} (min cc change {CONFIGS.FILTER_MIN_CC_CHANGE}, '
+              f'min pitch bend change {CONFIGS.FILTER_MIN_PB_CHANGE}, '
+              f'max rate {CONFIGS.FILTER_MAX_RATE:g}/s)')
+    elif s.startswith('decimate'):
+        setting = parse_filter_setting(s)
+        if setting is None:
+            return
+        if setting == ():
+            CONFIGS.INPUT_DECIMATION = not CONFIGS.INPUT_DECIMATION
+        else:
+            setattr(CONFIGS, {'cc': 'DECIMATE_MIN_CC_CHANGE', 'pb': 'DECIMATE_MIN_PB_CHANGE',
+                              'rate': 'DECIMATE_MAX_RATE'}[setting[0]], setting[1])
+            CONFIGS.INPUT_DECIMATION = True
+        print(f'Input decimation: {"on" if CONFIGS.INPUT_DECIMATION else "off"} '
+              f'(min pressure/slide change {CONFIGS.DECIMATE_MIN_CC_CHANGE}, '
+              f'min pitch bend change {CONFIGS.DECIMATE_MIN_PB_CHANGE}, '
+              f'max rate {CONFIGS.DECIMATE_MAX_RATE:g}/s)')
+    elif s == 'journal':
+        if JOURNAL.enabled:
+            JOURNAL.close()
+            CONFIGS.JOURNAL = False
+        else:
+            CONFIGS.JOURNAL = open_journal()
+        print(f'Journal: {"on, recording to " + journal.JOURNAL_FILE if JOURNAL.enabled else "off"}')
+    elif s.startswith('journal dump'):
+        args = s.split()[2:]
+        try:
+            last = int(args[0]) if args else 20
+        except ValueError:
+            print('Usage: journal dump [number of records]')
+            return
+        try:
+            journal.dump(journal.JOURNAL_FILE, last)
+        except (journal.JournalError, OSError) as e:
+            print(e)
+    elif s == 'watch':
+        if hotreload.WATCHER.is_running():
+            hotreload.WATCHER.stop()
+        else:
+            hotreload.WATCHER.start()
+        print(f'Reload mapping/velocity curve files on change: {"on" if hotreload.WATCHER.is_running() else "off"}')
+    elif s == 'debug':
+        CONFIGS.DEBUG = not CONFIGS.DEBUG
+        print(f'Debug mode: {"on" if CONFIGS.DEBUG else "off"}')
+    else:
+        print_help()
+
+
+def run_command(s: str):
+    handle_command(s)
+    # recompile anything specialised for the previous settings
+    configs.configs_changed()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='microtonal seaboard retuner')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='handle MIDI, websocket output and commands on a single asyncio event loop')
+    parser.add_argument('--inputs', type=int, default=1,
+                        help='number of input controllers to open, each with its own key tracking (default: 1)')
+    parser.add_argument('--watch', action='store_true',
+                        help='reload the .sbmap/.vel files whenever they change (same as the watch command)')
+    parser.add_argument('--bank', default=None,
+                        help='.sbbank file of mappings/velocity curves to switch between with Program Change messages')
+    parser.add_argument('--no-journal', action='store_true',
+                        help=f"don't record input/output messages in {journal.JOURNAL_FILE} (see the journal command)")
+    parser.add_argument('--timings', action='store_true', help='print how long each startup phase took')
+    args = parser.parse_args()
+    startup_phase('imports')
+
     print('microtonal seaboard retuner v0.6.2')
 
     has_read_configs = configs.read_configs()
+    startup_phase('read configs')
 
     if not has_read_configs:
         select_mapping(search_default=True)
+        startup_phase('select mapping')
+
+    if args.bank is not None or CONFIGS.BANK_FILE is not None:
+        load_bank(args.bank if args.bank is not None else CONFIGS.BANK_FILE)
+        startup_phase('load bank')
+
+    if CONFIGS.JOURNAL and not args.no_journal:
+        open_journal()
+        startup_phase('open journal')
 
     print('')
     print('MIDI IN/OUT DEVICE SELECTION')
     print('')
 
     try:
-        print('Select the Seaboard MIDI input device:')
-        seaboard: MidiIn = open_midiinput()[0]
+        seaboards: list[MidiIn] = []
+        for i in range(args.inputs):
+            if args.inputs == 1:
+                print('Select the Seaboard MIDI input device:')
+            else:
+                print(f'Select MIDI input device {i + 1} of {args.inputs}:')
+            seaboards.append(open_midiinput()[0])
 
         print('Select the virtual MIDI output port that gets sent to the DAW/VST/Program:')
         virtual_port: MidiOut = open_midioutput()[0]
+        startup_phase('open MIDI ports')
     except Exception:
         print('\n\n__________________________\nError opening MIDI ports:')
         traceback.print_exc()
@@ -215,9 +613,14 @@ if __name__ == '__main__':
         import sys
         sys.exit(1)
 
+    device_mappings: list[Optional[Mapping]] = [None] * args.inputs
+    if args.inputs > 1:
+        device_mappings = [select_device_mapping(i) for i in range(args.inputs)]
+
     if not has_read_configs:
         print('')
         select_pitch_bend_range()
+        startup_phase('pitch bend range')
 
     print()
 
@@ -226,86 +629,62 @@ if __name__ == '__main__':
     print(f'Starting microtonal message forwarding in '
           f'{"MPE" if CONFIGS.MPE_MODE else "MIDI"} mode...')
 
-    ws_server.start_ws_server()
-
-    seaboard.set_callback(MidiInputHandler(virtual_port))
+    if args.inputs > 1:
+        # devices share the output port, give each its own block of MPE member channels
+        port_lock = threading.Lock()
+        channel_maps = mpe_channel_maps(args.inputs)
+        for i, channel_map in enumerate(channel_maps):
+            print(f'input device {i + 1}: MPE member channels / MIDI mode channels '
+                  f'{channel_map[1] + 1}-{max(channel_map) + 1}')
+        handlers = [
+            MidiInputHandler(virtual_port, device_mappings[i], channel_maps[i], port_lock, device=i)
+            for i in range(args.inputs)
+        ]
+    else:
+        handlers = [MidiInputHandler(virtual_port)]
+
+    # the pitch bend range may have been entered after the journal was opened
+    record_journal_settings()
+    configs.add_listener(record_journal_settings)
+
+    if args.asyncio:
+        import eventloop
+        eventloop.start(list(zip(seaboards, handlers)))
+        hotreload.WATCHER.run_swap = eventloop.call
+    else:
+        ws_server.start_ws_server()
+        # each input port calls its handler on its own callback thread
+        for seaboard, handler in zip(seaboards, handlers):
+            seaboard.set_callback(handler)
+    startup_phase('start forwarding')
+
+    if args.watch:
+        hotreload.WATCHER.start()
+
+    if args.timings:
+        print_startup_timings()
 
     while True:
         s = input('>> ').strip().lower()
 
         if s == 'exit':
             print('closing port connections')
+            LOG.flush()
+            if args.asyncio:
+                eventloop.stop()
+            for handler in handlers:
+                handler.close()
             del virtual_port
-            del seaboard
+            del seaboards
+            JOURNAL.close()
             import sys
             sys.exit(0)
-        if s == 'save':
-            configs.save_configs()
-        elif s == 'mpe':
-            print('MPE mode active')
-            CONFIGS.MPE_MODE = True
-        elif s == 'midi':
-            print('MIDI mode active')
-            CONFIGS.MPE_MODE = False
-        elif s.startswith('slide'):
-            if 'none' in s:
-                CONFIGS.SLIDE_MODE = SlideMode.FIXED
-                CONFIGS.SLIDE_FIXED_N = 64
-                print('Defaulting slide dimension (cc74) to 64')
-            elif 'prs' in s or 'press' in s:
-                CONFIGS.SLIDE_MODE = SlideMode.PRESS
-                print('Forwarding press dimension to cc74')
-            elif 'rel' in s or 'relative' in s:
-                CONFIGS.SLIDE_MODE = SlideMode.RELATIVE
-                print('Relative slide mode activated')
-            elif 'abs' in s or 'absolute' in s:
-                CONFIGS.SLIDE_MODE = SlideMode.ABSOLUTE
-                print('Absolute slide mode activated')
-            elif 'bip' in s or 'bipolar' in s:
-                CONFIGS.SLIDE_MODE = SlideMode.BIPOLAR
-                print('Bipolar slide mode activated')
-            else:
-                try:
-                    n = int(s[5:])
-                    if 0 > n > 127:
-                        print('Default slide value must be an integer from 0-127 inclusive')
-                        continue
 
-                    CONFIGS.SLIDE_MODE = SlideMode.FIXED
-                    CONFIGS.SLIDE_FIXED_N = n
-                    continue
-                except Exception:
-                    print("""Unsupported slide mode. Valid slide modes are:
-                        <n>: fixed slide value (choose from 0-127)
-                        prs: map to press dimension
-                        rel: emulate relative slide mode
-                        abs: emulate absolute slide mode
-                        bip: (default) emulate bipolar mode
-                    """)
-                    pass
-        elif s == 'split':
-            select_splits()
-        elif s == 'autosplit':
-            if CONFIGS.AUTO_SPLIT is not None:
-                CONFIGS.AUTO_SPLIT = None
-            else:
-                CONFIGS.AUTO_SPLIT = SplitData(CONFIGS.MAPPING)
-            print(f'Auto Split: {"on" if CONFIGS.AUTO_SPLIT is not None else "off"}')
-        elif s == 'map':
-            select_mapping()
-        elif s == 'vel':
-            select_vel_curve()
-            print('Press octave switch to track octave offset.')
-        elif s == 'velsm':
-            CONFIGS.VELOCITY_SMOOTHING = not CONFIGS.VELOCITY_SMOOTHING
-            print(f'Velocity Smoothing: {"on" if CONFIGS.VELOCITY_SMOOTHING else "off"}')
-        elif s == 'pb':
-            select_pitch_bend_range()
-        elif s == 'sus':
-            CONFIGS.TOGGLE_SUSTAIN = not CONFIGS.TOGGLE_SUSTAIN
-            print(f'Invert sustain: {"on" if CONFIGS.TOGGLE_SUSTAIN else "off"}')
-        elif s == 'debug':
-            CONFIGS.DEBUG = not CONFIGS.DEBUG
-            print(f'Debug mode: {"on" if CONFIGS.DEBUG else "off"}')
+        if not args.asyncio:
+            run_command(s)
+        elif s in PROMPT_COMMANDS:
+            handle_command(s)
+            eventloop.call(configs.configs_changed)
         else:
-            print_help()
+            eventloop.call(run_command, s)
+
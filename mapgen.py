@@ -0,0 +1,246 @@
+"""
+Parametric .sbmap mapping generator.
+
+Generates a mapping from a tuning (steps per period, period, generator, reference pitch) and a key
+zone layout, instead of a one-off script per EDO (see `mapping_generator/edo31.py`).
+
+The 7 natural notes are placed on a chain of generators (fifths) around A: F C G D A E B. Each key
+is split into zones along its slide (cc74) axis, and each zone plays a note relative to the natural
+of the key (white keys) or to the naturals below/above the key (black keys), offset by a number of
+chromas (sharps, 7 generators - 4 periods) and steps.
+
+Usage (from the repository root):
+
+    python mapgen.py <edos, e.g. 31 or 5-72 or 12,19,31> [--layout five-three] [--a4 440] [--out-dir mappings] [--cache]
+
+Several EDOs are generated in parallel, one process per mapping.
+"""
+import argparse
+import contextlib
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import convert
+
+Zone = tuple[int, str, int, int]
+"""
+(exclusive upper bound cc74, anchor, chromas, steps). The anchor is 'nat' (the natural of a white key),
+'below' or 'above' (the natural below/above a black key). The zone plays anchor + chromas * chroma + steps.
+"""
+
+LAYOUTS: dict[str, tuple[list[Zone], list[Zone], list[str]]] = {
+    'five-three': (
+        [(30, 'nat', 0, -1), (50, 'nat', 0, 0), (73, 'nat', 0, 1), (98, 'nat', 0, 0), (128, 'nat', 0, 1)],
+        [(76, 'below', 1, 0), (109, 'above', -1, 0), (128, 'above', 0, 1)],
+        ['White key: down, natural, up, natural, up',
+         'Black key: sharp, flat, up of the next white key'],
+    ),
+    'three-two': (
+        [(30, 'nat', 0, -1), (50, 'nat', 0, 0), (128, 'nat', 0, 1)],
+        [(76, 'below', 1, -1), (128, 'below', 1, 0)],
+        ['White key: down, natural, up',
+         'Black key: sharp-down, sharp'],
+    ),
+}
+"""
+Zone layouts of white and black keys, and their description. 'five-three' is the layout of the default
+31 edo mapping, 'three-two' the one of the 22 edo mapping.
+"""
+
+WHITE_KEYS = (True, False, True, False, True, True, False, True, False, True, False, True)
+"""
+Whether each pitch class (C = 0) is a white key.
+"""
+FIFTHS_FROM_A = (-3, 0, -1, 0, 1, -4, 0, -2, 0, 0, 0, 2)
+"""
+Position of each natural pitch class on the chain of fifths, relative to A (black keys unused).
+"""
+PITCH_CLASS_A = 9
+MIDI_NOTE_A4 = convert.notename_to_midinum('a4')
+
+
+class Tuning:
+    def __init__(self, steps_per_period: int, period_cents: float = 1200.0,
+                 generator_steps: Optional[int] = None, a4_hz: float = 440.0):
+        """
+        :param steps_per_period: Number of steps in a period, e.g. 31 for 31 edo
+        :param period_cents: Size of the period. Each octave of keys on the Seaboard spans one period.
+        :param generator_steps: Size of the generator (fifth) in steps, defaults to the closest to a 3/2
+        :param a4_hz: Frequency of A4, which is step 0
+        """
+        self.steps_per_period = steps_per_period
+        self.period_cents = period_cents
+        self.step_cents = period_cents / steps_per_period
+        self.generator_steps = generator_steps if generator_steps is not None \
+            else round(1200 * math.log2(3 / 2) / self.step_cents)
+        self.chroma = 7 * self.generator_steps - 4 * steps_per_period
+        self.a4_hz = a4_hz
+        self.a4_cents = 1200 * math.log2(a4_hz / 440)
+        """
+        Offset of the reference pitch from A4 = 440Hz, added to every cents value.
+        """
+
+        self.naturals = [0] * 12
+        """
+        Steps from A of the natural of each white key pitch class, within the period of that A
+        (C to G below A, B above).
+        """
+        for pc in range(12):
+            if WHITE_KEYS[pc]:
+                steps = FIFTHS_FROM_A[pc] * self.generator_steps % steps_per_period
+                if pc < PITCH_CLASS_A and steps > 0:
+                    steps -= steps_per_period
+                self.naturals[pc] = steps
+
+    def name(self) -> str:
+        if self.period_cents == 1200.0:
+            return f'{self.steps_per_period} edo'
+        return f'{self.steps_per_period} equal divisions of {self.period_cents:g} cents'
+
+
+def generate_grid(tuning: Tuning, layout: str) -> list[list[tuple[int, float, int]]]:
+    """
+    Computes the zones of all 128 keys.
+
+    :return: For each midi note, the (exclusive upper bound cc74, cents offset, steps from A4) of its zones
+    """
+    white_zones, black_zones, _ = LAYOUTS[layout]
+    notes = range(128)
+    pcs = [n % 12 for n in notes]
+    periods = [(n // 12 - 5) * tuning.steps_per_period for n in notes]
+    naturals = tuning.naturals
+    # anchors of every key: white keys use their own natural, black keys the naturals around them
+    anchors = {
+        'nat': [naturals[pc] + p for pc, p in zip(pcs, periods)],
+        'below': [naturals[pc - 1] + p - (tuning.steps_per_period if pc == 0 else 0)
+                  for pc, p in zip(pcs, periods)],
+        'above': [naturals[(pc + 1) % 12] + p + (tuning.steps_per_period if pc == 11 else 0)
+                  for pc, p in zip(pcs, periods)],
+    }
+    semitone_cents = [(n - MIDI_NOTE_A4) * 100 - tuning.a4_cents for n in notes]
+    step_cents = tuning.step_cents
+
+    columns = []
+    for is_white, zones in ((True, white_zones), (False, black_zones)):
+        for cc74, anchor, chromas, steps in zones:
+            offset = chromas * tuning.chroma + steps
+            zone_steps = [a + offset for a in anchors[anchor]]
+            columns.append((is_white, cc74, zone_steps,
+                            [s * step_cents - c for s, c in zip(zone_steps, semitone_cents)]))
+
+    return [
+        [(cc74, cents[n], steps[n]) for is_white, cc74, steps, cents in columns if is_white == WHITE_KEYS[pcs[n]]]
+        for n in notes
+    ]
+
+
+def sbmap_text(tuning: Tuning, layout: str) -> str:
+    """
+    :return: Contents of the .sbmap file of the mapping
+    """
+    description = [
+        f'{tuning.name()} mapping for seaboard, generated by mapgen.py ({layout} layout).',
+        f'pitch bends in MPE mode are based on A4 = {tuning.a4_hz:g}Hz',
+        '',
+        'Key splits (bottom-to-top):',
+        *('    ' + line for line in LAYOUTS[layout][2]),
+        '',
+        'Supports MIDI mode, A4 is the anchoring equivalent note.',
+        'Each step raises midi output by 1 semitone.',
+    ]
+    lines = [('/   ' + line).rstrip() for line in description]
+
+    for midinote, zones in enumerate(generate_grid(tuning, layout)):
+        line = f'{convert.midinum_to_12edo_name(midinote):<4}'
+        for cc74, cents, steps in zones:
+            line += f' {cc74:>3} {cents:>8.4f} {steps:>4}'
+        lines.append(line)
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_sbmap(path: str, tuning: Tuning, layout: str, cache: bool = False):
+    """
+    Writes the mapping to a .sbmap file.
+
+    :param cache: Whether to also write the compiled `.sbmap.cache` file, so the mapper doesn't have to
+                  parse the mapping when it is first loaded.
+    """
+    with open(path, 'w') as f:
+        f.write(sbmap_text(tuning, layout))
+
+    if cache:
+        import configs  # noqa: F401, mapping can only be imported after configs
+        from mapping import Mapping
+        # loading the mapping writes its cache
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            Mapping(path)
+
+
+def _generate_file(job: tuple) -> tuple[str, float]:
+    t0 = time.perf_counter()
+    path, steps, period, generator, a4_hz, layout, cache = job
+    write_sbmap(path, Tuning(steps, period, generator, a4_hz), layout, cache)
+    return path, time.perf_counter() - t0
+
+
+def parse_edos(s: str) -> list[int]:
+    """
+    :param s: e.g. '31', '5-72' or '12,19,22-24'
+    """
+    edos = []
+    for part in s.split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            edos.extend(range(int(lo), int(hi) + 1))
+        else:
+            edos.append(int(part))
+    return edos
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Generate .sbmap mappings for equal divisions of a period.')
+    parser.add_argument('edos', help='steps per period to generate, e.g. 31, 5-72 or 12,19,31')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='five-three',
+                        help='key zone layout (default: five-three)')
+    parser.add_argument('--period', type=float, default=1200.0, help='period in cents (default: 1200)')
+    parser.add_argument('--generator', type=int, default=None,
+                        help='generator (fifth) in steps (default: closest to 3/2)')
+    parser.add_argument('--a4', type=float, default=440.0, help='frequency of A4 in Hz (default: 440)')
+    parser.add_argument('--out-dir', default='mappings', help='directory to write <n>edo.sbmap files to')
+    parser.add_argument('--cache', action='store_true', help='also write the compiled .sbmap.cache files')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+
+    try:
+        edos = parse_edos(args.edos)
+    except ValueError:
+        parser.error(f'invalid edos: {args.edos}')
+    if any(n < 1 for n in edos):
+        parser.error('steps per period must be at least 1')
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    jobs = [
+        (os.path.join(args.out_dir, f'{n}edo.sbmap'), n, args.period, args.generator, args.a4, args.layout, args.cache)
+        for n in edos
+    ]
+
+    t0 = time.perf_counter()
+    if len(jobs) == 1:
+        results = [_generate_file(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(_generate_file, jobs))
+
+    for path, seconds in results:
+        print(f'{path} ({seconds * 1000:.1f}ms)')
+    print(f'generated {len(results)} mapping(s) in {time.perf_counter() - t0:.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,73 @@
+import hashlib
+import mmap
 import re
+import struct
+import sys
+import weakref
+from array import array
 
 import configs
 import convert
 import os
 
+TABLE_SIZE = 128 * 128
+"""
+Number of entries of the dense (midinote, cc74) lookup tables.
+"""
+
+CACHE_SUFFIX = '.cache'
+"""
+Compiled mappings are cached next to the .sbmap file, e.g. `mappings/default.sbmap.cache`.
+"""
+CACHE_MAGIC = b'SBMC'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sHBxqq32sHI2x')
+"""
+magic, version, byte order of the tables (0 = little, 1 = big endian), source file mtime (ns),
+source file size, source file sha256, pitch bend range of the pitch bend tables,
+size of the utf-8 description. 64 bytes.
+
+The header is followed by the step table (int32), cents table (float64), pitch bend table (uint16),
+pitch bend lsb and msb tables (uint8), each `TABLE_SIZE` entries in the byte order given in the
+header, then the description lines of the mapping.
+"""
+_CACHE_TABLES = (('i', 4), ('d', 8), ('H', 2), ('B', 1), ('B', 1))
+_BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
 
 class MapParsingError(Exception):
     def __init__(self, msg):
         super().__init__('Error parsing mapping. ' + msg)
 
+
+def cache_path(sbm_file_path: str) -> str:
+    return sbm_file_path + CACHE_SUFFIX
+
+
+def file_sha256(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+_LIVE_MAPPINGS: 'weakref.WeakSet[Mapping]' = weakref.WeakSet()
+"""
+Every loaded mapping (current mapping, per device mappings, bank slots), so that their pitch bend
+tables can be recompiled when the pitch bend range changes.
+"""
+
+
+def recompile_pitchbend_tables():
+    """
+    Recompiles the pitch bend tables of every loaded mapping that was compiled for another pitch bend
+    range than `CONFIGS.PITCH_BEND_RANGE`. Registered as a configs listener, so that pitch bend lookups
+    on note on never have to check the range.
+    """
+    pb_range = configs.CONFIGS.PITCH_BEND_RANGE
+    for m in list(_LIVE_MAPPINGS):
+        if m.pitch_bend_range != pb_range:
+            m.compile_pitchbend_tables(pb_range)
+
+
 class Mapping:
     def __init__(self, sbm_file_path: str):
         self.__keys = {}
@@ -32,20 +91,85 @@ class Mapping:
                 - 30-59: 0 cents, will play Bb4 in MIDI mode
                 - 60-89: 10 cents, will play B4 in MIDI mode
                 - 90-127: 0 cents, will play C5 in MIDI mode
+
+                None when the mapping was loaded from its compiled cache file, in which case
+                it is reconstructed from the tables when needed (see `__getstate__`).
+        """
+
+        self.__description: list[str] = []
+        """
+        Description lines of the mapping file (lines starting with /), printed when the mapping is loaded.
+        """
+
+        self.__step_table = array('i')
+        """
+        Dense (midinote, cc74) -> steps from A4 lookup table, indexed by `midinote << 7 | cc74`.
+
+        Compiled from `__keys` by `compile_tables`, or a read only memoryview of the memory mapped
+        cache file. The other tables are the same.
+        """
+
+        self.__cents_table = array('d')
+        """
+        Dense (midinote, cc74) -> cents offset lookup table, indexed by `midinote << 7 | cc74`.
+
+        Kept so that the pitch bend tables can be recompiled when the pitch bend range changes.
+        """
+
+        self.__pb_table = array('H')
+        """
+        Dense (midinote, cc74) -> pitch bend (0-16383) lookup table, indexed by `midinote << 7 | cc74`.
+
+        Only valid for the pitch bend range in `__pb_range`.
+        """
+
+        self.__pb_lsb = bytearray()
+        self.__pb_msb = bytearray()
+        """
+        `__pb_table` already split into the (lsb, msb) data bytes of a pitch bend message.
+        """
+
+        self.__pb_range = 0
+        """
+        The `CONFIGS.PITCH_BEND_RANGE` the pitch bend tables were compiled for.
         """
 
         self.load_mapping(sbm_file_path)
+        _LIVE_MAPPINGS.add(self)
         self.mapping_file_name = os.path.basename(sbm_file_path)
+        self.file_path = sbm_file_path
+        """
+        Path of the loaded .sbmap file, used to save the mapping in the configs by reference.
+        """
 
         # Add heuristic for how many edosteps per octave (assumes octaves are mapped all the same on the seaboard)
         # Calculate step offset difference between lowest split of C4 to C5 to get EDO
-        self.edo = self.__keys[convert.notename_to_midinum('c5')][0][2] - self.__keys[convert.notename_to_midinum('c4')][0][2]
+        self.edo = self.calc_notes_from_a4(convert.notename_to_midinum('c5'), 0) - self.calc_notes_from_a4(convert.notename_to_midinum('c4'), 0)
         '''
         A heuristic guess on how many steps correspond to an octave. Used for auto splitting in MIDI mode.
         '''
 
-    def load_mapping(self, sbm_file_path: str):
+    def load_mapping(self, sbm_file_path: str, use_cache=True):
+        """
+        Loads a .sbmap mapping file.
+
+        :param sbm_file_path: path to the .sbmap file
+        :param use_cache: Whether to load the compiled mapping from its cache file (see `CACHE_HEADER`)
+                          if it is up to date with the .sbmap file, and to write the cache file after
+                          parsing the .sbmap file otherwise.
+        """
+        if use_cache and self.__load_cache(sbm_file_path):
+            if self.__pb_range != configs.CONFIGS.PITCH_BEND_RANGE:
+                # cached for another pitch bend range
+                self.compile_pitchbend_tables(configs.CONFIGS.PITCH_BEND_RANGE)
+            for line in self.__description:
+                print(line)
+            print('Mapping loaded!')
+            return
+
         self.__keys = {}
+        self.__description = []
+        stat = os.stat(sbm_file_path)
 
         with open(sbm_file_path, mode='r') as f:
             linecount = 0
@@ -59,6 +183,7 @@ class Mapping:
                     continue
                 elif line.startswith('/'):
                     print(line[1:].rstrip())
+                    self.__description.append(line[1:].rstrip())
                     continue
 
                 notename, *data = re.split('\\s+', line.strip())
@@ -113,8 +238,202 @@ class Mapping:
 
                 self.__keys[midinote] = vert_split_points
 
+        self.compile_tables()
+
+        if use_cache:
+            self.write_cache(cache_path(sbm_file_path), stat, file_sha256(sbm_file_path))
+
         print('Mapping loaded!')
 
+    def __load_cache(self, sbm_file_path: str) -> bool:
+        """
+        Loads the compiled tables from the cache file of `sbm_file_path`, if it exists and was compiled
+        from the current contents of the .sbmap file (its hash matches). Hashing the file is cheap next to
+        parsing it, and unlike its mtime, it also catches same size edits within one mtime tick.
+
+        The cache file is memory mapped, and the tables are memoryviews into the mapping: nothing is
+        parsed or copied, pages are only read as notes are looked up.
+
+        :return: True if the mapping was loaded from the cache
+        """
+        path = cache_path(sbm_file_path)
+        try:
+            stat = os.stat(sbm_file_path)
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < CACHE_HEADER.size:
+                    return False
+                # the memory map stays valid after the file is closed, until the last view of it is released
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        magic, version, byte_order, mtime_ns, size, sha256, pb_range, description_len = \
+            CACHE_HEADER.unpack_from(buf)
+
+        tables_size = TABLE_SIZE * sum(itemsize for _, itemsize in _CACHE_TABLES)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or byte_order != _BYTE_ORDER \
+                or len(buf) != CACHE_HEADER.size + tables_size + description_len:
+            buf.close()
+            return False
+
+        if size != stat.st_size or sha256 != file_sha256(sbm_file_path):
+            buf.close()
+            return False
+        if mtime_ns != stat.st_mtime_ns:
+            # e.g. touched or checked out again, keep the header up to date
+            self.write_cache(path, stat, sha256, buf[CACHE_HEADER.size:])
+
+        # read only views, every table is at an offset that is a multiple of its item size
+        view = memoryview(buf)
+        tables = []
+        offset = CACHE_HEADER.size
+        for typecode, itemsize in _CACHE_TABLES:
+            tables.append(view[offset:offset + TABLE_SIZE * itemsize].cast(typecode))
+            offset += TABLE_SIZE * itemsize
+
+        self.__keys = None
+        self.__step_table, self.__cents_table, self.__pb_table, self.__pb_lsb, self.__pb_msb = tables
+        self.__pb_range = pb_range
+        self.__description = bytes(view[offset:]).decode('utf-8').split('\n') if description_len else []
+        return True
+
+    def write_cache(self, path: str, stat: os.stat_result, sha256: bytes, body: bytes = None):
+        """
+        Atomically writes the compiled tables to a cache file. Failing to write the cache
+        (e.g. read-only mappings directory) is not an error, the mapping will just be parsed again.
+
+        :param path: Path of the cache file, see `cache_path`
+        :param stat: `os.stat` of the .sbmap file the tables were compiled from
+        :param sha256: sha256 digest of the .sbmap file
+        :param body: Tables and description as already stored in a cache file, to only update the header
+        """
+        description = '\n'.join(self.__description).encode('utf-8')
+        if body is None:
+            body = b''.join(
+                bytes(table) for table in
+                (self.__step_table, self.__cents_table, self.__pb_table, self.__pb_lsb, self.__pb_msb)
+            ) + description
+        else:
+            description = body[TABLE_SIZE * sum(itemsize for _, itemsize in _CACHE_TABLES):]
+
+        header = CACHE_HEADER.pack(
+            CACHE_MAGIC, CACHE_VERSION, _BYTE_ORDER, stat.st_mtime_ns, stat.st_size, sha256,
+            self.__pb_range, len(description),
+        )
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if configs.CONFIGS.DEBUG:
+                print(f'debug: unable to write mapping cache {path}: {e}')
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def __keys_from_tables(self) -> dict:
+        """
+        Reconstructs the `__keys` split lists from the compiled tables (after loading from the cache).
+        Notes that play their own midi note number with no offset everywhere are treated as unmapped.
+        """
+        keys = {}
+        steps_table = self.__step_table
+        cents_table = self.__cents_table
+        for midinote in range(0, 128):
+            base = midinote << 7
+            splits = []
+            for cc74 in range(0, 128):
+                steps = steps_table[base | cc74]
+                cents = cents_table[base | cc74]
+                if splits and splits[-1][1] == cents and splits[-1][2] == steps:
+                    splits[-1] = (cc74 + 1, cents, steps)
+                else:
+                    splits.append((cc74 + 1, cents, steps))
+            if splits != [(128, 0.0, midinote)]:
+                keys[midinote] = splits
+        return keys
+
+    def compile_tables(self):
+        """
+        Flattens the split lists in `__keys` into dense 128x128 lookup tables so that
+        looking up a (midinote, cc74) pair on note on is a single array index.
+
+        Unmapped notes keep the default behavior: no pitch bend offset, and the input
+        midi note number is returned as the number of steps.
+        """
+        steps_table = array('i', bytes(4 * 128 * 128))
+        cents_table = array('d', bytes(8 * 128 * 128))
+
+        for midinote in range(0, 128):
+            base = midinote << 7
+
+            if midinote not in self.__keys:
+                for cc74 in range(0, 128):
+                    steps_table[base | cc74] = midinote
+                continue
+
+            cc74 = 0
+            for split_pos, cents, steps in self.__keys[midinote]:
+                while cc74 < split_pos and cc74 < 128:
+                    steps_table[base | cc74] = steps
+                    cents_table[base | cc74] = cents
+                    cc74 += 1
+
+        self.__step_table = steps_table
+        self.__cents_table = cents_table
+        self.compile_pitchbend_tables(configs.CONFIGS.PITCH_BEND_RANGE)
+
+    def compile_pitchbend_tables(self, pb_range: int):
+        """
+        (Re)compiles the pitch bend lookup tables for the given pitch bend range.
+
+        :param pb_range: pitch bend range in either direction (+/-) as per `CONFIGS.PITCH_BEND_RANGE`
+        """
+        # Cache the conversion of each distinct cents value, a mapping usually only has a handful.
+        pb_of_cents = {}
+        pb_table = array('H', bytes(2 * 128 * 128))
+        pb_lsb = bytearray(128 * 128)
+        pb_msb = bytearray(128 * 128)
+
+        for i, cents in enumerate(self.__cents_table):
+            pb = pb_of_cents.get(cents)
+            if pb is None:
+                pb = pb_of_cents[cents] = convert.cents_to_pitchbend(cents, pb_range)
+            pb_table[i] = pb
+            pb_lsb[i], pb_msb[i] = convert.pitch_bend_to_raw_pitch_msg(pb)
+
+        self.__pb_table = pb_table
+        self.__pb_lsb = pb_lsb
+        self.__pb_msb = pb_msb
+        self.__pb_range = pb_range
+
+    @property
+    def pitch_bend_range(self) -> int:
+        """
+        The pitch bend range the pitch bend tables are compiled for.
+        """
+        return self.__pb_range
+
+    def __getstate__(self):
+        # The compiled tables are derived data, don't persist them in saved configs.
+        state = self.__dict__.copy()
+        if state['_Mapping__keys'] is None:
+            state['_Mapping__keys'] = self.__keys_from_tables()
+        for attr in ('step_table', 'cents_table', 'pb_table', 'pb_lsb', 'pb_msb'):
+            state.pop(f'_Mapping__{attr}', None)
+        state['_Mapping__pb_range'] = 0
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_Mapping__description', [])
+        self.__dict__.update(state)
+        self.compile_tables()
+        _LIVE_MAPPINGS.add(self)
+
     def calc_pitchbend(self, midinote, cc74):
         """
         Looks up the input note and cc74 in the mapping table and calculates
@@ -124,16 +443,30 @@ class Mapping:
         :param cc74: cc74 value of input
         :return: pitch bend amount to send (0-16383)
         """
+        return self.__pb_table[midinote << 7 | cc74]
+
+    def calc_raw_pitchbend(self, midinote, cc74):
+        """
+        Same as `calc_pitchbend`, but returns the pitch bend already split into
+        the data bytes of a pitch bend message.
 
-        if midinote not in self.__keys:
-            return 8192
+        :param midinote: midi note number of input
+        :param cc74: cc74 value of input
+        :return: (lsb, msb)
+        """
+        i = midinote << 7 | cc74
+        return self.__pb_lsb[i], self.__pb_msb[i]
 
-        for split_pos, cents, steps in self.__keys[midinote]:
-            if cc74 < split_pos:
-                return convert.cents_to_pitchbend(cents, configs.CONFIGS.PITCH_BEND_RANGE)
+    def calc_pitchbend_msg(self, midinote, cc74) -> tuple[int, int, int]:
+        """
+        `calc_pitchbend` and `calc_raw_pitchbend` in one call, for note on.
 
-        raise RuntimeError(f'Impossible state error: calc_pitchbend could not find split pos'
-                           f'of {convert.midinum_to_12edo_name(midinote)}, cc74: {cc74}')
+        :param midinote: midi note number of input
+        :param cc74: cc74 value of input
+        :return: (pitch bend amount to send (0-16383), lsb, msb)
+        """
+        i = midinote << 7 | cc74
+        return self.__pb_table[i], self.__pb_lsb[i], self.__pb_msb[i]
 
     def calc_notes_from_a4(self, midinote, cc74):
         """
@@ -142,13 +475,4 @@ class Mapping:
         :param cc74: cc74 value of input
         :return: number of midi notes from A4 (midi note - 69)
         """
-
-        if midinote not in self.__keys:
-            return midinote
-
-        for split_pos, cents, steps in self.__keys[midinote]:
-            if cc74 < split_pos:
-                return steps
-
-        raise RuntimeError(f'Impossible state error: calc_midi_output could not find split pos'
-                           f'of {convert.midinum_to_12edo_name(midinote)}, cc74: {cc74}')
\ No newline at end of file
+        return self.__step_table[midinote << 7 | cc74]
@@ -0,0 +1,18 @@
+"""
+MIDI status bytes and controller numbers used by the mapper.
+
+Kept here instead of importing `rtmidi.midiconstants`, so that the input handler, the replay harness
+and the benchmarks don't load the native rtmidi backend (which needs ALSA/CoreMIDI/WinMM).
+"""
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+POLY_PRESSURE = 0xA0
+CONTROL_CHANGE = 0xB0
+PROGRAM_CHANGE = 0xC0
+CHANNEL_PRESSURE = 0xD0
+PITCH_BEND = 0xE0
+
+SUSTAIN = 0x40
+"""
+Sustain pedal controller number (CC 64).
+"""
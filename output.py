@@ -0,0 +1,219 @@
+"""
+Batched MIDI output stage.
+
+All messages produced while handling one input event are written into preallocated message
+buffers, then sent to the output port in one tight loop by `flush`.
+"""
+import threading
+import time
+from typing import Callable, Optional, TYPE_CHECKING
+
+from filters import ChangeFilter
+from journal import Journal, OUTPUT
+from midi import CHANNEL_PRESSURE
+
+if TYPE_CHECKING:
+    # only for annotations, importing rtmidi loads the native MIDI backend
+    from rtmidi import MidiOut  # type: ignore
+
+OUTPUT_BUFFER_SIZE = 64
+"""
+Max number of messages buffered before they are flushed early.
+"""
+
+
+class MidiOutputStage:
+    def __init__(self, out_port: 'MidiOut', capacity: int = OUTPUT_BUFFER_SIZE, lock: Optional[threading.Lock] = None):
+        """
+        :param out_port: The output port
+        :param capacity: Max number of buffered messages
+        :param lock: Lock shared by all output stages sending to the same port (one per input device).
+                     If None, the port is only used by this output stage.
+        """
+        self.out_port = out_port
+        self.__capacity = capacity
+        self.__pool = [[0, 0, 0] for _ in range(capacity)]
+        """
+        Preallocated 3 byte message buffers, reused for every event.
+        """
+        self.__pending: list = [None] * capacity
+        """
+        Messages waiting to be flushed. Either a buffer from `__pool`, or a raw message passed
+        to `send_raw`.
+        """
+        self.__count = 0
+        self.__lock = lock if lock is not None else threading.Lock()
+        """
+        Serializes writes to the output port between `flush` (input callback thread)
+        and `send_now` (other threads, e.g. the scheduler), and between devices sharing the port.
+        """
+        self.__channel_map: Optional[bytes] = None
+        self.__filter: Optional[ChangeFilter] = None
+        self.__journal: Optional[Journal] = None
+        self.__journal_device = 0
+        self.__next_send = self.__buffer
+        self.__next_send_raw = self.__buffer_raw
+        self.__next_send_now = self.__send_direct
+        """
+        What the channel remapping stage passes messages on to: the filter stage, or the buffer.
+        """
+
+        # The stages in use are selected by assigning these attributes, see `__install`. They are
+        # never deleted, nor is `__dict__` touched: that makes every attribute access of this
+        # object slower from then on (it disables CPython's inline instance attribute values).
+        self.send: Callable[[int, int, int], bool] = self.__buffer
+        """
+        Buffer a 3 byte channel message. Only to be called from the input callback thread.
+        Returns False if the message was dropped as redundant (see `set_filter`).
+        """
+        self.send_raw: Callable[[list], None] = self.__buffer_raw
+        """
+        Buffer a message of any length as is. Only to be called from the input callback thread.
+        """
+        self.send_now: Callable[[int, int, int], None] = self.__send_direct
+        """
+        Send a 3 byte channel message immediately, bypassing the buffer.
+        Safe to call from threads other than the input callback thread.
+        """
+
+    def set_channel_map(self, channel_map: Optional[bytes]):
+        """
+        Remap the channel of every channel message sent through this stage, so that several input
+        devices can share one output port without colliding.
+
+        :param channel_map: Output channel for each of the 16 channels, or None to send messages as is.
+        """
+        self.__channel_map = channel_map
+        self.__install()
+
+    def set_filter(self, change_filter: Optional[ChangeFilter]):
+        """
+        Drop redundant cc, pitch bend and channel pressure messages, see `filters.py`.
+        Only to be called from the input callback thread, or while no input is handled.
+
+        :param change_filter: The filter, or None to send every message. The final values it holds back
+                              to keep to its max rate are sent directly to the output port.
+        """
+        if change_filter is not None:
+            change_filter.on_trailing = self.__send_trailing
+        self.__filter = change_filter
+        self.__install()
+
+    def set_journal(self, journal: Optional[Journal], device: int = 0):
+        """
+        Record every message sent to the output port in a journal, see `journal.py`.
+
+        :param journal: The journal, or None to stop recording.
+        :param device: Index of the input device the messages are recorded for.
+        """
+        self.__journal = journal
+        self.__journal_device = device
+
+    def __install(self):
+        # only pay for the remapping/filter stages in use
+        if self.__filter is None:
+            self.__next_send = self.__buffer
+            self.__next_send_raw = self.__buffer_raw
+            self.__next_send_now = self.__send_direct
+        else:
+            self.__next_send = self.__send_filtered
+            self.__next_send_raw = self.__send_raw_filtered
+            self.__next_send_now = self.__send_now_filtered
+
+        if self.__channel_map is not None:
+            self.send = self.__send_remapped
+            self.send_raw = self.__send_raw_remapped
+            self.send_now = self.__send_now_remapped
+        else:
+            self.send = self.__next_send
+            self.send_raw = self.__next_send_raw
+            self.send_now = self.__next_send_now
+
+    def __send_remapped(self, status, data1, data2) -> bool:
+        if status < 0xF0:
+            status = status & 0xF0 | self.__channel_map[status & 0x0F]
+        return self.__next_send(status, data1, data2)
+
+    def __send_raw_remapped(self, msg):
+        status = msg[0]
+        if status < 0xF0:
+            msg = [status & 0xF0 | self.__channel_map[status & 0x0F], *msg[1:]]
+        self.__next_send_raw(msg)
+
+    def __send_now_remapped(self, status, data1, data2):
+        if status < 0xF0:
+            status = status & 0xF0 | self.__channel_map[status & 0x0F]
+        self.__next_send_now(status, data1, data2)
+
+    def __send_filtered(self, status, data1, data2) -> bool:
+        if self.__filter.accept(status, data1, data2):
+            return self.__buffer(status, data1, data2)
+        return False
+
+    def __send_raw_filtered(self, msg):
+        if len(msg) == 2 and not self.__filter.accept(msg[0], msg[1]):
+            return
+        self.__buffer_raw(msg)
+
+    def __send_now_filtered(self, status, data1, data2):
+        # sent outside of the input callback thread, don't touch the filter state apart from
+        # making sure the next message of this kind isn't compared against an outdated value.
+        # The filter may be replaced by the input callback thread meanwhile.
+        change_filter = self.__filter
+        if change_filter is not None:
+            change_filter.forget(status, data1)
+        self.__send_direct(status, data1, data2)
+
+    def __buffer(self, status, data1, data2) -> bool:
+        i = self.__count
+        if i == self.__capacity:
+            self.flush()
+            i = 0
+        msg = self.__pool[i]
+        msg[0] = status
+        msg[1] = data1
+        msg[2] = data2
+        self.__pending[i] = msg
+        self.__count = i + 1
+        return True
+
+    def __buffer_raw(self, msg):
+        i = self.__count
+        if i == self.__capacity:
+            self.flush()
+            i = 0
+        self.__pending[i] = msg
+        self.__count = i + 1
+
+    def flush(self):
+        """
+        Send all buffered messages to the output port.
+        """
+        n = self.__count
+        if n == 0:
+            return
+
+        pending = self.__pending
+        send_message = self.out_port.send_message
+        with self.__lock:
+            for i in range(n):
+                send_message(pending[i])
+        self.__count = 0
+
+        if self.__journal is not None:
+            now = time.time()
+            for i in range(n):
+                self.__journal.record(OUTPUT, self.__journal_device, pending[i], now)
+
+    def __send_direct(self, status, data1, data2):
+        self.__send_message([status, data1, data2])
+
+    def __send_trailing(self, status, data1, data2):
+        # the final value of a burst the filter held back, on the scheduler thread or before a note off
+        self.__send_message([status, data1] if status & 0xF0 == CHANNEL_PRESSURE else [status, data1, data2])
+
+    def __send_message(self, msg):
+        with self.__lock:
+            self.out_port.send_message(msg)
+        if self.__journal is not None:
+            self.__journal.record(OUTPUT, self.__journal_device, msg, time.time())
@@ -0,0 +1,377 @@
+"""
+Headless replay harness.
+
+Feeds a recorded event stream (standard MIDI file or timestamped log) into `MidiInputHandler`
+using the same `(message, deltatime)` events as rtmidi, with the output port replaced by an
+in-memory sink. No MIDI hardware or virtual ports required.
+
+Usage (from the repository root):
+
+    python replay.py <recording.mid|recording.log> [--realtime] [--midi] [--slide <n>|prs|rel|abs|bip] ...
+
+Journal files written by the mapper (see `journal.py`) can be replayed too: the input messages of
+one input device in the last session of the journal are replayed, with the MPE/MIDI mode, slide mode,
+mapping and pitch bend range recorded in the journal, unless given as arguments.
+
+Log format: one event per line, `<deltatime in seconds> <status byte> <data bytes...>` with
+bytes in hex, e.g. `0.001250 91 3c 64`. Blank lines and lines starting with `#` are ignored.
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+from typing import Optional
+
+import configs
+import journal
+from configs import CONFIGS, SlideMode
+from log import LOG
+from mapping import Mapping
+from scheduler import SCHEDULER
+from split import SplitData
+from velcurve import VelocityCurves
+
+Event = tuple[list[int], float]
+"""
+(message bytes, deltatime in seconds since the previous event), as passed to the rtmidi callback.
+"""
+
+
+class MemoryOutPort:
+    """
+    Stands in for an rtmidi `MidiOut`. Records every sent message with the time it was sent.
+    """
+    def __init__(self):
+        self.messages: list[tuple[float, tuple[int, ...]]] = []
+        """
+        (time.perf_counter() when sent, message bytes)
+        """
+
+    def send_message(self, message):
+        self.messages.append((time.perf_counter(), tuple(message)))
+
+    def clear(self):
+        self.messages = []
+
+
+class MidiFileError(Exception):
+    def __init__(self, msg):
+        super().__init__('Error reading MIDI file. ' + msg)
+
+
+def _read_varlen(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, pos
+
+
+# number of data bytes following each channel message status nibble
+_DATA_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+
+def read_midi_file(path: str) -> list[Event]:
+    """
+    Read all channel messages of a standard MIDI file (format 0 or 1), merged across tracks
+    and converted to rtmidi style deltatimes using the file's tempo map.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != b'MThd':
+        raise MidiFileError(f'{path} is not a standard MIDI file')
+
+    header_len, _, num_tracks, division = struct.unpack('>IHHH', data[4:14])
+    pos = 8 + header_len
+
+    # (absolute tick, track order, message)
+    timed_messages: list[tuple[int, int, list[int]]] = []
+    # (absolute tick, microseconds per quarter note)
+    tempo_changes: list[tuple[int, int]] = []
+    order = 0
+
+    for _ in range(num_tracks):
+        if data[pos:pos + 4] != b'MTrk':
+            raise MidiFileError(f'expected track chunk at byte {pos}')
+        track_len = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        pos += 8
+        end = pos + track_len
+        tick = 0
+        running_status = 0
+
+        while pos < end:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+
+            status = data[pos]
+            if status & 0x80:
+                pos += 1
+            else:
+                status = running_status
+
+            if status == 0xFF:
+                meta_type = data[pos]
+                length, pos = _read_varlen(data, pos + 1)
+                if meta_type == 0x51:
+                    tempo_changes.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+                pos += length
+            elif status == 0xF0 or status == 0xF7:
+                length, pos = _read_varlen(data, pos)
+                if status == 0xF0:
+                    timed_messages.append((tick, order, [0xF0, *data[pos:pos + length]]))
+                    order += 1
+                pos += length
+            else:
+                n = _DATA_LENGTHS.get(status & 0xF0)
+                if n is None:
+                    raise MidiFileError(f'invalid status byte {status:#x} at byte {pos}')
+                running_status = status
+                timed_messages.append((tick, order, [status, *data[pos:pos + n]]))
+                order += 1
+                pos += n
+
+        pos = end
+
+    timed_messages.sort(key=lambda m: (m[0], m[1]))
+
+    if division & 0x8000:
+        # SMPTE time division
+        frames_per_second = 256 - (division >> 8)
+        seconds_per_tick = 1 / (frames_per_second * (division & 0xFF))
+
+        def tick_to_seconds(t):
+            return t * seconds_per_tick
+    else:
+        tempo_changes.sort()
+        if not tempo_changes or tempo_changes[0][0] != 0:
+            tempo_changes.insert(0, (0, 500000))  # default 120bpm
+
+        # precompute the time at each tempo change
+        tempo_seconds = [0.0]
+        for (t0, us0), (t1, _) in zip(tempo_changes, tempo_changes[1:]):
+            tempo_seconds.append(tempo_seconds[-1] + (t1 - t0) * us0 / 1e6 / division)
+
+        def tick_to_seconds(t):
+            i = len(tempo_changes) - 1
+            while tempo_changes[i][0] > t:
+                i -= 1
+            t0, us = tempo_changes[i]
+            return tempo_seconds[i] + (t - t0) * us / 1e6 / division
+
+    events = []
+    prev_seconds = 0.0
+    for tick, _, message in timed_messages:
+        seconds = tick_to_seconds(tick)
+        events.append((message, seconds - prev_seconds))
+        prev_seconds = seconds
+
+    return events
+
+
+def read_log(path: str) -> list[Event]:
+    """
+    Read a timestamped event log (see module docstring for the format).
+    """
+    events = []
+    with open(path, 'r') as f:
+        for linecount, line in enumerate(f, start=1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            try:
+                deltatime, *msg_bytes = line.split()
+                events.append(([int(b, 16) for b in msg_bytes], float(deltatime)))
+            except ValueError:
+                raise ValueError(f'{path} line {linecount}: invalid event: {line}')
+    return events
+
+
+def write_log(events: list[Event], file=sys.stdout):
+    for message, deltatime in events:
+        print(f'{deltatime:.6f} ' + ' '.join(f'{b:02x}' for b in message), file=file)
+
+
+def read_events(path: str, device: int = 0) -> list[Event]:
+    """
+    Read a standard MIDI file, a journal or an event log, depending on the file contents.
+
+    :param device: Input device whose messages are read from a journal
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic == b'MThd':
+        return read_midi_file(path)
+    if magic == journal.MAGIC:
+        return journal.input_events(journal.read_journal(path), device)
+    return read_log(path)
+
+
+def read_settings(path: str) -> Optional[journal.Settings]:
+    """
+    :return: The settings recorded in the last session of a journal, None if the file isn't a journal or
+             has no settings recorded
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic != journal.MAGIC:
+        return None
+    return journal.session_settings(journal.read_journal(path))
+
+
+class ReplayResult:
+    def __init__(self, num_events: int, elapsed: float, latencies: list[float], output: list[tuple[float, tuple[int, ...]]]):
+        self.num_events = num_events
+        self.elapsed = elapsed
+        """
+        Wall time in seconds to process all events (including time spent waiting in real time mode)
+        """
+        self.latencies = latencies
+        """
+        Seconds spent in `MidiInputHandler.__call__` for each event.
+        """
+        self.output = output
+        """
+        Every message sent to the output port, see `MemoryOutPort.messages`.
+        """
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        s = sorted(self.latencies)
+        return s[min(len(s) - 1, int(p / 100 * len(s)))]
+
+    def events_per_second(self) -> float:
+        return self.num_events / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self, file=sys.stdout):
+        print(f'events:      {self.num_events}', file=file)
+        print(f'output msgs: {len(self.output)}', file=file)
+        print(f'throughput:  {self.events_per_second():.0f} events/s', file=file)
+        print(
+            f'latency:     p50 {self.percentile(50) * 1e6:.1f}us, '
+            f'p99 {self.percentile(99) * 1e6:.1f}us, '
+            f'max {max(self.latencies, default=0) * 1e6:.1f}us',
+            file=file,
+        )
+
+
+def replay(events: list[Event], handler, out_port: MemoryOutPort, realtime=False, settle: float = 0.05) -> ReplayResult:
+    """
+    Feed events into a `MidiInputHandler`.
+
+    :param events: Events to replay
+    :param handler: The handler, constructed with `out_port` as its output port
+    :param out_port: The in-memory output port of the handler
+    :param realtime: If True, wait for each event's deltatime before handling it.
+                     Otherwise, replay as fast as possible.
+    :param settle: Max seconds to wait after the last event for deferred actions to run.
+    """
+    latencies = []
+    perf_counter = time.perf_counter
+
+    start = perf_counter()
+    due = start
+    for event in events:
+        if realtime:
+            due += event[1]
+            wait = due - perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+        t0 = perf_counter()
+        handler(event)
+        latencies.append(perf_counter() - t0)
+    elapsed = perf_counter() - start
+
+    settle_until = perf_counter() + settle
+    while SCHEDULER.queue_depth() > 0 and perf_counter() < settle_until:
+        time.sleep(0.001)
+
+    return ReplayResult(len(events), elapsed, latencies, out_port.messages)
+
+
+def set_slide_mode(s: str):
+    """
+    Sets the slide mode from the same arguments as the `slide` REPL command.
+    """
+    modes = {'prs': SlideMode.PRESS, 'rel': SlideMode.RELATIVE, 'abs': SlideMode.ABSOLUTE, 'bip': SlideMode.BIPOLAR}
+    if s in modes:
+        CONFIGS.SLIDE_MODE = modes[s]
+    else:
+        CONFIGS.SLIDE_MODE = SlideMode.FIXED
+        CONFIGS.SLIDE_FIXED_N = int(s)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Replay a recorded MIDI stream through the mapper without hardware.')
+    parser.add_argument('recording', help='standard MIDI file, journal or event log')
+    parser.add_argument('--device', type=int, default=0, help='input device to replay from a journal (default: 0)')
+    parser.add_argument('--realtime', action='store_true', help='replay in real time instead of as fast as possible')
+    parser.add_argument('--midi', action='store_true', help='MIDI mode instead of MPE mode')
+    parser.add_argument('--autosplit', action='store_true', help='enable auto split (MIDI mode)')
+    parser.add_argument('--slide', default=None, help='slide mode: <n>|prs|rel|abs|bip (default: rel)')
+    parser.add_argument('--map', default=None, help='.sbmap mapping file (default: mappings/default.sbmap)')
+    parser.add_argument('--vel', default=None, help='.vel velocity curve file')
+    parser.add_argument('--pb', type=int, default=None, help=f'pitch bend range (default: {CONFIGS.PITCH_BEND_RANGE})')
+    parser.add_argument('--no-smoothing', action='store_true', help='disable velocity smoothing')
+    parser.add_argument('--output', default=None, help='write the output stream as an event log to this file ("-" for stdout)')
+    args = parser.parse_args(argv)
+
+    # imported here so that argument errors don't pay for importing the handler
+    from handler import MidiInputHandler
+
+    info = sys.stderr if args.output == '-' else sys.stdout
+    mpe_mode, slide_mode, slide_fixed_n, pitch_bend_range, mapping_path = \
+        True, SlideMode.RELATIVE.value, CONFIGS.SLIDE_FIXED_N, CONFIGS.PITCH_BEND_RANGE, None
+    settings = read_settings(args.recording)
+    if settings is not None:
+        mpe_mode, slide_mode, slide_fixed_n, pitch_bend_range, mapping_path = settings
+        print(f'Journal settings: {"MPE" if mpe_mode else "MIDI"} mode, slide mode {SlideMode(slide_mode).name}'
+              f'{f" ({slide_fixed_n})" if slide_mode == SlideMode.FIXED.value else ""}, '
+              f'pitch bend range {pitch_bend_range}, mapping {mapping_path}', file=info)
+        if mapping_path is not None and not os.path.isfile(mapping_path):
+            print(f'Recorded mapping {mapping_path} not found, using the default mapping', file=info)
+            mapping_path = None
+
+    CONFIGS.PITCH_BEND_RANGE = args.pb if args.pb is not None else pitch_bend_range
+    CONFIGS.MAPPING = Mapping(args.map or mapping_path or 'mappings/default.sbmap')
+    CONFIGS.VELOCITY_CURVES = VelocityCurves(args.vel)
+    CONFIGS.MPE_MODE = mpe_mode and not args.midi
+    CONFIGS.AUTO_SPLIT = SplitData(CONFIGS.MAPPING) if args.autosplit else None
+    CONFIGS.VELOCITY_SMOOTHING = not args.no_smoothing
+    if args.slide is not None:
+        set_slide_mode(args.slide)
+    else:
+        CONFIGS.SLIDE_MODE = SlideMode(slide_mode)
+        CONFIGS.SLIDE_FIXED_N = slide_fixed_n
+    configs.configs_changed()
+
+    events = read_events(args.recording, args.device)
+    out_port = MemoryOutPort()
+    result = replay(events, MidiInputHandler(out_port), out_port, realtime=args.realtime)
+    # write the handler's messages before the results
+    LOG.flush()
+
+    if args.output is not None:
+        # convert send times back into deltatimes
+        output_events = []
+        prev = result.output[0][0] if result.output else 0.0
+        for t, message in result.output:
+            output_events.append((list(message), t - prev))
+            prev = t
+
+        if args.output == '-':
+            write_log(output_events)
+        else:
+            with open(args.output, 'w') as f:
+                write_log(output_events, f)
+
+    result.report(sys.stderr if args.output == '-' else sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Single long-lived scheduler thread for deferred actions (e.g. the 20ms cc74 double check in
+KeyTracker and the 1ms delayed cc74 in MIDI mode), instead of spawning one thread per event.
+
+When running on a single asyncio event loop (see `eventloop.py`), deferred actions are
+scheduled on that loop instead, see `Scheduler.use_loop`.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+class ScheduledAction:
+    """
+    Handle to an action scheduled with `Scheduler.call_later`.
+    """
+    __slots__ = ('when', 'fn', 'args', 'cancelled', 'done', 'handle')
+
+    def __init__(self, when: float, fn: Callable, args: tuple):
+        self.when = when
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+        self.done = False
+        self.handle: Optional['asyncio.TimerHandle'] = None
+        """
+        The event loop timer of this action, when the scheduler runs on an event loop.
+        """
+
+
+class Scheduler:
+    """
+    Runs deferred actions on one daemon thread, ordered by a heap of due times.
+
+    Cancelled actions are dropped lazily when they reach the top of the heap.
+    """
+    def __init__(self):
+        self.__heap: list[tuple[float, int, ScheduledAction]] = []
+        self.__cond = threading.Condition()
+        self.__seq = itertools.count()
+        self.__pending = 0
+        """
+        Number of scheduled actions that have neither run nor been cancelled.
+        """
+        self.__thread: Optional[threading.Thread] = None
+        self.__loop: Optional['asyncio.AbstractEventLoop'] = None
+        self.__loop_thread_id = 0
+
+    def use_loop(self, loop: 'asyncio.AbstractEventLoop'):
+        """
+        Run all actions scheduled from now on as timers of `loop` instead of on the scheduler thread.
+        Must be called on the thread running `loop`.
+        """
+        self.__loop = loop
+        self.__loop_thread_id = threading.get_ident()
+
+    def call_later(self, delay: float, fn: Callable, *args) -> ScheduledAction:
+        """
+        Schedule `fn(*args)` to run on the scheduler thread after `delay` seconds.
+
+        :param delay: Delay in seconds
+        :return: Handle that can be passed to `cancel`
+        """
+        action = ScheduledAction(time.monotonic() + delay, fn, args)
+
+        loop = self.__loop
+        if loop is not None:
+            with self.__cond:
+                self.__pending += 1
+            if threading.get_ident() == self.__loop_thread_id:
+                action.handle = loop.call_later(delay, self.__run_action, action)
+            else:
+                loop.call_soon_threadsafe(self.__schedule_on_loop, action)
+            return action
+
+        with self.__cond:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='scheduler', daemon=True)
+                self.__thread.start()
+
+            heapq.heappush(self.__heap, (action.when, next(self.__seq), action))
+            self.__pending += 1
+            # only need to wake the thread up if this is now the earliest action
+            if self.__heap[0][2] is action:
+                self.__cond.notify()
+
+        return action
+
+    def cancel(self, action: Optional[ScheduledAction]) -> bool:
+        """
+        Cancel a pending action. Does nothing if the action has already run or was already cancelled.
+
+        :param action: Handle returned by `call_later` (None is allowed and ignored)
+        :return: True if the action was pending and is now cancelled.
+        """
+        if action is None:
+            return False
+
+        with self.__cond:
+            if action.cancelled or action.done:
+                return False
+            action.cancelled = True
+            self.__pending -= 1
+
+        if action.handle is not None:
+            action.handle.cancel()
+        return True
+
+    def queue_depth(self) -> int:
+        """
+        :return: Number of actions waiting to run (excluding cancelled ones)
+        """
+        return self.__pending
+
+    def __schedule_on_loop(self, action: ScheduledAction):
+        if not action.cancelled:
+            action.handle = self.__loop.call_at(
+                self.__loop.time() + action.when - time.monotonic(), self.__run_action, action
+            )
+
+    def __run_action(self, action: ScheduledAction):
+        with self.__cond:
+            if action.cancelled or action.done:
+                return
+            action.done = True
+            self.__pending -= 1
+
+        try:
+            action.fn(*action.args)
+        except Exception:
+            print('error in scheduled action:')
+            traceback.print_exc()
+
+    def __run(self):
+        heap = self.__heap
+        cond = self.__cond
+
+        while True:
+            with cond:
+                while True:
+                    if not heap:
+                        cond.wait()
+                        continue
+
+                    when, _, action = heap[0]
+                    if action.cancelled:
+                        heapq.heappop(heap)
+                        continue
+
+                    delay = when - time.monotonic()
+                    if delay > 0:
+                        cond.wait(delay)
+                        continue
+
+                    heapq.heappop(heap)
+                    action.done = True
+                    self.__pending -= 1
+                    break
+
+            try:
+                action.fn(*action.args)
+            except Exception:
+                print('error in scheduled action:')
+                traceback.print_exc()
+
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,127 @@
+"""
+Velocity smoothing by pressure (aftertouch).
+
+The steepness of the velocity curve follows an exponential moving average of the pressure of the
+notes being played: playing with a heavy touch makes soft velocities louder, a light touch makes
+them softer. This evens out keys/areas of the Seaboard that sense velocity inaccurately.
+
+Each region of the voice allocator (a split region, see the `split` command, or an octave with
+auto split or without splits) keeps its own average, so the pressure of one hand doesn't change the
+velocity of the other hand's notes. The response to every
+(quantized average, velocity) pair is precomputed, so smoothing a velocity is a single table lookup.
+"""
+from array import array
+
+from split import SplitData
+
+NUM_CHANNELS = 16
+
+_TABLES: dict[tuple[float, float], bytearray] = {}
+"""
+Compiled smoothing tables by (effect, bias), see `get_smoothing_table`.
+"""
+
+
+def compile_smoothing_table(effect: float, bias: float) -> bytearray:
+    """
+    Precomputes the velocity smoothing response for every (quantized pressure moving average,
+    velocity) pair.
+
+    :param effect: Max increase/decrease of the exponent applied to the velocity normalized to 0-1.
+                   With an effect larger than the bias, the exponent is negative for high averages.
+    :param bias: Exponent applied to the velocity when the average is at mid point (64)
+    :return: Output velocities indexed by `round(average) << 7 | velocity`
+    """
+    table = bytearray(128 * 128)
+    # velocity 0 is never looked up (it's a note off), but 0 to a negative exponent is undefined
+    normalized = [max(vel, 1) / 127 for vel in range(0, 128)]
+    for ma in range(0, 128):
+        exponent = bias + effect - 2 * effect * (ma / 127)
+        row = [round((n ** exponent) * 127) for n in normalized]
+        table[ma << 7:(ma + 1) << 7] = bytes(1 if v < 1 else 127 if v > 127 else v for v in row)
+    return table
+
+
+def get_smoothing_table(effect: float, bias: float) -> bytearray:
+    """
+    Compiles the table of (effect, bias) on first use, so that startup doesn't pay for it unless
+    velocity smoothing is on, and changing settings back and forth doesn't recompile it.
+    """
+    key = (effect, bias)
+    table = _TABLES.get(key)
+    if table is None:
+        table = _TABLES[key] = compile_smoothing_table(effect, bias)
+    return table
+
+
+class VelocitySmoother:
+    """
+    Pressure moving averages of each region, and the region of the note of each input channel.
+
+    Not thread safe, only used from the thread handling input events.
+    """
+    __slots__ = ('alpha', 'table', 'num_regions', '__region_of_note', '__region_of_channel', '__ma')
+
+    def __init__(self, splits: SplitData, alpha: float, effect: float, bias: float):
+        """
+        :param splits: Regions that keep their own average, the regions of the voice allocator or the
+                       auto split octaves
+        :param alpha: Rate of change of the moving averages, 0-1
+        :param effect: See `compile_smoothing_table`
+        :param bias: See `compile_smoothing_table`
+        """
+        self.alpha = alpha
+        self.table = get_smoothing_table(effect, bias)
+        self.num_regions = splits.get_num_channels_used()
+        self.__region_of_note = bytes(min(self.__region(splits, note), self.num_regions - 1) for note in range(128))
+        """
+        Region of each input midi note.
+        """
+        self.__region_of_channel = array('B', bytes(NUM_CHANNELS))
+        """
+        Region of the last note of each input channel, whose pressure messages update that region.
+        """
+        self.__ma = array('d', [64.0]) * self.num_regions
+        """
+        Pressure moving average of each region.
+        """
+
+    @staticmethod
+    def __region(splits: SplitData, note: int) -> int:
+        try:
+            return splits.get_split_range(note)[0]
+        except RuntimeError:
+            # note above the last split point
+            return len(splits.get_splits())
+
+    def smooth(self, channel: int, note: int, vel: int) -> int:
+        """
+        Applies smoothing to the velocity of a note on, and assigns the channel to the note's region.
+
+        :param vel: Velocity after the velocity curve, 1-127
+        """
+        region = self.__region_of_note[note]
+        self.__region_of_channel[channel] = region
+        return self.table[int(self.__ma[region] + 0.5) << 7 | vel]
+
+    def update(self, channel: int, pressure: int):
+        """
+        Updates the moving average of the region of the note of `channel` with a pressure value.
+        """
+        ma = self.__ma
+        region = self.__region_of_channel[channel]
+        ma[region] += self.alpha * (pressure - ma[region])
+
+    def average(self, channel: int) -> float:
+        """
+        :return: The moving average used for the next note of the region of `channel`'s last note
+        """
+        return self.__ma[self.__region_of_channel[channel]]
+
+    def carry_over(self, previous: 'VelocitySmoother'):
+        """
+        Keeps the averages of `previous` when its regions are the same, e.g. after a settings change.
+        """
+        if previous.num_regions == self.num_regions:
+            self.__ma[:] = previous.__ma
+            self.__region_of_channel[:] = previous.__region_of_channel
@@ -23,7 +23,16 @@ class SplitData:
             self.add_split(128, (5 - 9) * map.edo)  # add a final split point at 128 to mark the end of the last split region
 
     def get_num_channels_used(self) -> int:
-        return min(1, len(self.__splits))
+        """
+        :return: Number of split regions, each region is sent to its own channel(s) in MIDI mode.
+        """
+        return max(1, len(self.__splits))
+
+    def get_splits(self) -> list[tuple[int, int]]:
+        """
+        :return: (exclusive upper bound midi note, output offset) of each split region
+        """
+        return list(self.__splits)
 
     def add_split(self, midinum, outputoffset):
         self.__splits.append((midinum, outputoffset))
@@ -0,0 +1,107 @@
+"""
+Low overhead instrumentation of the input handler: per-event processing time histograms split
+by message type/handler branch, and counters for notable events.
+
+Timing is only recorded while `STATS.enabled` is True (toggled with the `stats on`/`stats off`
+commands). Counters are always kept, they are only incremented in rare branches.
+"""
+NUM_BUCKETS = 256
+
+
+def bucket_index(ns: int) -> int:
+    """
+    Fixed log-linear buckets: 4 buckets per power of two, i.e. each bucket spans at most 25%
+    of its lower bound. Values 0-3 get their own bucket.
+    """
+    b = ns.bit_length()
+    if b < 3:
+        return ns
+    return min(NUM_BUCKETS - 1, ((b - 2) << 2) | ((ns >> (b - 3)) & 3))
+
+
+def bucket_lower_bound(idx: int) -> int:
+    if idx < 4:
+        return idx
+    return (4 | (idx & 3)) << ((idx >> 2) - 1)
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns: int):
+        self.counts[bucket_index(ns)] += 1
+        self.total += 1
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p: float) -> int:
+        """
+        :return: Upper bound (ns) of the bucket containing the p-th percentile.
+        """
+        if self.total == 0:
+            return 0
+        target = p / 100 * self.total
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self.max, bucket_lower_bound(idx + 1))
+        return self.max
+
+
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        """
+        Whether per-event processing times are recorded. Takes effect when the handler is recompiled.
+        """
+        self.histograms: dict[str, Histogram] = {}
+        """
+        Processing time histograms per message type/handler branch (e.g. 'note_on', 'cc74.slide').
+        """
+        self.counters: dict[str, int] = {}
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {
+            'deferred_notes': 0,
+            'resolved_notes': 0,
+            'stuck_notes': 0,
+            'channel_steals': 0,
+            'voice_steals': 0,
+            'output_filtered': 0,
+            'input_decimated': 0,
+        }
+
+    def record(self, branch: str, ns: int):
+        h = self.histograms.get(branch)
+        if h is None:
+            h = self.histograms[branch] = Histogram()
+        h.record(ns)
+
+    def count(self, counter: str):
+        self.counters[counter] = self.counters.get(counter, 0) + 1
+
+    def print(self):
+        from scheduler import SCHEDULER
+
+        print(f'timing: {"on" if self.enabled else "off"}')
+        if self.histograms:
+            print(f'    {"branch":<22}{"count":>9}{"p50":>11}{"p99":>11}{"max":>11}')
+            for branch, h in sorted(self.histograms.items()):
+                print(
+                    f'    {branch:<22}{h.total:>9}'
+                    f'{h.percentile(50) / 1000:>9.1f}us{h.percentile(99) / 1000:>9.1f}us{h.max / 1000:>9.1f}us'
+                )
+        for counter, value in self.counters.items():
+            print(f'    {counter:<22}{value:>9}')
+        print(f'    {"scheduler queue depth":<22}{SCHEDULER.queue_depth():>9}')
+
+
+STATS = Stats()
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# the mapper is a set of top level modules that open mappings/ relative to the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import configs  # noqa: E402
+from bank import BANK  # noqa: E402
+from configs import CONFIGS  # noqa: E402
+from mapping import Mapping  # noqa: E402
+
+DEFAULT_MAPPING = os.path.join('mappings', 'default.sbmap')
+
+
+@pytest.fixture(scope='session')
+def default_mapping() -> Mapping:
+    return Mapping(DEFAULT_MAPPING)
+
+
+@pytest.fixture(autouse=True)
+def restore_configs(default_mapping):
+    """
+    Every test starts from the default CONFIGS with the default mapping, and the CONFIGS, listeners
+    and bank it changes are restored afterwards.
+    """
+    saved = {name: value for name, value in vars(CONFIGS).items() if name.isupper()}
+    listeners = list(configs._listeners)
+    CONFIGS.MAPPING = default_mapping
+    configs.configs_changed()
+    yield
+    for name, value in saved.items():
+        setattr(CONFIGS, name, value)
+    configs._listeners[:] = listeners
+    BANK.unload()
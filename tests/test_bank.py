@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+import configs
+from bank import BANK, BankParsingError
+from configs import CONFIGS
+from handler import MidiInputHandler
+from midi import CONTROL_CHANGE, NOTE_OFF, NOTE_ON, PITCH_BEND, PROGRAM_CHANGE
+from replay import MemoryOutPort
+from split import SplitData
+
+MAPPINGS_DIR = os.path.abspath('mappings')
+
+
+@pytest.fixture
+def bank_file(tmp_path) -> str:
+    path = str(tmp_path / 'test.sbbank')
+    with open(path, 'w') as f:
+        f.write(f'# program  mapping\n'
+                f'0  {os.path.join(MAPPINGS_DIR, "default.sbmap")}\n'
+                f'5  {os.path.join(MAPPINGS_DIR, "22edo.sbmap")}\n')
+    return path
+
+
+def play(handler: MidiInputHandler, out: MemoryOutPort, note: int, cc74: int = 64) -> list[tuple[int, ...]]:
+    """
+    :return: Note on and pitch bend messages sent for a note on channel 2
+    """
+    out.clear()
+    handler(([CONTROL_CHANGE | 1, 74, cc74], 0.0))
+    handler(([NOTE_ON | 1, note, 100], 0.0))
+    handler(([NOTE_OFF | 1, note, 0], 0.0))
+    return [m for _, m in out.messages if m[0] & 0xF0 in (NOTE_ON, PITCH_BEND)]
+
+
+def test_program_change_switches_mapping(bank_file, default_mapping):
+    BANK.load(bank_file)
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+    recompiles = []
+    configs.add_listener(lambda: recompiles.append(1))
+
+    default = play(handler, out, 60)
+
+    handler(([PROGRAM_CHANGE, 5], 0.0))
+    assert BANK.active.program == 5
+    edo22 = play(handler, out, 60)
+    assert edo22 != default
+
+    handler(([PROGRAM_CHANGE, 0], 0.0))
+    assert play(handler, out, 60) == default
+
+    # switching only swaps the bank slot, nothing is recompiled
+    assert recompiles == []
+    assert CONFIGS.MAPPING is default_mapping
+
+
+def test_program_not_in_bank_is_forwarded(bank_file):
+    BANK.load(bank_file)
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+
+    handler(([PROGRAM_CHANGE, 7], 0.0))
+    assert [m for _, m in out.messages] == [(PROGRAM_CHANGE, 7)]
+    assert BANK.active is None
+
+
+def test_auto_split_follows_program(bank_file):
+    BANK.load(bank_file)
+    CONFIGS.MPE_MODE = False
+    CONFIGS.AUTO_SPLIT = SplitData(CONFIGS.MAPPING)
+    configs.configs_changed()
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+
+    handler(([PROGRAM_CHANGE, 5], 0.0))
+    notes = [m for m in play(handler, out, 60) if m[0] & 0xF0 == NOTE_ON]
+    # C4 is in the auto split region with no offset, sent as the 22edo note
+    note_22edo = BANK.active.mapping.calc_notes_from_a4(60, 64) + 69
+    assert notes == [(NOTE_ON | 4, note_22edo, notes[0][2])]
+
+
+def test_reload_keeps_program(bank_file):
+    BANK.load(bank_file)
+    assert BANK.select(5)
+    BANK.load(bank_file)
+    assert BANK.active.program == 5
+    assert BANK.active.mapping.mapping_file_name == '22edo.sbmap'
+
+
+def test_invalid_bank_keeps_current(bank_file, tmp_path):
+    BANK.load(bank_file)
+    invalid = str(tmp_path / 'invalid.sbbank')
+    with open(invalid, 'w') as f:
+        f.write('200 default.sbmap\n')
+
+    with pytest.raises(BankParsingError):
+        BANK.load(invalid)
+    assert BANK.file_path == bank_file
+    assert BANK.slots[5] is not None
+
+
+def test_deselect_goes_back_to_selected_mapping(bank_file):
+    BANK.load(bank_file)
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+    default = play(handler, out, 60)
+
+    handler(([PROGRAM_CHANGE, 5], 0.0))
+    assert play(handler, out, 60) != default
+    # e.g. the map command
+    assert BANK.deselect() == 5
+    assert play(handler, out, 60) == default
+    assert BANK.deselect() is None
+
+
+def test_bank_is_shared_by_devices(bank_file):
+    BANK.load(bank_file)
+    outs = [MemoryOutPort(), MemoryOutPort()]
+    handlers = [MidiInputHandler(out, device=device) for device, out in enumerate(outs)]
+    default = play(handlers[1], outs[1], 60)
+
+    handlers[0](([PROGRAM_CHANGE, 5], 0.0))
+    assert play(handlers[1], outs[1], 60) != default
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import configs
+from configs import CONFIGS, SlideMode
+from split import SplitData
+from voices import VoiceAllocation
+
+ADDED_IN_VERSION_2 = (
+    'VOICES_PER_SPLIT', 'VOICE_ALLOCATION', 'OUTPUT_FILTER', 'FILTER_MIN_CC_CHANGE', 'FILTER_MIN_PB_CHANGE',
+    'FILTER_MAX_RATE', 'INPUT_DECIMATION', 'BANK_FILE', 'SMOOTHING_ALPHA', 'SMOOTHING_EFFECT',
+    'SMOOTHING_BIAS', 'JOURNAL', 'DECIMATE_MIN_CC_CHANGE', 'DECIMATE_MIN_PB_CHANGE', 'DECIMATE_MAX_RATE',
+)
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch) -> str:
+    path = str(tmp_path / 'config.json')
+    monkeypatch.setattr(configs, 'CONFIG_FILE', path)
+    monkeypatch.setattr(configs, 'LEGACY_CONFIG_FILE', str(tmp_path / 'config.dill'))
+    return path
+
+
+def test_round_trip(config_file):
+    CONFIGS.MPE_MODE = False
+    CONFIGS.SLIDE_MODE = SlideMode.BIPOLAR
+    CONFIGS.PITCH_BEND_RANGE = 48
+    CONFIGS.VOICES_PER_SPLIT = 4
+    CONFIGS.VOICE_ALLOCATION = VoiceAllocation.ROUND_ROBIN
+    CONFIGS.SPLITS = SplitData()
+    CONFIGS.SPLITS.add_split(64, -31)
+    configs.save_configs().result()
+
+    CONFIGS.MPE_MODE = True
+    CONFIGS.SLIDE_MODE = SlideMode.RELATIVE
+    CONFIGS.PITCH_BEND_RANGE = 24
+    CONFIGS.VOICES_PER_SPLIT = 1
+    CONFIGS.VOICE_ALLOCATION = VoiceAllocation.LRU
+    assert configs.read_configs()
+
+    assert CONFIGS.MPE_MODE is False
+    assert CONFIGS.SLIDE_MODE == SlideMode.BIPOLAR
+    assert CONFIGS.PITCH_BEND_RANGE == 48
+    assert CONFIGS.VOICES_PER_SPLIT == 4
+    assert CONFIGS.VOICE_ALLOCATION == VoiceAllocation.ROUND_ROBIN
+    assert CONFIGS.SPLITS.get_splits() == [(64, -31)]
+    # the mapping is recompiled for the saved pitch bend range
+    assert CONFIGS.MAPPING.pitch_bend_range == 48
+
+
+def test_version_1_gets_defaults(config_file):
+    configs.save_configs().result()
+    with open(config_file) as f:
+        c = json.load(f)
+    c['version'] = 1
+    for name in ADDED_IN_VERSION_2:
+        del c[name]
+    with open(config_file, 'w') as f:
+        json.dump(c, f)
+
+    CONFIGS.VOICES_PER_SPLIT = 3
+    CONFIGS.SMOOTHING_ALPHA = 0.5
+    CONFIGS.JOURNAL = False
+    assert configs.read_configs()
+    assert CONFIGS.VOICES_PER_SPLIT == 1
+    assert CONFIGS.SMOOTHING_ALPHA == 0.04
+    assert CONFIGS.JOURNAL is True
+
+
+def test_newer_version_is_ignored(config_file):
+    configs.save_configs().result()
+    with open(config_file) as f:
+        c = json.load(f)
+    c['version'] = configs.CONFIG_VERSION + 1
+    c['PITCH_BEND_RANGE'] = 2
+    with open(config_file, 'w') as f:
+        json.dump(c, f)
+
+    assert not configs.read_configs()
+    assert CONFIGS.PITCH_BEND_RANGE == 24
+
+
+def test_missing_mapping_changes_nothing(config_file, tmp_path):
+    CONFIGS.PITCH_BEND_RANGE = 48
+    CONFIGS.MPE_MODE = False
+    configs.save_configs().result()
+    with open(config_file) as f:
+        c = json.load(f)
+    c['MAPPING']['path'] = str(tmp_path / 'deleted.sbmap')
+    with open(config_file, 'w') as f:
+        json.dump(c, f)
+
+    CONFIGS.PITCH_BEND_RANGE = 24
+    CONFIGS.MPE_MODE = True
+    assert not configs.read_configs()
+    assert CONFIGS.PITCH_BEND_RANGE == 24
+    assert CONFIGS.MPE_MODE is True
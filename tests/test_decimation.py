@@ -0,0 +1,50 @@
+import time
+
+import configs
+from configs import CONFIGS
+from handler import MidiInputHandler
+from midi import CHANNEL_PRESSURE, CONTROL_CHANGE, NOTE_OFF, NOTE_ON
+from replay import MemoryOutPort
+
+
+def play_burst(handler: MidiInputHandler):
+    handler(([CONTROL_CHANGE | 1, 74, 64], 0.0))
+    handler(([NOTE_ON | 1, 60, 100], 0.0))
+    for pressure in range(0, 128, 8):
+        handler(([CHANNEL_PRESSURE | 1, pressure], 0.0))
+
+
+def pressures(out: MemoryOutPort) -> list[tuple[int, ...]]:
+    return [m for _, m in out.messages if m[0] & 0xF0 == CHANNEL_PRESSURE]
+
+
+def decimating_handler() -> tuple[MidiInputHandler, MemoryOutPort]:
+    CONFIGS.INPUT_DECIMATION = True
+    CONFIGS.DECIMATE_MAX_RATE = 20
+    CONFIGS.OUTPUT_FILTER = False
+    configs.configs_changed()
+    out = MemoryOutPort()
+    return MidiInputHandler(out), out
+
+
+def test_final_value_of_burst_is_handled():
+    handler, out = decimating_handler()
+    play_burst(handler)
+    assert pressures(out) == [(CHANNEL_PRESSURE | 1, 0)]
+
+    deadline = time.perf_counter() + 1
+    while len(pressures(out)) < 2 and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    assert pressures(out) == [(CHANNEL_PRESSURE | 1, 0), (CHANNEL_PRESSURE | 1, 120)]
+
+
+def test_note_off_handles_final_value_first():
+    handler, out = decimating_handler()
+    play_burst(handler)
+    handler(([NOTE_OFF | 1, 60, 0], 0.0))
+
+    messages = [m for _, m in out.messages]
+    assert messages.index((CHANNEL_PRESSURE | 1, 120)) < messages.index((NOTE_OFF | 1, 60, 0))
+    # and isn't handled again later
+    time.sleep(0.1)
+    assert len(pressures(out)) == 2
@@ -0,0 +1,42 @@
+import gc
+import threading
+import weakref
+
+import configs
+from configs import CONFIGS
+from handler import MidiInputHandler, mpe_channel_maps
+from midi import CONTROL_CHANGE, NOTE_OFF, NOTE_ON
+from replay import MemoryOutPort
+
+
+def test_closed_handler_is_released():
+    handler = MidiInputHandler(MemoryOutPort())
+    handler.close()
+    ref = weakref.ref(handler)
+    del handler
+    gc.collect()
+    assert ref() is None
+
+    # nothing is left to recompile
+    configs.configs_changed()
+
+
+def test_devices_get_their_own_channels_in_midi_mode():
+    CONFIGS.MPE_MODE = False
+    CONFIGS.VOICES_PER_SPLIT = 2
+    configs.configs_changed()
+    out = MemoryOutPort()
+    port_lock = threading.Lock()
+    handlers = [MidiInputHandler(out, channel_map=channel_map, port_lock=port_lock, device=device)
+                for device, channel_map in enumerate(mpe_channel_maps(2))]
+
+    # both devices play on the same input channels
+    for handler in handlers:
+        for in_channel, note in ((1, 60), (2, 64)):
+            handler(([CONTROL_CHANGE | in_channel, 74, 64], 0.0))
+            handler(([NOTE_ON | in_channel, note, 100], 0.0))
+
+    note_ons = [m for _, m in out.messages if m[0] & 0xF0 == NOTE_ON]
+    assert [m[0] & 0x0F for m in note_ons] == [1, 2, 9, 10]
+    # no note was turned off to make room
+    assert not [m for _, m in out.messages if m[0] & 0xF0 == NOTE_OFF]
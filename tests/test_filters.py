@@ -0,0 +1,129 @@
+import time
+
+import configs
+from configs import CONFIGS
+from filters import ChangeFilter
+from handler import MidiInputHandler
+from midi import CHANNEL_PRESSURE, CONTROL_CHANGE, NOTE_OFF, NOTE_ON, PITCH_BEND
+from replay import MemoryOutPort
+
+
+def test_drops_repeated_values():
+    f = ChangeFilter()
+    assert f.accept(CONTROL_CHANGE | 1, 74, 64)
+    assert not f.accept(CONTROL_CHANGE | 1, 74, 64)
+    assert f.accept(CONTROL_CHANGE | 1, 74, 65)
+
+    assert f.accept(PITCH_BEND | 1, 0, 64)
+    assert not f.accept(PITCH_BEND | 1, 0, 64)
+
+    assert f.accept(CHANNEL_PRESSURE | 1, 10)
+    assert not f.accept(CHANNEL_PRESSURE | 1, 10)
+
+
+def test_slots_are_independent():
+    f = ChangeFilter()
+    assert f.accept(CONTROL_CHANGE | 1, 74, 64)
+    # other controller, other channel
+    assert f.accept(CONTROL_CHANGE | 1, 1, 64)
+    assert f.accept(CONTROL_CHANGE | 2, 74, 64)
+
+
+def test_min_change():
+    f = ChangeFilter(min_cc_change=4, min_pb_change=100)
+    assert f.accept(CONTROL_CHANGE, 74, 64)
+    assert not f.accept(CONTROL_CHANGE, 74, 67)
+    assert f.accept(CONTROL_CHANGE, 74, 68)
+
+    assert f.accept(PITCH_BEND, 0, 64)  # 8192
+    assert not f.accept(PITCH_BEND, 99, 64)
+    assert f.accept(PITCH_BEND, 100, 64)
+
+
+def test_max_rate():
+    f = ChangeFilter(max_rate=1)
+    assert f.accept(CONTROL_CHANGE, 74, 0)
+    # changed, but less than a second after the last message
+    assert not f.accept(CONTROL_CHANGE, 74, 127)
+
+
+def test_note_on_resets_channel():
+    f = ChangeFilter()
+    assert f.accept(CONTROL_CHANGE | 3, 74, 64)
+    assert f.accept(NOTE_ON | 3, 60, 100)
+    assert f.accept(CONTROL_CHANGE | 3, 74, 64)
+
+    # note offs always pass, and don't reset
+    assert f.accept(NOTE_OFF | 3, 60, 0)
+    assert not f.accept(CONTROL_CHANGE | 3, 74, 64)
+
+
+def test_forget():
+    f = ChangeFilter()
+    assert f.accept(PITCH_BEND | 4, 0, 64)
+    f.forget(PITCH_BEND | 4, 0)
+    assert f.accept(PITCH_BEND | 4, 0, 64)
+
+    assert f.accept(CONTROL_CHANGE | 4, 74, 64)
+    f.reset_channel(4)
+    assert f.accept(CONTROL_CHANGE | 4, 74, 64)
+
+
+def wait_for(condition, timeout=1.0):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_max_rate_sends_final_value_of_burst():
+    trailing = []
+    f = ChangeFilter(max_rate=20, on_trailing=lambda *message: trailing.append(message))
+    assert f.accept(CONTROL_CHANGE, 74, 0)
+    for value in range(1, 10):
+        assert not f.accept(CONTROL_CHANGE, 74, value)
+
+    # only the latest dropped value is sent, once the rate allows it
+    assert wait_for(lambda: trailing)
+    time.sleep(0.1)
+    assert trailing == [(CONTROL_CHANGE, 74, 9)]
+    # and counts as the last value passed
+    assert not f.accept(CONTROL_CHANGE, 74, 9)
+
+
+def test_note_off_sends_final_value_first():
+    trailing = []
+    f = ChangeFilter(max_rate=1, on_trailing=lambda *message: trailing.append(message))
+    assert f.accept(PITCH_BEND | 2, 0, 64)
+    assert not f.accept(PITCH_BEND | 2, 0, 70)
+
+    assert f.accept(NOTE_OFF | 2, 60, 0)
+    assert (PITCH_BEND | 2, 0, 70) in trailing
+
+
+def test_superseded_final_value_isnt_sent():
+    trailing = []
+    f = ChangeFilter(max_rate=20, on_trailing=lambda *message: trailing.append(message))
+    assert f.accept(CONTROL_CHANGE | 1, 74, 0)
+    assert not f.accept(CONTROL_CHANGE | 1, 74, 50)
+    # a new note starts over
+    assert f.accept(NOTE_ON | 1, 60, 100)
+    time.sleep(0.1)
+    assert trailing == []
+
+
+def test_output_sends_final_value_of_burst():
+    CONFIGS.FILTER_MAX_RATE = 20
+    configs.configs_changed()
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+    handler(([CONTROL_CHANGE | 1, 74, 64], 0.0))
+    handler(([NOTE_ON | 1, 60, 100], 0.0))
+    for pressure in range(0, 128, 8):
+        handler(([CHANNEL_PRESSURE | 1, pressure], 0.0))
+
+    def pressures():
+        return [m for _, m in out.messages if m[0] & 0xF0 == CHANNEL_PRESSURE]
+    assert pressures() == [(CHANNEL_PRESSURE | 1, 0)]
+    assert wait_for(lambda: len(pressures()) == 2)
+    assert pressures()[-1] == (CHANNEL_PRESSURE | 1, 120)
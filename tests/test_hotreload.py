@@ -0,0 +1,40 @@
+import configs
+from configs import CONFIGS
+from handler import MidiInputHandler
+from midi import CONTROL_CHANGE, NOTE_OFF, NOTE_ON
+from replay import MemoryOutPort
+from split import SplitData
+
+
+def test_layout_change_keeps_held_notes_on_channels_still_used():
+    CONFIGS.MPE_MODE = False
+    CONFIGS.SPLITS = SplitData()
+    CONFIGS.SPLITS.add_split(60, 0)
+    CONFIGS.SPLITS.add_split(128, 0)
+    CONFIGS.VOICES_PER_SPLIT = 2
+    configs.configs_changed()
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+
+    # one note in each region: channels 0 (region 1) and 2 (region 2)
+    for in_channel, note in ((1, 48), (2, 72)):
+        handler(([CONTROL_CHANGE | in_channel, 74, 64], 0.0))
+        handler(([NOTE_ON | in_channel, note, 100], 0.0))
+    assert handler.voices.active_voices() == [(1, 0), (2, 2)]
+
+    # e.g. a reloaded mapping with other auto split regions: each region only has one channel now
+    CONFIGS.VOICES_PER_SPLIT = 1
+    configs.configs_changed()
+    out.clear()
+    handler(([CONTROL_CHANGE | 3, 1, 0], 0.0))
+
+    note_offs = [m for _, m in out.messages if m[0] & 0xF0 == NOTE_OFF]
+    assert [m[0] & 0x0F for m in note_offs] == [2]
+    assert handler.voices.active_voices() == [(1, 0)]
+
+    out.clear()
+    handler(([NOTE_OFF | 1, 48, 0], 0.0))
+    # the kept note is still turned off on its channel
+    note_offs = [m for _, m in out.messages if m[0] & 0xF0 == NOTE_OFF]
+    assert [m[0] & 0x0F for m in note_offs] == [0]
+    assert handler.voices.active_voices() == []
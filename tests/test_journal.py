@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+import journal
+import replay
+from configs import CONFIGS, SlideMode
+from journal import INPUT, OUTPUT, SESSION, SETTINGS, Journal, JournalError
+
+
+@pytest.fixture
+def journal_path(tmp_path) -> str:
+    return str(tmp_path / 'journal.sbj')
+
+
+def test_file_format(journal_path):
+    j = Journal()
+    j.open(journal_path, capacity=8)
+    j.record(INPUT, 1, [0x90, 60, 100], 1000.5)
+    j.record(OUTPUT, 1, [0x91, 62, 100], 1000.75)
+    j.close()
+
+    with open(journal_path, 'rb') as f:
+        data = f.read()
+    assert len(data) == journal.HEADER.size + 8 * journal.RECORD.size
+    assert journal.HEADER.unpack_from(data) == (journal.MAGIC, 8, 3)
+    t, kind, length, msg = journal.RECORD.unpack_from(data, journal.HEADER.size + journal.RECORD.size)
+    assert (t, kind, length, msg) == (1000.5, 1 << 2 | INPUT, 3, bytes([0x90, 60, 100]))
+
+
+def test_read_journal(journal_path):
+    j = Journal()
+    j.open(journal_path, capacity=8)
+    j.record(INPUT, 0, [0xB0, 74, 64], 10.0)
+    j.record(OUTPUT, 2, [0xD0, 5], 11.0)
+    j.record(INPUT, 0, [0xF0, 1, 2, 3, 0xF7], 12.0)
+    j.close()
+
+    records = journal.read_journal(journal_path)
+    assert [r[1] for r in records] == [SESSION, INPUT, OUTPUT, INPUT]
+    assert records[1] == (10.0, INPUT, 0, 3, bytes([0xB0, 74, 64]))
+    assert records[2] == (11.0, OUTPUT, 2, 2, bytes([0xD0, 5]))
+    # only the first 3 bytes of longer messages are kept
+    assert records[3] == (12.0, INPUT, 0, 5, bytes([0xF0, 1, 2]))
+    assert journal.format_record(records[3]).endswith('in 0 f0 01 02 ...')
+
+
+def test_ring_overwrites_oldest(journal_path):
+    j = Journal()
+    j.open(journal_path, capacity=4)
+    for i in range(10):
+        j.record(INPUT, 0, [0x90, i, 100], float(i))
+    j.close()
+
+    records = journal.read_journal(journal_path)
+    assert [r[4][1] for r in records] == [6, 7, 8, 9]
+
+
+def test_reopen_continues_ring(journal_path):
+    j = Journal()
+    j.open(journal_path, capacity=8)
+    j.record(INPUT, 0, [0x90, 60, 100], 1.0)
+    j.close()
+    j.open(journal_path, capacity=8)
+    j.close()
+
+    assert [r[1] for r in journal.read_journal(journal_path)] == [SESSION, INPUT, SESSION]
+
+
+def test_input_events_of_last_session(journal_path):
+    j = Journal()
+    j.open(journal_path, capacity=16)
+    j.record(INPUT, 0, [0x90, 40, 100], 1.0)
+    j.open(journal_path, capacity=16)
+    j.record(INPUT, 0, [0xB0, 74, 64], 2.0)
+    j.record(INPUT, 1, [0x90, 61, 100], 2.1)
+    j.record(OUTPUT, 0, [0x90, 60, 100], 2.2)
+    j.record(INPUT, 0, [0x90, 60, 100], 2.5)
+    j.close()
+
+    events = journal.input_events(journal.read_journal(journal_path), device=0)
+    assert [m for m, _ in events] == [[0xB0, 74, 64], [0x90, 60, 100]]
+    assert events[0][1] == 0.0
+    assert events[1][1] == pytest.approx(0.5)
+
+
+def test_not_a_journal(journal_path):
+    with open(journal_path, 'wb') as f:
+        f.write(b'\0' * 100)
+    with pytest.raises(JournalError):
+        journal.read_journal(journal_path)
+
+
+def test_settings_of_last_session(journal_path):
+    mapping = os.path.abspath(os.path.join('mappings', '22edo.sbmap'))
+    j = Journal()
+    j.open(journal_path, capacity=64)
+    j.record_settings((True, SlideMode.RELATIVE.value, 64, 24, None), 1.0)
+    j.open(journal_path, capacity=64)
+    j.record_settings((False, SlideMode.FIXED.value, 100, 48, mapping), 2.0)
+    # unchanged settings aren't recorded again
+    j.record_settings((False, SlideMode.FIXED.value, 100, 48, mapping), 2.1)
+    j.record(INPUT, 0, [0x90, 60, 100], 2.5)
+    # changed after the first input message
+    j.record_settings((True, SlideMode.PRESS.value, 100, 48, mapping), 3.0)
+    j.close()
+
+    records = journal.read_journal(journal_path)
+    # mode, pitch bend range and the mapping path 3 bytes per record, twice
+    assert [r[1] for r in journal.last_session(records)].count(SETTINGS) == (2 + -(-len(mapping) // 3)) * 2
+    assert journal.session_settings(records) == (False, SlideMode.FIXED.value, 100, 48, mapping)
+    assert journal.format_record(journal.last_session(records)[0]).endswith('settings mpe 0, slide mode 1, fixed slide 100')
+    assert journal.input_events(records) == [([0x90, 60, 100], 0.0)]
+
+
+def test_no_settings(journal_path):
+    j = Journal()
+    j.open(journal_path, capacity=8)
+    j.record(INPUT, 0, [0x90, 60, 100], 1.0)
+    j.close()
+    assert journal.session_settings(journal.read_journal(journal_path)) is None
+
+
+def test_replay_restores_settings(journal_path, tmp_path):
+    mapping = os.path.abspath(os.path.join('mappings', '22edo.sbmap'))
+    j = Journal()
+    j.open(journal_path, capacity=64)
+    j.record_settings((False, SlideMode.FIXED.value, 100, 48, mapping), 1.0)
+    j.record(INPUT, 0, [0xB0 | 1, 74, 64], 1.0)
+    j.record(INPUT, 0, [0x90 | 1, 60, 100], 1.1)
+    j.close()
+
+    output = str(tmp_path / 'output.log')
+    replay.main([journal_path, '--output', output])
+    assert not CONFIGS.MPE_MODE
+    assert (CONFIGS.SLIDE_MODE, CONFIGS.SLIDE_FIXED_N) == (SlideMode.FIXED, 100)
+    assert CONFIGS.PITCH_BEND_RANGE == 48
+    assert CONFIGS.MAPPING.file_path == mapping
+
+    # arguments take precedence over the recorded settings
+    replay.main([journal_path, '--output', output, '--pb', '2', '--slide', 'abs'])
+    assert CONFIGS.SLIDE_MODE == SlideMode.ABSOLUTE
+    assert CONFIGS.PITCH_BEND_RANGE == 2
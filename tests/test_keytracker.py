@@ -0,0 +1,74 @@
+import time
+
+from keytracker import CC74_DOUBLE_CHECK_DELAY, KeyTracker, ON, PENDING, RESOLVED, WAITING
+
+
+def test_cc74_before_note_on():
+    tracker = KeyTracker()
+    assert tracker.get_state(1) == WAITING
+
+    assert tracker.register_cc74(1, 40) is None
+    assert tracker.get_state(1) == RESOLVED
+
+    # forwarded immediately with the cc74 that was received first
+    assert tracker.note_on(60, 100, 1) == 40
+    tracker.register_on(60, 100, 1, 62, 1, 3)
+    assert tracker.get_state(1) == ON
+    assert tracker.check_existing(1).midi_note_sent == 62
+
+
+def test_note_on_before_cc74():
+    tracker = KeyTracker()
+    assert tracker.note_on(60, 100, 2) is None
+    assert tracker.get_state(2) == PENDING
+    assert tracker.check_waiting_for_cc74(2)
+
+    # the cc74 resolves the pending note, which then has to be forwarded
+    pending = tracker.register_cc74(2, 70)
+    assert pending is not None
+    assert pending.midi_note_received == 60
+    assert pending.on_velocity_received == 100
+    assert tracker.get_state(2) == RESOLVED
+
+    tracker.register_on(60, 100, 2, 60, 2, 0)
+    assert tracker.get_state(2) == ON
+
+
+def test_slide_while_on_returns_initial_cc74():
+    tracker = KeyTracker()
+    tracker.register_cc74(3, 30)
+    tracker.note_on(60, 100, 3)
+    tracker.register_on(60, 100, 3, 60, 3, 0)
+
+    assert tracker.register_cc74(3, 90) == 30
+    assert tracker.get_initial_cc74(3) == 30
+
+
+def test_note_off():
+    tracker = KeyTracker()
+    tracker.register_cc74(4, 64)
+    tracker.note_on(60, 100, 4)
+    tracker.register_on(60, 100, 4, 60, 4, 0)
+
+    tracker.register_off(4)
+    assert tracker.get_state(4) == WAITING
+    assert tracker.check_existing(4) is None
+    # the next note has to wait for its own cc74
+    assert tracker.note_on(61, 100, 4) is None
+
+
+def test_stray_cc74_is_double_checked():
+    tracker = KeyTracker()
+    tracker.register_cc74(5, 64)
+    assert tracker.get_state(5) == RESOLVED
+
+    # no note on followed the cc74, e.g. it arrived after its note off
+    time.sleep(CC74_DOUBLE_CHECK_DELAY * 10)
+    assert tracker.get_state(5) == WAITING
+
+
+def test_channels_are_independent():
+    tracker = KeyTracker()
+    tracker.register_cc74(6, 64)
+    assert tracker.get_state(6) == RESOLVED
+    assert tracker.get_state(7) == WAITING
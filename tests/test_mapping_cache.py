@@ -0,0 +1,92 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import DEFAULT_MAPPING
+from mapping import Mapping, cache_path
+
+
+@pytest.fixture
+def sbmap(tmp_path) -> str:
+    path = str(tmp_path / 'default.sbmap')
+    shutil.copyfile(DEFAULT_MAPPING, path)
+    return path
+
+
+@pytest.fixture
+def compiles(monkeypatch) -> list:
+    """
+    Mappings parsed and compiled from their .sbmap file (not loaded from the cache).
+    """
+    compiled = []
+    compile_tables = Mapping.compile_tables
+
+    def counting_compile_tables(self):
+        compiled.append(self)
+        compile_tables(self)
+    monkeypatch.setattr(Mapping, 'compile_tables', counting_compile_tables)
+    return compiled
+
+
+def test_cache_is_written_and_reused(sbmap, compiles):
+    parsed = Mapping(sbmap)
+    assert len(compiles) == 1
+    assert os.path.isfile(cache_path(sbmap))
+
+    cached = Mapping(sbmap)
+    assert len(compiles) == 1
+    for note in (0, 60, 127):
+        for cc74 in (0, 64, 127):
+            assert cached.calc_notes_from_a4(note, cc74) == parsed.calc_notes_from_a4(note, cc74)
+            assert cached.calc_pitchbend_msg(note, cc74) == parsed.calc_pitchbend_msg(note, cc74)
+
+
+def test_touched_file_keeps_cache(sbmap, compiles):
+    Mapping(sbmap)
+    stat = os.stat(sbmap)
+    os.utime(sbmap, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    Mapping(sbmap)
+    assert len(compiles) == 1
+
+
+def test_changed_file_invalidates_cache(sbmap, compiles):
+    before = Mapping(sbmap).calc_notes_from_a4(0, 0)
+
+    with open(sbmap) as f:
+        lines = f.read().split('\n')
+    with open(sbmap, 'w') as f:
+        for line in lines:
+            if line.startswith('C-1 '):
+                # one step higher, same file size
+                line = line.replace('-179', '-178', 1)
+            f.write(line + '\n')
+
+    after = Mapping(sbmap)
+    assert len(compiles) == 2
+    assert after.calc_notes_from_a4(0, 0) == before + 1
+
+
+def test_corrupt_cache_is_ignored(sbmap, compiles):
+    Mapping(sbmap)
+    with open(cache_path(sbmap), 'r+b') as f:
+        f.write(b'XXXX')
+
+    Mapping(sbmap)
+    assert len(compiles) == 2
+
+
+def test_edit_within_same_mtime_invalidates_cache(sbmap, compiles):
+    Mapping(sbmap)
+    stat = os.stat(sbmap)
+    with open(sbmap) as f:
+        text = f.read()
+    with open(sbmap, 'w') as f:
+        f.write(text.replace('-179', '-178', 1))
+    # saved again within the same mtime tick, with the same size
+    os.utime(sbmap, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(sbmap).st_size == stat.st_size
+
+    Mapping(sbmap)
+    assert len(compiles) == 2
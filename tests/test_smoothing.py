@@ -0,0 +1,37 @@
+import json
+
+import configs
+from configs import CONFIGS
+from smoothing import compile_smoothing_table
+
+
+def test_table_with_effect_larger_than_bias():
+    table = compile_smoothing_table(effect=1.5, bias=1.0)
+    # the exponent is negative for heavy averages, every velocity is loud
+    assert table[127 << 7 | 1] == 127
+    assert table[0 << 7 | 1] == 1
+    assert all(1 <= v <= 127 for v in table)
+
+
+def test_table_at_mid_average_applies_bias():
+    table = compile_smoothing_table(effect=0.4, bias=1.0)
+    assert table[64 << 7 | 100] in (99, 100, 101)
+
+
+def test_saved_effect_larger_than_bias_is_ignored(tmp_path, monkeypatch):
+    path = str(tmp_path / 'config.json')
+    monkeypatch.setattr(configs, 'CONFIG_FILE', path)
+    monkeypatch.setattr(configs, 'LEGACY_CONFIG_FILE', str(tmp_path / 'config.dill'))
+    configs.save_configs().result()
+    with open(path) as f:
+        c = json.load(f)
+    c['SMOOTHING_EFFECT'] = 2.0
+    c['SMOOTHING_BIAS'] = 1.0
+    c['PITCH_BEND_RANGE'] = 48
+    with open(path, 'w') as f:
+        json.dump(c, f)
+
+    assert configs.read_configs()
+    assert CONFIGS.PITCH_BEND_RANGE == 48
+    assert CONFIGS.SMOOTHING_EFFECT == 0.4
+    assert CONFIGS.SMOOTHING_BIAS == 1.0
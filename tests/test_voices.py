@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+import configs
+from configs import CONFIGS, SlideMode
+from handler import MidiInputHandler
+from midi import CONTROL_CHANGE, NOTE_OFF, NOTE_ON
+from replay import MemoryOutPort
+from voices import VoiceAllocation, VoiceAllocator
+
+
+def test_one_channel_per_region():
+    voices = VoiceAllocator(num_regions=2)
+    assert voices.allocate(1, 0) == (0, -1)
+    assert voices.allocate(2, 1) == (1, -1)
+    assert voices.channel_of(1) == 0
+    assert voices.channel_of(2) == 1
+
+
+def test_lru():
+    voices = VoiceAllocator(channels_per_region=3)
+    assert voices.allocate(1, 0) == (0, -1)
+    assert voices.allocate(2, 0) == (1, -1)
+    assert voices.release(1) == 0
+    # channel 2 was never used, channel 0 was released the latest
+    assert voices.allocate(3, 0) == (2, -1)
+    assert voices.allocate(4, 0) == (0, -1)
+
+
+def test_round_robin():
+    voices = VoiceAllocator(channels_per_region=3, policy=VoiceAllocation.ROUND_ROBIN)
+    assert voices.allocate(1, 0) == (0, -1)
+    assert voices.release(1) == 0
+    # continues after the last allocated channel instead of reusing channel 0
+    assert voices.allocate(2, 0) == (1, -1)
+    assert voices.release(2) == 1
+    assert voices.allocate(3, 0) == (2, -1)
+    assert voices.release(3) == 2
+    assert voices.allocate(4, 0) == (0, -1)
+
+
+def test_steal_oldest_note_of_region():
+    voices = VoiceAllocator(num_regions=2, channels_per_region=2)
+    voices.allocate(1, 0)
+    voices.allocate(2, 0)
+    voices.allocate(3, 1)
+
+    assert voices.allocate(4, 0) == (0, 1)
+    assert voices.channel_of(1) == -1
+    # the stolen note has no channel to release anymore
+    assert voices.release(1) == -1
+    assert sorted(voices.active_voices()) == [(2, 1), (3, 2), (4, 0)]
+
+
+def test_channels():
+    assert list(VoiceAllocator(num_regions=3, channels_per_region=4).channels()) == list(range(12))
+    with pytest.raises(ValueError):
+        VoiceAllocator(num_regions=9, channels_per_region=2)
+
+
+def test_first_channel():
+    voices = VoiceAllocator(num_regions=2, channels_per_region=2, first_channel=9)
+    assert list(voices.channels()) == [9, 10, 11, 12]
+    assert voices.allocate(1, 1) == (11, -1)
+    assert voices.release(1) == 11
+    with pytest.raises(ValueError):
+        VoiceAllocator(num_regions=2, channels_per_region=4, first_channel=9)
+
+
+def test_adopt():
+    voices = VoiceAllocator(channels_per_region=2)
+    assert voices.adopt(3, 1)
+    assert not voices.adopt(4, 1)
+    assert not voices.adopt(5, 7)
+    assert voices.allocate(6, 0) == (0, -1)
+    assert voices.release(3) == 1
+
+
+def test_handler_gives_each_note_its_own_channel():
+    CONFIGS.MPE_MODE = False
+    CONFIGS.VOICES_PER_SPLIT = 2
+    configs.configs_changed()
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+
+    for in_channel, note in ((1, 60), (2, 64), (3, 67)):
+        handler(([CONTROL_CHANGE | in_channel, 74, 64], 0.0))
+        handler(([NOTE_ON | in_channel, note, 100], 0.0))
+
+    messages = [m for _, m in out.messages]
+    note_ons = [m for m in messages if m[0] & 0xF0 == NOTE_ON and m[2] > 0]
+    assert [m[0] & 0x0F for m in note_ons] == [0, 1, 0]
+    # the first note was stolen for the third
+    assert (NOTE_OFF, note_ons[0][1], 0) in messages
+    assert handler.voices.channel_of(1) == -1
+
+
+def test_fixed_slide_goes_to_the_channel_of_the_note():
+    CONFIGS.MPE_MODE = False
+    CONFIGS.SLIDE_MODE = SlideMode.FIXED
+    CONFIGS.SLIDE_FIXED_N = 100
+    CONFIGS.VOICES_PER_SPLIT = 2
+    configs.configs_changed()
+    out = MemoryOutPort()
+    handler = MidiInputHandler(out)
+
+    for in_channel, note in ((5, 60), (6, 64), (7, 67)):
+        handler(([CONTROL_CHANGE | in_channel, 74, 64], 0.0))
+        handler(([NOTE_ON | in_channel, note, 100], 0.0))
+        time.sleep(0.05)
+
+    fixed = [m[0] & 0x0F for _, m in out.messages if m[0] & 0xF0 == CONTROL_CHANGE and m[2] == 100]
+    # sent on the output channel of each note, not on its input channel
+    assert fixed == [0, 1, 0]
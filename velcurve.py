@@ -9,6 +9,8 @@ Several velocity curves are defined
 import os
 from typing import Optional
 
+from log import LOG
+
 
 class VelocityCurves:
     def __init__(self, file_path: Optional[str] = None):
@@ -34,6 +36,16 @@ class VelocityCurves:
 
         where curve index refers to the index in vel_curves.
         """
+        self.__curve_index: Optional[bytearray] = None
+        """
+        Compiled from `key_vel_curves`: (physical key, cc74) -> curve index, indexed by `key << 7 | cc74`.
+
+        None if the default velocity curve is used.
+        """
+        self.__curve_table: Optional[bytearray] = None
+        """
+        Compiled from `vel_curves`: all curves laid out contiguously, indexed by `curve index << 7 | velocity`.
+        """
 
         if file_path is not None:
             self.load(file_path)
@@ -42,9 +54,47 @@ class VelocityCurves:
             self.set_default()
             self.file_name = 'default'
 
+        self.file_path = file_path
+        """
+        Path of the loaded .vel file (None for the default curve), used to save the curves in the configs by reference.
+        """
+
     def set_default(self):
         self.vel_curves = []
         self.key_vel_curves = None
+        self.__curve_index = None
+        self.__curve_table = None
+
+    def compile_tables(self):
+        """
+        Flattens `key_vel_curves` and `vel_curves` into the byte arrays used by `get_velocity`.
+        """
+        if self.key_vel_curves is None:
+            self.__curve_index = None
+            self.__curve_table = None
+            return
+
+        curve_index = bytearray(49 * 128)
+        for key, cc74_index_pairs in enumerate(self.key_vel_curves):
+            cc74 = 0
+            for cc74_bound, idx in cc74_index_pairs:
+                while cc74 <= cc74_bound:
+                    curve_index[key << 7 | cc74] = idx
+                    cc74 += 1
+
+        self.__curve_table = bytearray(v for curve in self.vel_curves for v in curve)
+        self.__curve_index = curve_index
+
+    def __getstate__(self):
+        # The compiled tables are derived data, don't persist them in saved configs.
+        state = self.__dict__.copy()
+        state['_VelocityCurves__curve_index'] = None
+        state['_VelocityCurves__curve_table'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compile_tables()
 
     def load(self, file_path: str):
         """
@@ -115,6 +165,7 @@ class VelocityCurves:
                             max_curve_index = curve_index
 
                         assert curve_index >= 0, f'Key {key} (line {key + 1}) has invalid curve index {curve_index}'
+                        assert curve_index < 256, f'Key {key} (line {key + 1}) has invalid curve index {curve_index}. At most 256 curves are supported.'
 
                         assert cc74 > prev_cc74, f'Key {key} (line {key + 1}) has invalid CC74 value {cc74} which is <= previous {prev_cc74}. Must be specified in strictly increasing order.'
                         cc74_index_pairs.append((cc74, curve_index))
@@ -141,6 +192,7 @@ class VelocityCurves:
                 print(f'Loaded {len(curves)} velocity curves for 49 keys.')
                 self.key_vel_curves = kvc
                 self.vel_curves = curves
+                self.compile_tables()
             except AssertionError as e:
                 print(f'Vel curve format error: {e}')
                 print('Using default velocity curve')
@@ -150,23 +202,21 @@ class VelocityCurves:
         """
         Get the output velocity for a given input velocity, midi note, and cc74 value.
         """
-        if self.key_vel_curves is None:
+        curve_index_table = self.__curve_index
+        if curve_index_table is None:
             return velocity
 
         physical_key_idx = midi_note - 12 * (octave_offset) # 0 is the lowest key on the seaboard, 48 is the highest.
 
         if physical_key_idx < 0 or physical_key_idx > 48:
-            print(f'WARNING: physical key index {physical_key_idx} out of range. Try pressing the octave switch to update octave offset.')
+            LOG.warning('WARNING: physical key index %d out of range. Try pressing the octave switch to update octave offset.',
+                        physical_key_idx)
             return velocity
 
-        # find the curve index for the given cc74 value
-        curve_index = 0
-        for cc74_bound, idx in self.key_vel_curves[physical_key_idx]:
-            if cc74 <= cc74_bound:
-                curve_index = idx
-                break
+        curve_index = curve_index_table[physical_key_idx << 7 | cc74]
 
         if debug:
-            print(f'Key {physical_key_idx} (midi {midi_note}, oct {octave_offset}) curve index {curve_index}, cc74 {cc74}')
+            LOG.debug('Key %d (midi %d, oct %d) curve index %d, cc74 %d', physical_key_idx, midi_note, octave_offset, curve_index, cc74)
+
+        return self.__curve_table[curve_index << 7 | velocity]
 
-        return self.vel_curves[curve_index][velocity]
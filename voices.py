@@ -0,0 +1,163 @@
+"""
+Voice allocation of MIDI mode output channels.
+
+Each split region (or auto-split octave) gets a pool of output channels. Every note gets a channel
+of its own from the pool of its region, so that the pitch bend of one note doesn't bend the other
+notes of the region. When all channels of a pool are in use, the oldest note of the region is stolen.
+
+With one channel per region (the default), this is the same as sending each region to its own channel.
+"""
+from collections import OrderedDict
+from enum import Enum
+
+NUM_CHANNELS = 16
+
+
+class VoiceAllocation(Enum):
+    LRU = 1             # use the channel that was released the longest ago
+    ROUND_ROBIN = 2     # cycle through the channels of the pool
+
+
+class VoiceAllocator:
+    """
+    Assigns output channels to notes, identified by the input channel they were received on.
+
+    Not thread safe, only used from the thread handling input events.
+    """
+    def __init__(self, num_regions: int = 1, channels_per_region: int = 1,
+                 policy: VoiceAllocation = VoiceAllocation.LRU, first_channel: int = 0):
+        """
+        :param num_regions: Number of split regions
+        :param channels_per_region: Size of the channel pool of each region. Region r uses output channels
+                                    r * channels_per_region to (r + 1) * channels_per_region - 1,
+                                    counted from `first_channel`.
+        :param policy: How a free channel is chosen from the pool
+        :param first_channel: First output channel of region 0, e.g. the first channel of an input device's
+                              block of channels when several devices share the output port.
+        """
+        if first_channel + num_regions * channels_per_region > NUM_CHANNELS:
+            raise ValueError(f'{num_regions} regions of {channels_per_region} channels don\'t fit in '
+                             f'channels {first_channel} to {NUM_CHANNELS - 1}')
+
+        self.num_regions = num_regions
+        self.channels_per_region = channels_per_region
+        self.policy = policy
+        self.first_channel = first_channel
+
+        self.__voice_of = [-1] * NUM_CHANNELS
+        """
+        Input channel -> output channel of its sounding note, or -1.
+        """
+        self.__owner = [-1] * NUM_CHANNELS
+        """
+        Output channel -> input channel of the note sounding on it, or -1.
+        """
+        self.__free: list[OrderedDict[int, None]] = [
+            OrderedDict((ch, None) for ch in self.__pool(r)) for r in range(num_regions)
+        ]
+        """
+        Free channels of each region, least recently released first.
+        """
+        self.__active: list[OrderedDict[int, None]] = [OrderedDict() for _ in range(num_regions)]
+        """
+        Channels in use in each region, oldest note first.
+        """
+        self.__next = [0] * num_regions
+        """
+        Index into the pool of each region where the next round robin search starts.
+        """
+
+    def __pool(self, region: int) -> range:
+        start = self.first_channel + region * self.channels_per_region
+        return range(start, start + self.channels_per_region)
+
+    def channels(self) -> range:
+        """
+        :return: All output channels that can be allocated
+        """
+        return range(self.first_channel, self.first_channel + self.num_regions * self.channels_per_region)
+
+    def allocate(self, in_channel: int, region: int) -> tuple[int, int]:
+        """
+        Allocates an output channel for a new note of `in_channel`. The previous note of `in_channel`
+        must have been released.
+
+        :param in_channel: The input channel of the note
+        :param region: Index of the split region of the note
+        :return: (output channel, input channel of the note that was stolen to free the channel or -1)
+        """
+        free = self.__free[region]
+        active = self.__active[region]
+        stolen = -1
+
+        if free:
+            if self.policy == VoiceAllocation.ROUND_ROBIN:
+                pool = self.__pool(region)
+                start = self.__next[region]
+                for i in range(len(pool)):
+                    idx = (start + i) % len(pool)
+                    if pool[idx] in free:
+                        out_channel = pool[idx]
+                        self.__next[region] = idx + 1
+                        break
+                del free[out_channel]
+            else:
+                out_channel, _ = free.popitem(last=False)
+        else:
+            # steal the oldest note of the region
+            out_channel, _ = active.popitem(last=False)
+            stolen = self.__owner[out_channel]
+            self.__voice_of[stolen] = -1
+
+        active[out_channel] = None
+        self.__owner[out_channel] = in_channel
+        self.__voice_of[in_channel] = out_channel
+        return out_channel, stolen
+
+    def adopt(self, in_channel: int, out_channel: int) -> bool:
+        """
+        Takes over a note that is already sounding on `out_channel`, e.g. a note held while the
+        allocator of the previous split/voice layout was replaced.
+
+        :return: False if `out_channel` isn't a channel of this allocator or is already in use.
+        """
+        if out_channel not in self.channels() or self.__owner[out_channel] != -1 \
+                or self.__voice_of[in_channel] != -1:
+            return False
+
+        region = (out_channel - self.first_channel) // self.channels_per_region
+        del self.__free[region][out_channel]
+        self.__active[region][out_channel] = None
+        self.__owner[out_channel] = in_channel
+        self.__voice_of[in_channel] = out_channel
+        return True
+
+    def release(self, in_channel: int) -> int:
+        """
+        Releases the output channel of the note of `in_channel`.
+
+        :return: The output channel the note was sounding on, or -1 if it has no channel
+                 (it was stolen, or never allocated).
+        """
+        out_channel = self.__voice_of[in_channel]
+        if out_channel == -1:
+            return -1
+
+        region = (out_channel - self.first_channel) // self.channels_per_region
+        del self.__active[region][out_channel]
+        self.__free[region][out_channel] = None
+        self.__owner[out_channel] = -1
+        self.__voice_of[in_channel] = -1
+        return out_channel
+
+    def channel_of(self, in_channel: int) -> int:
+        """
+        :return: Output channel of the note of `in_channel`, or -1 if it has none.
+        """
+        return self.__voice_of[in_channel]
+
+    def active_voices(self) -> list[tuple[int, int]]:
+        """
+        :return: (input channel, output channel) of every sounding note
+        """
+        return [(in_ch, out_ch) for in_ch, out_ch in enumerate(self.__voice_of) if out_ch != -1]
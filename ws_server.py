@@ -1,41 +1,193 @@
 """
 Websocket server for the purpose of sending out microtonal note info
 """
-import asyncio
-from asyncio import get_event_loop, new_event_loop, set_event_loop
+import queue
+import struct
+import time
 from threading import Thread
 from time import sleep
+from typing import TYPE_CHECKING, Optional
 
-import janus
-import websockets
+# asyncio, janus and websockets are only imported once the server starts, to keep startup fast
+if TYPE_CHECKING:
+    import asyncio
 
-message_queue = {}
+    import janus
+    import websockets
+
+INTAKE_QUEUE_SIZE = 4096
+"""
+Max number of batches waiting to be broadcast. Batches published while it is full are dropped,
+so that a stalled server never blocks the MIDI callback thread.
+"""
+CLIENT_QUEUE_SIZE = 1024
+"""
+Max number of batches waiting to be sent to one client. When a slow client's queue is full,
+its oldest batches are dropped.
+"""
+
+BINARY_SUBPROTOCOL = 'seaboard.binary.v1'
+"""
+Clients that offer this websocket subprotocol receive binary frames, one per batch of events
+(all events produced by one incoming MIDI message), each event packed as `EVENT_STRUCT`.
+Other clients receive the default text protocol, one `on:<edosteps>:<vel>`,
+`off:<edosteps>:<vel>` or `cc:<cc>:<value>` text frame per event.
+"""
+
+EVENT_STRUCT = struct.Struct('<BBhd')
+"""
+Binary protocol event: event type (`EVENT_*`), value (velocity or cc value),
+edosteps from A4 (cc number for cc events), timestamp in seconds (unix time). Little endian, 12 bytes.
+"""
+EVENT_NOTE_ON = 1
+EVENT_NOTE_OFF = 2
+EVENT_CC = 3
+
+_TEXT_PREFIXES = {EVENT_NOTE_ON: 'on', EVENT_NOTE_OFF: 'off', EVENT_CC: 'cc'}
+
+Batch = tuple[float, list[tuple[int, int, int]]]
+"""
+(timestamp, [(event type, edosteps or cc number, value)...])
+"""
+
+intake: Optional['janus.Queue'] = None
+"""
+Producers (the MIDI callback thread) publish each batch into this queue once, the broadcaster
+task fans it out to all clients. Created when the server starts on its own thread.
+"""
+
+clients: dict['asyncio.Queue', bool] = {}
+"""
+Outgoing frame queue of each live websocket connection -> whether it uses the binary protocol.
+"""
+
+in_loop = False
+"""
+True if the server runs on the same event loop as the MIDI handler (see `eventloop.py`), in which
+case published batches are fanned out directly instead of going through `intake`.
+"""
+
+dropped_messages = 0
 
 WS_SERVER = None
 
-async def handler(websocket: websockets.ServerConnection):
-    global message_queue
+
+def select_subprotocol(connection, subprotocols):
+    # unlike the websockets default, accept clients that don't offer any subprotocol (text protocol)
+    if BINARY_SUBPROTOCOL in subprotocols:
+        return BINARY_SUBPROTOCOL
+    return None
+
+
+def encode_text(batch: Batch) -> list[str]:
+    return [f'{_TEXT_PREFIXES[event_type]}:{a}:{b}' for event_type, a, b in batch[1]]
+
+
+def encode_binary(batch: Batch) -> list[bytes]:
+    timestamp, events = batch
+    frame = bytearray(EVENT_STRUCT.size * len(events))
+    for i, (event_type, a, b) in enumerate(events):
+        EVENT_STRUCT.pack_into(frame, i * EVENT_STRUCT.size, event_type, b, a, timestamp)
+    return [bytes(frame)]
+
+
+async def handler(websocket: 'websockets.ServerConnection'):
+    import asyncio
+    import websockets
+
     await websocket.send('hello')
 
-    print('new connection')
-    q = janus.Queue()
-    message_queue['sync'] = q.sync_q
-    message_queue['async'] = q.async_q
+    binary = websocket.subprotocol == BINARY_SUBPROTOCOL
+    print(f'new connection{" (binary protocol)" if binary else ""}')
+    q = asyncio.Queue(CLIENT_QUEUE_SIZE)
+    clients[q] = binary
+
+    async def send_messages():
+        try:
+            while True:
+                for frame in await q.get():
+                    await websocket.send(frame)
+        except websockets.ConnectionClosed:
+            pass
 
+    sender = asyncio.create_task(send_messages())
+    try:
+        # stop feeding this client as soon as it disconnects, not only when the next send fails
+        await websocket.wait_closed()
+    finally:
+        clients.pop(q, None)
+        sender.cancel()
+        print('connection closed')
+
+
+def fan_out(batch: Batch):
+    """
+    Queues a published batch for all live clients. Each batch is encoded at most once per protocol.
+    Must be called on the server's event loop.
+    """
+    global dropped_messages
+    text_frames = None
+    binary_frames = None
+    for q, binary in clients.items():
+        if binary:
+            if binary_frames is None:
+                binary_frames = encode_binary(batch)
+            frames = binary_frames
+        else:
+            if text_frames is None:
+                text_frames = encode_text(batch)
+            frames = text_frames
+
+        if q.full():
+            q.get_nowait()
+            dropped_messages += 1
+        q.put_nowait(frames)
+
+
+async def broadcast(intake_q: 'janus.AsyncQueue'):
+    """
+    Fans out every batch published from other threads to all live clients.
+    """
     while True:
-        message = await message_queue['async'].get()
-        await websocket.send(message)
+        fan_out(await intake_q.get())
 
-def start_ws_server():
-    global WS_SERVER
-    print('starting websocket server at 127.0.0.1:8765')
 
+async def serve(use_intake=True):
+    """
+    Runs the websocket server on the current event loop.
 
-    async def server():
-        global WS_SERVER
-        WS_SERVER = websockets.serve(handler, "localhost", 8765)
-        async with WS_SERVER as server:
-            await server.serve_forever()
+    :param use_intake: Whether batches are published from another thread through the `intake` queue.
+                       If False, `publish` must only be called on this event loop.
+    """
+    import asyncio
+    import janus
+    import websockets
+
+    global WS_SERVER, intake, in_loop
+    broadcaster = None
+    if use_intake:
+        intake = janus.Queue(INTAKE_QUEUE_SIZE)
+        broadcaster = asyncio.create_task(broadcast(intake.async_q))
+    else:
+        in_loop = True
+
+    WS_SERVER = websockets.serve(
+        handler,
+        "localhost",
+        8765,
+        subprotocols=[BINARY_SUBPROTOCOL],
+        select_subprotocol=select_subprotocol,
+    )
+    async with WS_SERVER as server:
+        await server.serve_forever()
+
+    in_loop = False
+    if broadcaster is not None:
+        broadcaster.cancel()
+
+
+def start_ws_server():
+    print('starting websocket server at 127.0.0.1:8765')
 
     def ws_thread():
         # This used to work, not anymore.
@@ -44,25 +196,73 @@ def start_ws_server():
         # server_coroutine = websockets.serve(handler, '127.0.0.1', 8765, loop=WS_EVENT_LOOP)
         # WS_EVENT_LOOP.run_until_complete(server_coroutine)
         # WS_EVENT_LOOP.run_forever()
-        asyncio.run(server())
+        import asyncio
+        asyncio.run(serve())
 
     Thread(target=ws_thread).start()
 
 
-def send_note_on(edosteps_from_a4, velocity):
-    if 'sync' in message_queue:
-        message_queue['sync'].put(f'on:{edosteps_from_a4}:{velocity}')
+def publish(batch: Batch):
+    """
+    Publish a batch of events to all connected clients. Never blocks, drops the batch if the server is backed up.
+    """
+    global dropped_messages
+    if not clients:
+        return
+    if in_loop:
+        fan_out(batch)
+        return
+    if intake is None:
+        return
+    try:
+        intake.sync_q.put_nowait(batch)
+    except queue.Full:
+        dropped_messages += 1
+
+
+class Publisher:
+    """
+    Collects the events produced while handling one incoming MIDI message, to publish them as one
+    batch. Each input handler has its own, so that handlers on different threads don't mix up
+    their batches.
+    """
+    __slots__ = ('pending',)
+
+    def __init__(self):
+        self.pending: list[tuple[int, int, int]] = []
+        """
+        Events produced since the last `flush`.
+        """
+
+    def flush(self, timestamp: float):
+        """
+        Publish all events produced since the last flush as one batch. Called at the end of
+        handling each message.
+
+        :param timestamp: Time the events were produced at (unix time)
+        """
+        if self.pending:
+            events = self.pending
+            self.pending = []
+            publish((timestamp, events))
+
+    def send_note_on(self, edosteps_from_a4, velocity):
+        self.pending.append((EVENT_NOTE_ON, edosteps_from_a4, velocity))
 
+    def send_note_off(self, edosteps_from_a4, velocity):
+        self.pending.append((EVENT_NOTE_OFF, edosteps_from_a4, velocity))
 
-def send_note_off(edosteps_from_a4, velocity):
-    if 'sync' in message_queue:
-        message_queue['sync'].put(f'off:{edosteps_from_a4}:{velocity}')
+    def send_cc(self, cc, value):
+        # assumes single channel mode so channel doesn't matter-
+        self.pending.append((EVENT_CC, cc, value))
 
 
-def send_cc(cc, value):
-    # assumes single channel mode so channel doesn't matter-
-    if 'sync' in message_queue:
-        message_queue['sync'].put(f'cc:{cc}:{value}')
+def send_cc_now(cc, value):
+    """
+    Publish a cc event immediately as its own batch. For deferred actions, which run outside of
+    the handling of a MIDI message.
+    """
+    publish((time.time(), [(EVENT_CC, cc, value)]))
 
 
 if __name__ == '__main__':
@@ -71,11 +271,13 @@ if __name__ == '__main__':
 
     sleep(1)
 
+    publisher = Publisher()
     count = 0
     while True:
         print('ping sent')
-        send_note_on(0, count)
-        send_note_off(0, count)
-        send_cc(64, count)
+        publisher.send_note_on(0, count)
+        publisher.send_note_off(0, count)
+        publisher.send_cc(64, count)
+        publisher.flush(time.time())
         count += 1
         sleep(1)